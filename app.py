@@ -1,31 +1,108 @@
+from services import perf
+
+_script_started = perf.script_started()
+
 import streamlit as st
-import requests
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import json
 import os
-import zipfile
 from io import BytesIO
-from PIL import Image
-import replicate
-import base64
 import re
+import random
 import asyncio
-import aiohttp
+import functools
+import time
+
+from components.asset_browser import display_asset_browser
+from components.results_view import display_results
+from components.workflow_manager import manage_workflow
+from services import providers
+from services.blobs import get_blob_dir
+from services.catalog import get_catalog, thumbnail
+from services.content_store import externalize, get_content_store, resolve
+from services.audio import process_music
+from services.export import optimize_images
+from services.hedging import get_hedger
+from services.incremental import IncrementalPlan, fingerprint
+from services.metrics import ACTIVE_JOBS, DOWNLOADED_BYTES, ZIP_BUILD_SECONDS, log_event, logged_call, start_http_server
+from services.phash import PERTURBATIONS, HashIndex, hash_images, phash
+from services.refinement import PREVIEW_MODEL, REFINEMENT_POLL, REFINEMENT_WEIGHT, Refiner
+from services.providers import CHAT_MODELS, IMAGE_MODELS, ProviderError
+from services.router import (
+    DEFAULT_TASK_PROFILE,
+    ROUTING_MODES,
+    TASK_PROFILES,
+    PlanReport,
+    current_report,
+    estimate_cost,
+    estimate_tokens,
+    get_router,
+)
+from services.scheduler import PROVIDER_NAMES, SPECULATIVE_WEIGHT, Flow, current_flow, get_scheduler
+from services.singleflight import get_single_flight
+from services.speculation import MIN_PROMPT_CHARS, SPECULATIVE_ELEMENTS, SpeculativeCall, Speculator
+from services.sprites import build_atlases, should_slice
+from services.task_queue import get_task_queue
+from services.tasks import QUEUE_ENABLED, dispatch
+from services.textures import is_texture, process_textures
+from services.workers import get_process_pool
+from services.prompts import (
+    IMAGE_TYPES,
+    SCRIPT_TYPES,
+    build_image_requests,
+    build_script_requests,
+    element_prompt,
+    music_prompt,
+    system_prompt,
+)
+
+# Heavy provider SDKs (replicate, aiohttp, PIL, requests, zipfile) are imported
+# inside the functions that use them (see services/providers.py) so a cold start only pays for what the
+# current run actually touches.
 
 # Constants
-CHAT_API_URL = "https://api.openai.com/v1/chat/completions"
-DALLE_API_URL = "https://api.openai.com/v1/images/generations"
 API_KEY_FILE = "api_keys.json"
+STYLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "styles", "style.css")
+
+# Load API keys from a file (cached per process, cleared on save)
+@st.cache_data(show_spinner=False)
+def load_api_keys():
+    if os.path.exists(API_KEY_FILE):
+        with open(API_KEY_FILE, 'r') as file:
+            data = json.load(file)
+            return data.get('openai'), data.get('replicate')
+    return None, None
+
+# Save API keys to a file
+def save_api_keys(openai_key, replicate_key):
+    with open(API_KEY_FILE, 'w') as file:
+        json.dump({"openai": openai_key, "replicate": replicate_key}, file)
+    load_api_keys.clear()
+
+# Read the stylesheet once per process
+@st.cache_resource(show_spinner=False)
+def load_css(path):
+    with open(path, 'r') as file:
+        return file.read()
+
+# Serve Prometheus metrics on localhost once per process
+@st.cache_resource(show_spinner=False)
+def start_metrics_server():
+    return start_http_server()
+
+start_metrics_server()
 
 # Initialize session state
 if 'api_keys' not in st.session_state:
-    st.session_state.api_keys = {'openai': None, 'replicate': None}
+    openai_key, replicate_key = load_api_keys()
+    st.session_state.api_keys = {'openai': openai_key, 'replicate': replicate_key}
 
 if 'customization' not in st.session_state:
     st.session_state.customization = {
-        'image_types': ['Character', 'Enemy', 'Background', 'Object', 'Texture', 'Sprite', 'UI'],
-        'script_types': ['Player', 'Enemy', 'Game Object', 'Level Background'],
-        'image_count': {t: 0 for t in ['Character', 'Enemy', 'Background', 'Object', 'Texture', 'Sprite', 'UI']},
-        'script_count': {t: 0 for t in ['Player', 'Enemy', 'Game Object', 'Level Background']},
+        'image_types': list(IMAGE_TYPES),
+        'script_types': list(SCRIPT_TYPES),
+        'image_count': {t: 0 for t in IMAGE_TYPES},
+        'script_count': {t: 0 for t in SCRIPT_TYPES},
         'use_replicate': {'generate_music': False},
         'code_types': {'unity': False, 'unreal': False, 'blender': False},
         'generate_elements': {
@@ -41,181 +118,168 @@ if 'customization' not in st.session_state:
         'image_model': 'dall-e-3',
         'chat_model': 'gpt-4',
         'code_model': 'gpt-4',
+        'reliability': {
+            'hedging': False,
+            'hedge_percentile': 90,
+            'image_fallback': None,
+            'chat_fallback': None,
+        },
+        'routing': {
+            'mode': 'off',
+            'latency_budget': 0,
+        },
+        'speculation': {
+            'enabled': False,
+        },
+        'refinement': {
+            'enabled': False,
+        },
+        'export': {
+            'sprite_atlases': True,
+            'texture_check': True,
+            'optimize_images': True,
+            'downscale': True,
+            'webp': False,
+            'avif': False,
+        },
+        'dedup': {
+            'mode': 'regenerate',
+            'library': False,
+        },
     }
 
-# Load API keys from a file
-def load_api_keys():
-    if os.path.exists(API_KEY_FILE):
-        with open(API_KEY_FILE, 'r') as file:
-            data = json.load(file)
-            return data.get('openai'), data.get('replicate')
-    return None, None
+# Hedging/failover settings from the customization
+def reliability_options(kind):
+    reliability = st.session_state.customization.get('reliability', {})
+    hedge_pct = reliability.get('hedge_percentile') if reliability.get('hedging') else None
+    return reliability.get(f'{kind}_fallback'), hedge_pct
 
-# Save API keys to a file
-def save_api_keys(openai_key, replicate_key):
-    with open(API_KEY_FILE, 'w') as file:
-        json.dump({"openai": openai_key, "replicate": replicate_key}, file)
-
-# Get headers for OpenAI API
-def get_openai_headers():
-    return {
-        "Authorization": f"Bearer {st.session_state.api_keys['openai']}",
-        "Content-Type": "application/json"
-    }
+# Chat models usable with the saved keys and not behind an open circuit
+def available_chat_models():
+    keys = st.session_state.api_keys
+    models = [m for m in CHAT_MODELS if keys.get(providers.provider_for(m))]
+    return [m for m in models if get_hedger().breaker(m).allows()]
 
 # Generate content using selected chat model
-async def generate_content(prompt, role):
-    if st.session_state.customization['chat_model'] in ['gpt-4', 'gpt-3.5-turbo']:
-        data = {
-            "model": st.session_state.customization['chat_model'],
-            "messages": [
-                {"role": "system", "content": f"You are a highly skilled assistant specializing in {role}. Provide detailed, creative, and well-structured responses optimized for game development."},
-                {"role": "user", "content": prompt}
-            ]
-        }
-
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(CHAT_API_URL, headers=get_openai_headers(), json=data) as response:
-                    response_data = await response.json()
-                    if "choices" not in response_data:
-                        error_message = response_data.get("error", {}).get("message", "Unknown error")
-                        return f"Error: {error_message}"
-
-                    content_text = response_data["choices"][0]["message"]["content"]
-                    return content_text
-
-        except Exception as e:
-            return f"Error: Unable to communicate with the OpenAI API: {str(e)}"
-    elif st.session_state.customization['chat_model'] == 'llama':
-        try:
-            client = replicate.Client(api_token=st.session_state.api_keys['replicate'])
-            output = client.run(
-                "meta/llama-2-70b-chat",
-                input={
-                    "prompt": f"You are a highly skilled assistant specializing in {role}. Provide detailed, creative, and well-structured responses optimized for game development.\n\n{prompt}\n\n",
-                    "temperature": 0.75,
-                    "top_p": 0.9,
-                    "max_length": 500,
-                    "repetition_penalty": 1
-                }
-            )
-            return ''.join(output)
-        except Exception as e:
-            return f"Error: Unable to generate content using Llama: {str(e)}"
-    else:
-        return "Error: Invalid chat model selected."
-
-# Generate images using selected image model
-async def generate_image(prompt, size, steps=25, guidance=3.0, interval=2.0):
-    if st.session_state.customization['image_model'] == 'dall-e-3':
-        data = {
-            "model": "dall-e-3",
-            "prompt": prompt,
-            "size": f"{size[0]}x{size[1]}",
-            "n": 1,
-            "response_format": "url"
-        }
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(DALLE_API_URL, headers=get_openai_headers(), json=data) as response:
-                    response_data = await response.json()
-                    if "data" not in response_data:
-                        error_message = response_data.get("error", {}).get("message", "Unknown error")
-                        return f"Error: {error_message}"
-                    if not response_data["data"]:
-                        return "Error: No data returned from API."
-                    return response_data["data"][0]["url"]
-        except Exception as e:
-            return f"Error: Unable to generate image: {str(e)}"
-    elif st.session_state.customization['image_model'] == 'SD Flux-1':
+# `task` names the element or script type for routing; `model` overrides the chat model
+async def generate_content(prompt, role, task=None, model=None):
+    customization = st.session_state.customization
+    routing = customization.get('routing', {})
+    fallback, hedge_pct = reliability_options('chat')
+    system = system_prompt(role)
+    chosen = get_router().choose(
+        task, prompt, routing.get('mode', 'off'), model or customization['chat_model'],
+        available_chat_models(), routing.get('latency_budget') or None
+    )
+    payload = {'task': task, 'model': chosen, 'fallback': fallback, 'hedge_pct': hedge_pct,
+               'system': system, 'prompt': prompt}
+    with logged_call('generate_content', task=task, model=chosen) as log:
         try:
-            width, height = size
-            aspect_ratio = f"{width}:{height}"
-
-            client = replicate.Client(api_token=st.session_state.api_keys['replicate'])
-
-            output = client.run(
-                "black-forest-labs/flux-pro",
-                input={
-                    "prompt": prompt,
-                    "aspect_ratio": aspect_ratio,
-                    "steps": steps,
-                    "guidance": guidance,
-                    "interval": interval,
-                    "safety_tolerance": 2,
-                    "output_format": "png",
-                    "output_quality": 100
-                }
-            )
-            return output
-        except Exception as e:
-            return f"Error: Unable to generate image using SD Flux-1: {str(e)}"
-    elif st.session_state.customization['image_model'] == 'SDXL Lightning':
+            return await dispatch('chat', payload, st.session_state.api_keys)
+        except ProviderError as e:
+            log.fields.update(outcome='error', error=str(e))
+            return f"Error: {str(e)}"
+
+# Fair-share scheduling flow of this browser session
+def session_flow(weight=1.0):
+    ctx = get_script_run_ctx()
+    return Flow(ctx.session_id if ctx else 'default', weight)
+
+# Chat call made in the background for speculation; runs outside the script,
+# so it takes its keys, models and scheduling flow explicitly.
+# Returns the text and the call's report.
+async def speculate_content(api_keys, prompt, task, model, fallback, flow):
+    report = PlanReport()
+    current_report.set(report)
+    current_flow.set(flow)
+    payload = {'task': task, 'model': model, 'fallback': fallback, 'system': system_prompt("game design"),
+               'prompt': prompt}
+    with logged_call('speculate_content', task=task, model=model):
+        return await dispatch('chat', payload, api_keys), report
+
+# Speculative calls for the concept elements of `user_prompt`, keyed by the
+# inputs the incremental planner fingerprints. Elements the last plan can
+# reuse as they are need no speculation.
+def speculative_calls(user_prompt):
+    customization = st.session_state.customization
+    chat_model = customization['chat_model']
+    routing = customization.get('routing', {})
+    routing_mode = routing.get('mode', 'off')
+    fallback, _ = reliability_options('chat')
+    previous_inputs = st.session_state.get('plan_inputs') or {}
+    flow = Flow(f"{session_flow().id}:speculative", SPECULATIVE_WEIGHT)
+    calls = []
+    for element in SPECULATIVE_ELEMENTS:
+        inputs = (user_prompt, chat_model, routing_mode)
+        if not customization['generate_elements'].get(element) or previous_inputs.get(element) == fingerprint(*inputs):
+            continue
+        prompt = element_prompt(element, user_prompt)
+        model = get_router().choose(element, prompt, routing_mode, chat_model, available_chat_models(),
+                                    routing.get('latency_budget') or None)
+        if not st.session_state.api_keys.get(providers.provider_for(model)):
+            continue
+        output_tokens = TASK_PROFILES.get(element, DEFAULT_TASK_PROFILE)[1]
+        cost = estimate_cost(model, estimate_tokens(prompt, model), output_tokens)
+        start = functools.partial(speculate_content, dict(st.session_state.api_keys), prompt, element, model, fallback, flow)
+        calls.append(SpeculativeCall(element, fingerprint(element, *inputs), start, cost))
+    return calls
+
+# Adopt a speculated result for one element; None when there is none or it failed
+async def speculated_content(speculator, element, inputs, report):
+    future = speculator.take(element, fingerprint(element, *inputs))
+    if future is None:
+        return None
+    try:
+        content, speculative_report = await asyncio.wrap_future(future)
+    except Exception:
+        return None
+    report.merge(speculative_report)
+    return content
+
+# Whether images are previewed with PREVIEW_MODEL, then refined with the selected model
+def refining_images(customization):
+    return customization['refinement']['enabled'] and customization['image_model'] != PREVIEW_MODEL
+
+# Whether image `name` is previewed. Tiling textures are not: their tiling
+# check, seam fix and mips are made from the image that ships.
+def previews_image(customization, name):
+    return refining_images(customization) and not is_texture(name)
+
+# Generate images using selected image model, or the preview model for previews
+async def generate_image(prompt, size, steps=25, guidance=3.0, interval=2.0, preview=False):
+    fallback, hedge_pct = reliability_options('image')
+    customization = st.session_state.customization
+    model = PREVIEW_MODEL if preview else customization['image_model']
+    payload = {'model': model, 'fallback': fallback, 'hedge_pct': hedge_pct, 'prompt': prompt, 'size': list(size),
+               'steps': steps, 'guidance': guidance, 'interval': interval}
+    with logged_call('generate_image', model=model, size=f"{size[0]}x{size[1]}") as log:
         try:
-            client = replicate.Client(api_token=st.session_state.api_keys['replicate'])
-            output = client.run(
-                "bytedance/sdxl-lightning-4step",
-                input={"prompt": prompt}
-            )
-            return output[0] if output else None
-        except Exception as e:
-            return f"Error: Unable to generate image using SDXL Lightning: {str(e)}"
-    else:
-        return "Error: Invalid image model selected."
+            return await dispatch('image', payload, st.session_state.api_keys)
+        except ProviderError as e:
+            log.fields.update(outcome='error', error=str(e))
+            return f"Error: {str(e)}"
 
 # Generate music using Replicate's MusicGen
 async def generate_music(prompt):
-    try:
-        client = replicate.Client(api_token=st.session_state.api_keys['replicate'])
-        output = client.run(
-            "meta/musicgen",
-            input={
-                "prompt": prompt,
-                "model_version": "stereo-large",
-                "output_format": "mp3",
-                "normalization_strategy": "peak"
-            }
-        )
-        if isinstance(output, str) and output.startswith("http"):
-            return output
-        else:
+    with logged_call('generate_music', model=providers.MUSICGEN_MODEL) as log:
+        try:
+            return await dispatch('music', {'prompt': prompt}, st.session_state.api_keys)
+        except ProviderError as e:
+            log.fields.update(outcome='error', error=str(e))
+            st.error(f"Error: {str(e)}")
             return None
-    except Exception as e:
-        st.error(f"Error: Unable to generate music: {str(e)}")
-        return None
 
 # Generate multiple images based on customization settings
-async def generate_images(customization, game_concept):
+# When `only` is given, just those image names are generated
+async def generate_images(customization, game_concept, only=None):
     images = {}
 
-    image_prompts = {
-        'Character': "Create a highly detailed, front-facing character concept art for a 2D game...",
-        'Enemy': "Design a menacing, front-facing enemy character concept art for a 2D game...",
-        'Background': "Create a wide, highly detailed background image for a level of the game...",
-        'Object': "Create a detailed object image for a 2D game...",
-        'Texture': "Generate a seamless texture pattern...",
-        'Sprite': "Create a game sprite sheet with multiple animation frames...",
-        'UI': "Design a cohesive set of user interface elements for a 2D game..."
-    }
-
-    sizes = {
-        'Character': (1024, 1024),
-        'Enemy': (1024, 1024),
-        'Background': (1920, 1080),
-        'Object': (512, 512),
-        'Texture': (512, 512),
-        'Sprite': (1024, 1024),
-        'UI': (1024, 1024)
-    }
-
     tasks = []
-    for img_type in customization['image_types']:
-        for i in range(customization['image_count'].get(img_type, 0)):
-            prompt = f"{image_prompts[img_type]} The design should fit the following game concept: {game_concept}. Variation {i + 1}"
-            size = sizes[img_type]
-            task = asyncio.create_task(generate_image(prompt, size))
-            tasks.append((task, f"{img_type.lower()}_image_{i + 1}"))
+    for img_name, (prompt, size) in build_image_requests(customization, game_concept).items():
+        if only is not None and img_name not in only:
+            continue
+        task = asyncio.create_task(generate_image(prompt, size, preview=previews_image(customization, img_name)))
+        tasks.append((task, img_name))
 
     for task, img_name in tasks:
         image_url = await task
@@ -224,39 +288,18 @@ async def generate_images(customization, game_concept):
     return images
 
 # Generate scripts based on customization settings and code types
-async def generate_scripts(customization, game_concept):
-    script_descriptions = {
-        'Player': "Create a comprehensive player character script for a 2D game. Include movement, input handling, and basic interactions.",
-        'Enemy': "Develop a detailed enemy AI script for a 2D game. Include patrolling, player detection, and attack behaviors.",
-        'Game Object': "Script a versatile game object that can be interacted with, collected, or activated by the player.",
-        'Level Background': "Create a script to manage the level background in a 2D game, including parallax scrolling if applicable."
-    }
-
+# When `only` is given, just those script names are generated
+async def generate_scripts(customization, game_concept, only=None):
     scripts = {}
-    selected_code_types = customization['code_types']
-    code_model = customization['code_model']
 
     tasks = []
-    for script_type in customization['script_types']:
-        for i in range(customization['script_count'].get(script_type, 0)):
-            for code_type, selected in selected_code_types.items():
-                if selected:
-                    if code_type == 'unity':
-                        lang = 'csharp'
-                        file_ext = '.cs'
-                    elif code_type == 'unreal':
-                        lang = 'cpp'
-                        file_ext = '.cpp'
-                    elif code_type == 'blender':
-                        lang = 'python'
-                        file_ext = '.py'
-                    else:
-                        continue  # Skip if it's an unknown code type
-
-                    desc = f"{script_descriptions[script_type]} The script should be for {code_type.capitalize()}. Generate ONLY the code, without any explanations or comments outside the code. Ensure the code is complete and can be directly used in a project."
-
-                    task = asyncio.create_task(generate_content(desc, "game development"))
-                    tasks.append((task, f"{script_type.lower()}_{code_type}_script_{i + 1}{file_ext}"))
+    for script_name, (script_type, desc) in build_script_requests(customization).items():
+        if only is not None and script_name not in only:
+            continue
+        task = asyncio.create_task(generate_content(
+            desc, "game development", task=f"script:{script_type}", model=customization['code_model']
+        ))
+        tasks.append((task, script_name))
 
     for task, script_name in tasks:
         script_code = await task
@@ -270,13 +313,171 @@ async def generate_scripts(customization, game_concept):
 
     return scripts
 
+# Download asset URLs concurrently, reusing bytes already fetched for this plan
+async def fetch_assets(urls, downloaded):
+    missing = [url for url in dict.fromkeys(urls) if url not in downloaded]
+    bodies = await asyncio.gather(*(providers.fetch_bytes(url) for url in missing), return_exceptions=True)
+    for url, body in zip(missing, bodies):
+        if isinstance(body, bytes):
+            downloaded[url] = body
+    return {url: downloaded[url] for url in urls if url in downloaded}
+
+# Replace or drop newly generated images that are near-duplicates (by pHash)
+# of other images in the plan or, optionally, in the asset library.
+# Returns {image name: {'match', 'distance', 'action'}} for every duplicate found.
+async def dedupe_images(customization, game_concept, images, pending, downloaded):
+    settings = customization['dedup']
+    if settings['mode'] == 'keep' or not pending:
+        return {}
+    catalog = get_catalog() if settings['library'] else None
+    requests_by_name = build_image_requests(customization, game_concept)
+
+    async def hash_urls(names):
+        urls = {name: images[name] for name in names if isinstance(images[name], str) and images[name].startswith('http')}
+        fetched = await fetch_assets(urls.values(), downloaded)
+        return await asyncio.to_thread(hash_images, {name: fetched[url] for name, url in urls.items() if url in fetched})
+
+    hashes = await hash_urls(images)
+    index = HashIndex()
+    for name in images:
+        if name not in pending and name in hashes:
+            index.add(name, hashes[name])
+
+    duplicates = {}
+    candidates = [name for name in images if name in pending]
+    for attempt in range(len(PERTURBATIONS) + 1):
+        regenerate = []
+        for name in candidates:
+            if name not in hashes:
+                continue
+            matches = index.query(hashes[name])
+            if not matches and catalog is not None:
+                matches = [(f"library asset #{asset_id}", distance) for asset_id, distance in catalog.similar_images(hashes[name])]
+            if not matches:
+                index.add(name, hashes[name])
+                continue
+            match, distance = matches[0]
+            if settings['mode'] == 'drop' or attempt == len(PERTURBATIONS):
+                duplicates[name] = {'match': match, 'distance': distance, 'action': 'dropped'}
+                del images[name]
+            else:
+                duplicates[name] = {'match': match, 'distance': distance, 'action': 'regenerated'}
+                regenerate.append(name)
+        if not regenerate:
+            break
+
+        # Regenerate with a prompt perturbation and a fresh seed phrase
+        retries = []
+        for name in regenerate:
+            prompt, size = requests_by_name[name]
+            retries.append(generate_image(f"{prompt} {PERTURBATIONS[attempt]} Variation seed {random.randrange(10 ** 6)}.", size,
+                                          preview=previews_image(customization, name)))
+        for name, url in zip(regenerate, await asyncio.gather(*retries)):
+            images[name] = url
+        hashes.update(await hash_urls(regenerate))
+        candidates = regenerate
+    return duplicates
+
+# Validate texture images: near misses are fixed, failures are regenerated
+# once with a tiling hint and flagged if they still do not tile.
+# Returns {image name: report entry}; fixed images and mips go to the blob store.
+async def check_textures(customization, game_concept, images, previous_report, downloaded):
+    report = {}
+    todo = {}
+    for name, url in images.items():
+        if not is_texture(name) or not (isinstance(url, str) and url.startswith('http')):
+            continue
+        if (previous_report.get(name) or {}).get('url') == url:
+            report[name] = previous_report[name]
+        else:
+            todo[name] = url
+
+    requests_by_name = build_image_requests(customization, game_concept)
+    for attempt in range(2):
+        if not todo:
+            break
+        fetched = await fetch_assets(todo.values(), downloaded)
+        data = {name: fetched[url] for name, url in todo.items() if url in fetched}
+        results = await asyncio.to_thread(process_textures, data)
+
+        retry = {}
+        blobs = get_blob_dir()
+        for name, result in results.items():
+            entry = {'url': todo[name], 'status': result['status'], 'seam': result['seam'], 'smooth': result['smooth']}
+            if 'error' in result:
+                entry['error'] = result['error']
+            if result['status'] != 'failed':
+                entry['image'] = blobs.put(result['image'])
+                entry['mips'] = {size: blobs.put(png) for size, png in result['mips'].items()}
+            elif attempt == 0:
+                prompt, size = requests_by_name[name]
+                retry[name] = generate_image(f"{prompt} The texture must tile seamlessly on every edge.", size)
+            report[name] = entry
+
+        todo = {}
+        for name, url in zip(retry, await asyncio.gather(*retry.values())):
+            if isinstance(url, str) and url.startswith('http'):
+                images[name] = url
+                todo[name] = url
+    return report
+
+# Download a generated track once into the blob store, for local playback and
+# export, and compute its waveform peaks and seamless loop in the process pool.
+# Returns the plan's 'music_audio' entry; `previous` is reused for the same URL.
+async def prepare_music(url, previous, downloaded):
+    blobs = get_blob_dir()
+    if previous.get('url') == url and previous.get('audio') and blobs.exists(previous['audio']):
+        downloaded.setdefault(url, blobs.get(previous['audio']))
+        return previous
+    entry = {'url': url}
+    fetched = await fetch_assets([url], downloaded)
+    if url not in fetched:
+        entry['error'] = "Unable to download the music."
+        return entry
+    entry['audio'] = blobs.put(fetched[url])
+    result = await asyncio.wrap_future(get_process_pool().submit(process_music, fetched[url]))
+    if 'error' in result:
+        entry['error'] = result['error']
+        return entry
+    entry.update(duration=result['duration'], peaks=result['peaks'], loop=result['loop'],
+                 loop_audio=blobs.put(result['loop_wav']))
+    return entry
+
+# Show where this session's waiting provider calls are in the shared queue
+async def report_queue_position(placeholder, flow_id, interval=0.5):
+    shown = None
+    while True:
+        position = get_scheduler().position(flow_id)
+        if position != shown:
+            if position:
+                placeholder.caption(f"⏳ Other plans are using the shared API keys: position {position} in the queue")
+            else:
+                placeholder.empty()
+            shown = position
+        await asyncio.sleep(interval)
+
 # Generate a complete game plan
-async def generate_game_plan(user_prompt, customization):
+# `previous` holds the last plan and its input fingerprints; results whose
+# inputs did not change are carried over instead of regenerated.
+# `downloaded` collects asset bytes fetched during post-processing (URL -> bytes).
+# `speculator` holds concept elements generated while the form was filled in.
+async def generate_game_plan(user_prompt, customization, previous=None, downloaded=None, speculator=None):
     game_plan = {}
+    previous = previous or {}
+    downloaded = {} if downloaded is None else downloaded
+    tracker = IncrementalPlan(previous.get('plan'), previous.get('inputs'))
+    chat_model = customization['chat_model']
+    routing_mode = customization.get('routing', {}).get('mode', 'off')
+    report = PlanReport()
+    current_report.set(report)
+    flow = session_flow()
+    current_flow.set(flow)
 
     # Status updates
     status = st.empty()
     progress_bar = st.progress(0)
+    queue_note = st.empty()
+    queue_task = asyncio.create_task(report_queue_position(queue_note, flow.id))
 
     def update_status(message, progress):
         status.text(message)
@@ -290,48 +491,466 @@ async def generate_game_plan(user_prompt, customization):
 
     for element, should_generate in elements_to_generate.items():
         if should_generate:
-            update_status(f"Generating {element.replace('_', ' ')}...", current_progress)
-            content = await generate_content(f"Create a detailed {element.replace('_', ' ')} for the following game concept: {user_prompt}", "game design")
+            reused, content = tracker.check(None, element, user_prompt, chat_model, routing_mode)
+            if not reused:
+                update_status(f"Generating {element.replace('_', ' ')}...", current_progress)
+                content = None
+                if speculator is not None and element in SPECULATIVE_ELEMENTS:
+                    content = await speculated_content(speculator, element, (user_prompt, chat_model, routing_mode), report)
+                if content is None:
+                    content = await generate_content(element_prompt(element, user_prompt), "game design", task=element)
             game_plan[element] = content
             current_progress += progress_increment
 
+    if speculator is not None:
+        speculator.cancel_all()  # leftovers were speculated for an earlier idea
+    game_concept = game_plan.get('game_concept', '')
+
     # Generate images
     if any(customization['image_count'].values()):
-        update_status("Generating game images...", 0.7)
-        game_plan['images'] = await generate_images(customization, game_plan.get('game_concept', ''))
+        images = {}
+        pending = set()
+        for img_name, (prompt, size) in build_image_requests(customization, game_concept).items():
+            reused, image_url = tracker.check('images', img_name, prompt, size, customization['image_model'])
+            if reused:
+                images[img_name] = image_url
+            else:
+                pending.add(img_name)
+        if pending:
+            update_status(f"Generating {len(pending)} game images...", 0.7)
+            images.update(await generate_images(customization, game_concept, only=pending))
+        game_plan['images'] = images
+
+        # Replace near-duplicate variations
+        if pending and customization['dedup']['mode'] != 'keep':
+            update_status("Checking images for near-duplicates...", 0.75)
+            duplicates = await dedupe_images(customization, game_concept, images, pending, downloaded)
+            for name, entry in duplicates.items():
+                if entry['action'] == 'dropped':
+                    tracker.invalidate('images', name)
+            if duplicates:
+                game_plan['duplicates'] = duplicates
+
+        # Check textures tile seamlessly
+        if customization['export']['texture_check'] and any(is_texture(name) for name in images):
+            update_status("Checking textures tile seamlessly...", 0.8)
+            textures = await check_textures(customization, game_concept, images, tracker.previous_plan.get('textures') or {}, downloaded)
+            for name, entry in textures.items():
+                if entry['status'] == 'failed':
+                    tracker.invalidate('images', name)  # Regenerate on the next submit
+            game_plan['textures'] = textures
 
     # Generate scripts
     if any(customization['script_count'].values()):
-        update_status("Writing game scripts...", 0.85)
-        game_plan['scripts'] = await generate_scripts(customization, game_plan.get('game_concept', ''))
+        scripts = {}
+        pending = set()
+        for script_name, (script_type, desc) in build_script_requests(customization).items():
+            reused, script_code = tracker.check('scripts', script_name, desc, customization['code_model'], routing_mode)
+            if reused:
+                scripts[script_name] = script_code
+            else:
+                pending.add(script_name)
+        if pending:
+            update_status(f"Writing {len(pending)} game scripts...", 0.85)
+            scripts.update(await generate_scripts(customization, game_concept, only=pending))
+        game_plan['scripts'] = scripts
 
     # Optional: Generate music
     if customization['use_replicate']['generate_music']:
-        update_status("Composing background music...", 0.95)
-        music_prompt = f"Create background music for the game: {game_plan.get('game_concept', '')}"
-        game_plan['music'] = await generate_music(music_prompt)
-
-    update_status("Game plan generation complete!", 1.0)
+        prompt = music_prompt(game_concept)
+        reused, music_url = tracker.check(None, 'music', prompt)
+        if not reused:
+            update_status("Composing background music...", 0.95)
+            music_url = await generate_music(prompt)
+        game_plan['music'] = music_url
+        if isinstance(music_url, str) and music_url.startswith('http'):
+            update_status("Preparing the music loop...", 0.97)
+            game_plan['music_audio'] = await prepare_music(music_url, tracker.previous_plan.get('music_audio') or {}, downloaded)
+
+    queue_task.cancel()  # asyncio.run cancels it too if generation fails
+    queue_note.empty()
+    if tracker.reused:
+        update_status(f"Game plan generation complete! Reused {len(tracker.reused)} unchanged results.", 1.0)
+    else:
+        update_status("Game plan generation complete!", 1.0)
 
+    st.session_state['plan_inputs'] = tracker.inputs
+    st.session_state['plan_report'] = report.summary()
     return game_plan
 
-# Function to display images
-def display_image(image_url, caption):
+# Slice and pack sprite/object/UI images; cached so reruns reuse the atlases
+@st.cache_data(show_spinner="Packing sprite atlases...", max_entries=8)
+def build_sprite_atlases(images):
+    return build_atlases(dict(images))
+
+# Bytes for an asset URL: from the asset library when catalogued, else downloaded
+def load_asset(url):
+    import requests
+
+    data = get_catalog().content_for_url(url)
+    if data is None:
+        response = requests.get(url)
+        response.raise_for_status()
+        data = response.content
+        DOWNLOADED_BYTES.inc('export', amount=len(data))
+    return data
+
+# Write the export ZIP for a full game plan. Returns (zip bytes, [error messages]).
+def write_game_plan_zip(game_plan, export_options):
+    import zipfile
+    from concurrent.futures import ThreadPoolExecutor
+    from PIL import Image
+
+    started = time.perf_counter()
+    errors = []
+    zip_buffer = BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        # Add text documents
+        for key in ['game_concept', 'world_concept', 'character_concepts', 'plot']:
+            if key in game_plan:
+                zip_file.writestr(f"{key}.txt", game_plan[key])
+
+        # Add images
+        if 'images' in game_plan:
+            textures = game_plan.get('textures') or {}
+            blobs = get_blob_dir()
+            urls = {
+                name: url for name, url in game_plan['images'].items()
+                if isinstance(url, str) and url.startswith('http') and not (textures.get(name) or {}).get('image')
+            }
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                futures = {name: pool.submit(load_asset, url) for name, url in urls.items()}
+            raw = {}
+            for name, future in futures.items():
+                try:
+                    raw[name] = future.result()
+                except Exception as e:
+                    errors.append(f"Unable to download {name}: {str(e)}")
+
+            # Use the seamless texture versions and add their mip chains
+            for name, texture in textures.items():
+                if texture.get('image') and name in game_plan['images']:
+                    raw[name] = blobs.get(texture['image'])
+                    for size, digest in texture['mips'].items():
+                        zip_file.writestr(f"textures/{name}_mip_{size}.png", blobs.get(digest), compress_type=zipfile.ZIP_STORED)
+
+            if export_options.get('optimize_images'):
+                image_files = optimize_images(raw, export_options)
+            else:
+                image_files = {}
+                for name, data in raw.items():
+                    with BytesIO() as img_buffer:
+                        Image.open(BytesIO(data)).save(img_buffer, format='PNG')
+                        image_files[f"{name}.png"] = img_buffer.getvalue()
+            for file_name, data in image_files.items():
+                zip_file.writestr(file_name, data, compress_type=zipfile.ZIP_STORED)
+
+            # Add sprite atlases and engine metadata
+            sliceable = {
+                name: image_files[f"{name}.png"] for name in raw
+                if should_slice(name) and f"{name}.png" in image_files
+            }
+            if sliceable and export_options['sprite_atlases']:
+                for file_name, data in build_sprite_atlases(tuple(sorted(sliceable.items()))).items():
+                    zip_file.writestr(file_name, data)
+
+        # Add scripts
+        if 'scripts' in game_plan:
+            for script_name, script_code in game_plan['scripts'].items():
+                zip_file.writestr(script_name, script_code)
+
+        # Add additional elements
+        if 'additional_elements' in game_plan:
+            for element_name, element_content in game_plan['additional_elements'].items():
+                zip_file.writestr(f"{element_name}.txt", element_content)
+
+        # Add music if generated, with its seamless loop
+        if game_plan.get('music'):
+            music_audio = game_plan.get('music_audio') or {}
+            blobs = get_blob_dir()
+            try:
+                if music_audio.get('audio') and blobs.exists(music_audio['audio']):
+                    music = blobs.get(music_audio['audio'])
+                else:
+                    music = load_asset(game_plan['music'])
+                zip_file.writestr("background_music.mp3", music, compress_type=zipfile.ZIP_STORED)
+            except Exception as e:
+                errors.append(f"Error downloading music: {str(e)}")
+            if music_audio.get('loop_audio') and blobs.exists(music_audio['loop_audio']):
+                zip_file.writestr("background_music_loop.wav", blobs.get(music_audio['loop_audio']))
+
+    ZIP_BUILD_SECONDS.observe(time.perf_counter() - started)
+    return zip_buffer.getvalue(), errors
+
+# Build the export ZIP for a plan of session handles into the shared content
+# store; cached so reruns do not download or re-encode anything.
+# Returns (zip content hash, [error messages]).
+@st.cache_data(show_spinner="Preparing ZIP...", max_entries=64)
+def build_game_plan_zip(plan_handles, export_options):
+    zip_bytes, errors = write_game_plan_zip(resolve(plan_handles), export_options)
+    return get_content_store().put(zip_bytes), errors
+
+# Download callback: ZIP bytes are only read when the button is clicked,
+# and rebuilt if the store has evicted them since
+def game_plan_zip_loader(plan_handles, export_options, digest):
+    def load():
+        data = get_content_store().get(digest)
+        if data is None:
+            data = write_game_plan_zip(resolve(plan_handles), export_options)[0]
+        return data
+    return load
+
+# This session's speculator, created on first use
+def session_speculator():
+    if 'speculator' not in st.session_state:
+        st.session_state['speculator'] = Speculator()
+    return st.session_state['speculator']
+
+# This session's image refiner, created on first use
+def session_refiner():
+    if 'refiner' not in st.session_state:
+        st.session_state['refiner'] = Refiner()
+    return st.session_state['refiner']
+
+# High-quality render of a previewed image, run by the session's refiner
+# outside the script, so it takes its keys and scheduling flow explicitly.
+# The final image replaces the preview in the asset library, so the Results
+# tab shows it without downloading it again.
+# Render the final of one preview. Under the dedup settings a final that is
+# a near-duplicate is re-rendered with a prompt perturbation, or the preview
+# is kept (the refinement fails) when dropping or out of perturbations.
+async def refine_image(api_keys, payload, flow, preview, dedup, others, own_assets, finals, name):
+    current_flow.set(flow)
+    size = f"{payload['size'][0]}x{payload['size'][1]}"
+    prompt = payload['prompt']
+    for attempt in range(len(PERTURBATIONS) + 1):
+        with logged_call('refine_image', model=payload['model'], size=size):
+            url = await dispatch('image', payload, api_keys)
+        try:
+            data = await providers.fetch_bytes(url)
+        except ProviderError as e:
+            log_event('refined_image_not_catalogued', url=url, error=str(e))
+            return url
+        match = await asyncio.to_thread(final_duplicate, dedup, data, others, own_assets, finals, name)
+        if match is None:
+            break
+        if dedup['mode'] == 'drop' or attempt == len(PERTURBATIONS):
+            raise ProviderError(f"The refined image is a near-duplicate of {match}; keeping the preview.")
+        payload = dict(payload, prompt=f"{prompt} {PERTURBATIONS[attempt]} Variation seed {random.randrange(10 ** 6)}.")
     try:
-        response = requests.get(image_url)
-        response.raise_for_status()  # Raise an exception for bad responses
-        image = Image.open(BytesIO(response.content))
-        st.image(image, caption=caption, use_column_width=True)
-    except requests.RequestException as e:
-        st.warning(f"Unable to load image: {caption}")
-        st.error(f"Error: {str(e)}")
+        await asyncio.to_thread(get_catalog().replace_image, preview, url, payload['model'], {url: data})
     except Exception as e:
-        st.warning(f"Unable to display image: {caption}")
-        st.error(f"Error: {str(e)}")
+        log_event('refined_image_not_catalogued', url=url, error=str(e))
+    return url
+
+# What the final image `name` is a near-duplicate of under the `dedup`
+# settings: one of the plan's `others` (image name -> pHash), a library asset
+# other than `own_assets` (its preview's) or a final already accepted into
+# `finals` (a HashIndex shared by the plan's refinements, which it joins
+# when it matches nothing); None if nothing
+def final_duplicate(dedup, data, others, own_assets, finals, name):
+    if dedup['mode'] == 'keep':
+        return None
+    value = phash(data)
+    index = HashIndex()
+    for other, other_value in others.items():
+        index.add(other, other_value)
+    matches = index.query(value)
+    if not matches and dedup['library']:
+        matches = [(f"library asset #{asset_id}", distance)
+                   for asset_id, distance in get_catalog().similar_images(value) if asset_id not in own_assets]
+    if not matches:
+        matches = finals.add_unless_near(name, value)
+    return matches[0][0] if matches else None
+
+# Start refining the plan's new previews (image name -> preview URL); the
+# finals are checked for near-duplicates of the plan's other `images`
+def refine_previews(previews, image_requests, images):
+    customization = st.session_state.customization
+    model = customization['image_model']
+    fallback, _ = reliability_options('image')
+    flow = Flow(f"{session_flow().id}:refine", REFINEMENT_WEIGHT)
+    refiner = session_refiner()
+    dedup = dict(customization['dedup'])
+    catalogued = []
+    if previews and dedup['mode'] != 'keep':
+        try:
+            catalogued = get_catalog().image_hashes(images.values())
+        except Exception as e:
+            log_event('refinement_dedup_unavailable', error=str(e))
+    hashes = {url: value for asset_id, url, value in catalogued}
+    finals = HashIndex()
+    for name, preview in previews.items():
+        prompt, size = image_requests[name]
+        payload = {'model': model, 'fallback': fallback, 'prompt': prompt, 'size': list(size)}
+        others = {other: hashes[url] for other, url in images.items() if other != name and url in hashes}
+        own_assets = {asset_id for asset_id, url, value in catalogued if url == preview}
+        start = functools.partial(refine_image, dict(st.session_state.api_keys), payload, flow, preview,
+                                  dedup, others, own_assets, finals, name)
+        refiner.start(name, preview, start, providers.estimated_cost('image', model, (model, prompt, size)))
+
+# Swap finished refinements into the session's plan; returns whether any were applied
+def apply_refinements(refiner):
+    plan = st.session_state.get('game_plan') or {}
+    images = plan.get('images') or {}
+    applied = False
+    for name, (preview, final) in refiner.take().items():
+        if images.get(name) == preview:
+            images[name] = final
+            applied = True
+    return applied
+
+# Generate a plan, keep only its handles in the session and catalogue it.
+# Runs in a function so the full plan text is released when it returns.
+def run_game_plan(user_prompt):
+    previous = {
+        'plan': resolve(st.session_state.get('game_plan')),
+        'inputs': st.session_state.get('plan_inputs'),
+    }
+    downloaded = {}
+    ACTIVE_JOBS.inc()
+    try:
+        with logged_call('generate_game_plan', chat_model=st.session_state.customization['chat_model'],
+                         image_model=st.session_state.customization['image_model']):
+            speculator = session_speculator() if st.session_state.customization['speculation']['enabled'] else None
+            game_plan = asyncio.run(generate_game_plan(
+                user_prompt, st.session_state.customization, previous, downloaded, speculator
+            ))
+    finally:
+        ACTIVE_JOBS.dec()
+    st.session_state['game_plan'] = externalize(game_plan)
+    image_requests = build_image_requests(st.session_state.customization, game_plan.get('game_concept', ''))
+    image_prompts = {name: prompt for name, (prompt, size) in image_requests.items()}
+    try:
+        get_catalog().record_plan(user_prompt, st.session_state.customization, game_plan, image_prompts, downloaded)
+    except Exception as e:
+        st.warning(f"Unable to save the plan to the asset library: {str(e)}")
+    # Refine new previews once they are catalogued, so the finals can replace them
+    images = game_plan.get('images') or {}
+    if 'refiner' in st.session_state:
+        st.session_state['refiner'].retain(images)
+    if refining_images(st.session_state.customization):
+        previous_urls = set(((previous['plan'] or {}).get('images') or {}).values())
+        refine_previews({
+            name: url for name, url in images.items()
+            if name in image_requests and previews_image(st.session_state.customization, name)
+            and isinstance(url, str) and url.startswith('http') and url not in previous_urls
+        }, image_requests, images)
+
+# Refinement progress, rerun every REFINEMENT_POLL seconds while refining;
+# finished images trigger a full rerun so every view shows them
+def _refinement_progress(refiner, active):
+    if apply_refinements(refiner) or refiner.active != active:
+        st.rerun()
+    stats = refiner.stats()
+    model = st.session_state.customization['image_model']
+    st.caption(f"Refining previews with {model}: {stats['done']} of {stats['total']} done,"
+               f" {stats['cancelled']} stopped (${stats['saved_usd']:.3f} saved), {stats['failed']} failed")
+    if active:
+        st.button("Stop refining all", key="refinement_stop_all", on_click=refiner.cancel)
+    for error in stats['errors'][:3]:
+        st.warning(f"Refinement failed: {error}")
+
+# Results tab for a plan of session handles; the resolved text only lives
+# for the duration of this call
+def display_game_plan(plan_handles):
+    refiner = st.session_state.get('refiner')
+    if refiner is not None:
+        apply_refinements(refiner)
+    game_plan = resolve(plan_handles)
+    st.markdown("## 📊 Generated Game Plan")
+    if refiner is not None and refiner.stats()['total']:
+        active = refiner.active
+        st.fragment(_refinement_progress, run_every=REFINEMENT_POLL if active else None)(refiner, active)
+
+    if 'plan_report' in st.session_state:
+        plan_report = st.session_state['plan_report']
+        with st.expander(f"📈 Cost & Latency (${plan_report['total_cost_usd']:.4f}, {plan_report['total_latency_s']:.1f}s model time,"
+                         f" {plan_report.get('total_input_tokens', 0):,} input tokens)"):
+            if plan_report['models']:
+                st.table(plan_report['models'])
+            else:
+                st.write("All text results were reused from the previous plan.")
+
+    display_results(plan_handles, image_thumbnail, full_image, refiner)
+
+    if game_plan.get('duplicates'):
+        with st.expander("🪞 Near-Duplicate Images"):
+            st.table([
+                {'image': name, **entry} for name, entry in game_plan['duplicates'].items()
+            ])
+
+    if game_plan.get('textures'):
+        with st.expander("🧱 Texture Tiling"):
+            st.table([
+                {'texture': name, 'status': entry['status'], 'seam': entry['seam'], 'smooth': entry['smooth']}
+                for name, entry in game_plan['textures'].items()
+            ])
+            flagged = [name for name, entry in game_plan['textures'].items() if entry['status'] == 'failed']
+            if flagged:
+                st.warning(f"Flagged for regeneration on the next submit: {', '.join(flagged)}")
+
+    # Save results
+    export_options = st.session_state.customization['export']
+    zip_digest, zip_errors = build_game_plan_zip(plan_handles, export_options)
+    for error in zip_errors:
+        st.error(error)
+
+    st.download_button(
+        "Download Game Plan ZIP",
+        game_plan_zip_loader(plan_handles, export_options, zip_digest),
+        file_name="game_plan.zip",
+        mime="application/zip",
+        help="Download a ZIP file containing all generated assets and documents."
+    )
+
+    # Display generated music if applicable
+    if 'music' in game_plan and game_plan['music']:
+        st.markdown("### 🎵 Generated Music")
+        display_music(game_plan['music'], game_plan.get('music_audio') or {})
+    else:
+        st.warning("No music was generated or an error occurred during music generation.")
+
+def _clock(seconds):
+    return f"{int(seconds // 60)}:{seconds % 60:04.1f}"
+
+# Waveform and players for the track and its loop. Audio is played from the
+# local blob store, served by Streamlit's media endpoint with range requests.
+def display_music(url, music_audio):
+    blobs = get_blob_dir()
+    if music_audio.get('peaks'):
+        peaks = music_audio['peaks']
+        step = music_audio['duration'] / len(peaks['max'])
+        st.area_chart({'seconds': [round(i * step, 2) for i in range(len(peaks['max']))],
+                       'max': peaks['max'], 'min': peaks['min']},
+                      x='seconds', y=['max', 'min'], height=140)
+    if music_audio.get('audio') and blobs.exists(music_audio['audio']):
+        st.audio(blobs.path(music_audio['audio']), format='audio/mpeg')
+    else:
+        st.audio(url, format='audio/mp3')
+    if music_audio.get('error'):
+        st.caption(f"No waveform or loop: {music_audio['error']}")
+    if music_audio.get('loop_audio') and blobs.exists(music_audio['loop_audio']):
+        loop = music_audio['loop']
+        if loop['score'] is None:
+            st.caption(f"🔁 Seamless loop: whole track, {_clock(loop['end'] - loop['start'])} with crossfaded ends")
+        else:
+            st.caption(f"🔁 Seamless loop: {_clock(loop['start'])} to {_clock(loop['end'])} (match {loop['score']:.0%})")
+        st.audio(blobs.path(music_audio['loop_audio']), format='audio/wav', loop=True)
+
+# Preview of a generated image: the asset library's thumbnail, or one made from the download
+@st.cache_data(show_spinner=False, max_entries=1024)
+def image_thumbnail(url):
+    return get_catalog().thumbnail_for_url(url) or thumbnail(load_asset(url))[0]
+
+# Full-size image bytes, sent only for images opened in the Results tab
+@st.cache_data(show_spinner=False, max_entries=16)
+def full_image(url):
+    return load_asset(url)
 
 # Streamlit app layout
 st.set_page_config(page_title="Game Dev Automation", page_icon="🎮", layout="wide")
-st.markdown('<style>' + open("style.css").read() + '</style>', unsafe_allow_html=True)
+st.markdown('<style>' + load_css(STYLE_FILE) + '</style>', unsafe_allow_html=True)
 
 st.title("🎮 Game Dev Automation")
 
@@ -363,44 +982,119 @@ with st.sidebar:
     st.markdown("### 🤖 Model Selection")
     st.session_state.customization['chat_model'] = st.selectbox(
         "Select Chat Model",
-        options=['gpt-4', 'gpt-3.5-turbo', 'llama'],
+        options=CHAT_MODELS,
         index=0,
         help="Choose the language model for generating game concepts and narratives."
     )
     st.session_state.customization['image_model'] = st.selectbox(
         "Select Image Generation Model",
-        options=['dall-e-3', 'SD Flux-1', 'SDXL Lightning'],
+        options=IMAGE_MODELS,
         index=0,
         help="Select the model for generating game images."
     )
+    st.session_state.customization['refinement']['enabled'] = st.checkbox(
+        "Preview, Then Refine Images",
+        value=st.session_state.customization['refinement']['enabled'],
+        disabled=st.session_state.customization['image_model'] == PREVIEW_MODEL,
+        help=f"Show quick {PREVIEW_MODEL} previews first, then replace each with the selected model's render"
+             " in the background. Stop refining images you don't want to avoid paying for them."
+    )
     st.session_state.customization['code_model'] = st.selectbox(
         "Select Code Generation Model",
-        options=['gpt-4', 'gpt-3.5-turbo', 'llama'],
+        options=CHAT_MODELS,
         index=0,
         help="Choose the model for generating code scripts."
     )
 
+    # Per-request model routing
+    routing = st.session_state.customization['routing']
+    routing['mode'] = st.selectbox(
+        "Model Routing",
+        options=ROUTING_MODES,
+        index=ROUTING_MODES.index(routing['mode']),
+        format_func=lambda mode: "Off (use selected models)" if mode == 'off' else mode.capitalize(),
+        help="Choose a chat model per request from its task, expected length, latency budget and observed stats."
+    )
+    routing['latency_budget'] = st.number_input(
+        "Latency Budget (seconds, 0 = none)",
+        min_value=0,
+        value=routing['latency_budget'],
+        disabled=routing['mode'] == 'off',
+        help="Prefer models predicted to answer within this many seconds."
+    )
+    speculation = st.session_state.customization['speculation']
+    speculation['enabled'] = st.checkbox(
+        "Speculative Concept Generation",
+        value=speculation['enabled'],
+        help="Start generating the game and world concepts in the background once the game idea stops changing, "
+             "so a plan starts with them ready. Results for an edited idea are discarded, which costs tokens."
+    )
+
+    # Hedging and failover
+    with st.expander("🛡 Reliability"):
+        reliability = st.session_state.customization['reliability']
+        reliability['hedging'] = st.checkbox(
+            "Hedge slow requests",
+            value=reliability['hedging'],
+            help="Fire a backup request when a call runs longer than usual and keep whichever finishes first."
+        )
+        reliability['hedge_percentile'] = st.slider(
+            "Hedge after latency percentile",
+            min_value=50,
+            max_value=99,
+            value=reliability['hedge_percentile'],
+            disabled=not reliability['hedging'],
+            help="The backup fires once a call exceeds this percentile of the model's recent latencies."
+        )
+        image_fallback = st.selectbox(
+            "Fallback Image Model",
+            options=['None'] + IMAGE_MODELS,
+            index=0,
+            help="Used when the selected image model fails or its circuit breaker is open."
+        )
+        reliability['image_fallback'] = None if image_fallback == 'None' else image_fallback
+        chat_fallback = st.selectbox(
+            "Fallback Chat Model",
+            options=['None'] + CHAT_MODELS,
+            index=0,
+            help="Used when the selected chat model fails or its circuit breaker is open."
+        )
+        reliability['chat_fallback'] = None if chat_fallback == 'None' else chat_fallback
+        open_circuits = [m for m in dict.fromkeys(CHAT_MODELS + IMAGE_MODELS) if get_hedger().breaker(m).is_open]
+        if open_circuits:
+            st.caption(f"Circuit open (routing around): {', '.join(open_circuits)}")
+
     # Asset Library
     st.markdown("### 📂 Asset Library")
-    if 'game_plan' in st.session_state and 'images' in st.session_state['game_plan']:
-        for img_name, img_url in st.session_state['game_plan']['images'].items():
-            if isinstance(img_url, str) and img_url.startswith('http'):
-                st.image(img_url, caption=img_name, use_column_width=True)
-                st.download_button("Download", img_url, file_name=f"{img_name}.png")
+    with st.expander("Browse past plans and assets"):
+        display_asset_browser(get_catalog())
+
+PROMPT_PLACEHOLDER = "Enter a detailed description of your game here..."
+
+def game_idea_input():
+    return st.text_area(
+        "Describe your game idea:",
+        PROMPT_PLACEHOLDER,
+        height=150,
+        help="This description will be used as the foundation for generating all game assets."
+    )
 
 # Main content area with Tabs
-options_tab, results_tab = st.tabs(["📝 Options", "📊 Results"])
+options_tab, results_tab, workflow_tab = st.tabs(["📝 Options", "📊 Results", "🧩 Workflow"])
 
 with options_tab:
     st.markdown("## 🎮 Define Your Game")
 
+    # Form widgets only report their values on submit, so when speculating
+    # the game idea is entered above the form
+    speculating = st.session_state.customization['speculation']['enabled']
+    if speculating:
+        user_prompt = game_idea_input()
+        st.caption("The game and world concepts start generating shortly after you finish editing the idea.")
+
     with st.form("generation_form"):
-        user_prompt = st.text_area(
-            "Describe your game idea:",
-            "Enter a detailed description of your game here...",
-            height=150,
-            help="This description will be used as the foundation for generating all game assets."
-        )
+        if not speculating:
+            user_prompt = game_idea_input()
 
         st.markdown("### 🖼️ Image Generation")
         for img_type in st.session_state.customization['image_types']:
@@ -420,6 +1114,20 @@ with options_tab:
                 key=f"script_count_{script_type}"
             )
 
+        dedup_modes = ['regenerate', 'drop', 'keep']
+        st.session_state.customization['dedup']['mode'] = st.selectbox(
+            "Near-Duplicate Images",
+            options=dedup_modes,
+            index=dedup_modes.index(st.session_state.customization['dedup']['mode']),
+            format_func=str.capitalize,
+            help="What to do with variations that come back nearly identical to another image."
+        )
+        st.session_state.customization['dedup']['library'] = st.checkbox(
+            "Also compare with the asset library",
+            value=st.session_state.customization['dedup']['library'],
+            help="Treat images close to any previously generated asset as duplicates too."
+        )
+
         st.markdown("### ⚙️ Code Type Selection")
         st.session_state.customization['code_types']['unity'] = st.checkbox(
             "Unity C# Scripts",
@@ -459,113 +1167,60 @@ with options_tab:
             value=st.session_state.customization['use_replicate']['generate_music']
         )
 
+        st.markdown("### 📦 Export")
+        st.session_state.customization['export']['sprite_atlases'] = st.checkbox(
+            "Pack Sprite Atlases",
+            value=st.session_state.customization['export']['sprite_atlases'],
+            help="Slice sprite, object and UI images into frames and pack them into texture atlases with Unity/Unreal metadata."
+        )
+        st.session_state.customization['export']['texture_check'] = st.checkbox(
+            "Make Textures Seamless",
+            value=st.session_state.customization['export']['texture_check'],
+            help="Check that textures tile, fix near misses, regenerate failures and export mip chains."
+        )
+        export_options = st.session_state.customization['export']
+        export_options['optimize_images'] = st.checkbox(
+            "Optimize Exported Images",
+            value=export_options['optimize_images'],
+            help="Losslessly recompress PNGs, using a palette where possible."
+        )
+        export_options['downscale'] = st.checkbox(
+            "Downscale to Requested Sizes",
+            value=export_options['downscale'],
+            help="Shrink images larger than the size requested for their asset type."
+        )
+        export_options['webp'] = st.checkbox("Add WebP Variants", value=export_options['webp'])
+        export_options['avif'] = st.checkbox("Add AVIF Variants", value=export_options['avif'])
+
         generate_button = st.form_submit_button("Generate Game Plan")
 
+# Speculate on the current idea; a submit adopts the results instead
+if speculating and not generate_button:
+    if len(user_prompt.strip()) >= MIN_PROMPT_CHARS and user_prompt != PROMPT_PLACEHOLDER:
+        session_speculator().propose(speculative_calls(user_prompt))
+    else:
+        session_speculator().cancel_all()
+elif not speculating and 'speculator' in st.session_state:
+    st.session_state['speculator'].cancel_all()
+
 if generate_button:
     if not st.session_state.api_keys['openai'] or not st.session_state.api_keys['replicate']:
         st.error("Please enter and save both OpenAI and Replicate API keys.")
     else:
         with st.spinner('Generating game plan...'):
-            game_plan = asyncio.run(generate_game_plan(user_prompt, st.session_state.customization))
-            st.session_state['game_plan'] = game_plan
+            run_game_plan(user_prompt)
         st.success('Game plan generated successfully!')
 
 with results_tab:
     if 'game_plan' in st.session_state:
-        st.markdown("## 📊 Generated Game Plan")
-
-        if 'game_concept' in st.session_state['game_plan']:
-            with st.expander("📖 Game Concept"):
-                st.write(st.session_state['game_plan']['game_concept'])
-
-        if 'world_concept' in st.session_state['game_plan']:
-            with st.expander("🌍 World Concept"):
-                st.write(st.session_state['game_plan']['world_concept'])
-
-        if 'character_concepts' in st.session_state['game_plan']:
-            with st.expander("🦸 Character Concepts"):
-                st.write(st.session_state['game_plan']['character_concepts'])
-
-        if 'plot' in st.session_state['game_plan']:
-            with st.expander("🎭 Plot"):
-                st.write(st.session_state['game_plan']['plot'])
-
-        if 'images' in st.session_state['game_plan']:
-            st.markdown("### 🖼️ Generated Images")
-            for img_name, img_url in st.session_state['game_plan']['images'].items():
-                if isinstance(img_url, str) and img_url.startswith('http'):
-                    display_image(img_url, img_name)
-                else:
-                    st.write(f"{img_name}: {img_url}")
-
-        if 'scripts' in st.session_state['game_plan']:
-            st.markdown("### 💻 Generated Scripts")
-            for script_name, script_code in st.session_state['game_plan']['scripts'].items():
-                language = script_name.split('.')[-1]
-                with st.expander(f"View {script_name}"):
-                    st.code(script_code, language=language)
-
-        if 'additional_elements' in st.session_state['game_plan']:
-            st.markdown("### 🔧 Additional Elements")
-            for element_name, element_content in st.session_state['game_plan']['additional_elements'].items():
-                with st.expander(f"View {element_name.capitalize()}"):
-                    st.write(element_content)
-
-        # Save results
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
-            # Add text documents
-            for key in ['game_concept', 'world_concept', 'character_concepts', 'plot']:
-                if key in st.session_state['game_plan']:
-                    zip_file.writestr(f"{key}.txt", st.session_state['game_plan'][key])
-
-            # Add images
-            if 'images' in st.session_state['game_plan']:
-                for asset_name, asset_url in st.session_state['game_plan']['images'].items():
-                    if isinstance(asset_url, str) and asset_url.startswith('http'):
-                        img_response = requests.get(asset_url)
-                        img = Image.open(BytesIO(img_response.content))
-                        img_file_name = f"{asset_name}.png"
-                        with BytesIO() as img_buffer:
-                            img.save(img_buffer, format='PNG')
-                            zip_file.writestr(img_file_name, img_buffer.getvalue())
-
-            # Add scripts
-            if 'scripts' in st.session_state['game_plan']:
-                for script_name, script_code in st.session_state['game_plan']['scripts'].items():
-                    zip_file.writestr(script_name, script_code)
-
-            # Add additional elements
-            if 'additional_elements' in st.session_state['game_plan']:
-                for element_name, element_content in st.session_state['game_plan']['additional_elements'].items():
-                    zip_file.writestr(f"{element_name}.txt", element_content)
-
-            # Add music if generated
-            if 'music' in st.session_state['game_plan'] and st.session_state['game_plan']['music']:
-                try:
-                    music_response = requests.get(st.session_state['game_plan']['music'])
-                    music_response.raise_for_status()
-                    zip_file.writestr("background_music.mp3", music_response.content)
-                except requests.RequestException as e:
-                    st.error(f"Error downloading music: {str(e)}")
-
-        st.download_button(
-            "Download Game Plan ZIP",
-            zip_buffer.getvalue(),
-            file_name="game_plan.zip",
-            mime="application/zip",
-            help="Download a ZIP file containing all generated assets and documents."
-        )
-
-        # Display generated music if applicable
-        if 'music' in st.session_state['game_plan'] and st.session_state['game_plan']['music']:
-            st.markdown("### 🎵 Generated Music")
-            st.audio(st.session_state['game_plan']['music'], format='audio/mp3')
-        else:
-            st.warning("No music was generated or an error occurred during music generation.")
+        display_game_plan(st.session_state['game_plan'])
     else:
         st.info("Generate a game plan to see the results here.")
 
+with workflow_tab:
+    st.markdown("## 🧩 Workflow Builder")
+    manage_workflow(st.session_state.api_keys, session_flow())
+
 # Footer
 st.markdown("---")
 st.markdown("""
@@ -575,12 +1230,26 @@ st.markdown("""
     [Instagram](https://instagram.com/your-instagram)
     """, unsafe_allow_html=True)
 
-# Initialize Replicate client
-if st.session_state.api_keys['replicate']:
-    replicate.Client(api_token=st.session_state.api_keys['replicate'])
-
-# Load API keys on startup
-openai_key, replicate_key = load_api_keys()
-if openai_key and replicate_key:
-    st.session_state.api_keys['openai'] = openai_key
-    st.session_state.api_keys['replicate'] = replicate_key
+# Sidebar timing readout
+with st.sidebar:
+    with st.expander("⏱ Performance"):
+        st.json(perf.timing_summary())
+        if 'speculator' in st.session_state:
+            stats = st.session_state['speculator'].stats()
+            hit_rate = "n/a" if stats['hit_rate'] is None else f"{stats['hit_rate']:.0%}"
+            st.caption(f"Speculation: {stats['hit']} hits, {stats['miss']} misses (hit rate {hit_rate}),"
+                       f" {stats['discarded']} discarded, ${stats['wasted_usd']:.4f} wasted")
+        single_flight = get_single_flight().stats()
+        st.caption(f"Coalesced requests: {single_flight['coalesced']} ({single_flight['in_flight']} calls in flight)")
+        for pool in get_scheduler().stats():
+            st.caption(f"{PROVIDER_NAMES.get(pool['provider'], pool['provider'])} key: {pool['active']}/{pool['limit']} calls running,"
+                       f" {pool['queued']} queued, ${pool['spent_usd']:.2f} spent this hour")
+        if QUEUE_ENABLED:
+            counts = get_task_queue().counts()
+            st.caption(f"Task queue: {counts.get('queued', 0)} waiting, {counts.get('leased', 0)} running on workers,"
+                       f" {counts.get('failed', 0)} failed")
+        metrics_port = start_metrics_server()
+        if metrics_port:
+            st.caption(f"Prometheus metrics: http://127.0.0.1:{metrics_port}/metrics")
+
+perf.script_finished(_script_started)
@@ -0,0 +1,90 @@
+# Canvas sync cost for large workflow graphs (services/graph.py,
+# components/canvas.py).
+#
+# Builds a layered DAG of --nodes nodes (each wired to two nodes of the
+# previous layer), then replays a session of --edits edits (node moves and
+# edge additions, as dragged on the canvas). For each edit it measures the
+# time to apply it, including the O(V+E) cycle check of new edges, and the
+# size of what the next rerun sends to the browser: the ops the frame has
+# not seen, against the full graph a stateless component would re-send on
+# every rerun. Usage:
+#
+#     python benchmarks/canvas_sync.py --nodes 100 300 1000 --edits 200
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.canvas import _new_sync, _outgoing, _receive  # noqa: E402
+from presets import get_available_nodes  # noqa: E402
+from services.graph import Graph, GraphError  # noqa: E402
+
+LAYER_WIDTH = 10
+
+
+def layered_graph(count, catalogue, rng):
+    graph = Graph(kinds=set(catalogue))
+    kinds = list(catalogue)
+    layers = []
+    for index in range(count):
+        layer, row = divmod(index, LAYER_WIDTH)
+        node_id = graph.new_id(rng.choice(kinds))
+        graph.apply({'op': 'add_node', 'id': node_id, 'kind': node_id.rsplit('-', 1)[0], 'x': layer * 230, 'y': row * 80})
+        if row == 0:
+            layers.append([])
+        if len(layers) > 1:
+            for source in rng.sample(layers[-2], min(2, len(layers[-2]))):
+                graph.apply({'op': 'add_edge', 'source': source, 'target': node_id})
+        layers[-1].append(node_id)
+    return graph
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--nodes", type=int, nargs='+', default=[100, 300, 1000])
+    parser.add_argument("--edits", type=int, default=200)
+    args = parser.parse_args()
+
+    catalogue = get_available_nodes()
+    print(f"{'nodes':>5} {'edges':>5} {'apply p50':>9} {'max':>8} {'rejected':>8} {'diff/rerun':>10} {'full/rerun':>10} {'topo':>7}")
+    for count in args.nodes:
+        rng = random.Random(count)
+        graph = layered_graph(count, catalogue, rng)
+        sync = _new_sync()
+        _outgoing(graph, catalogue, sync, None, 560, 'canvas')  # first render: snapshot
+        node_ids = list(graph.nodes)
+        applied, diff_sizes, full_sizes, rejected = [], [], [], 0
+        for seq in range(1, args.edits + 1):
+            if seq % 2:
+                node_id = rng.choice(node_ids)
+                op = {'op': 'move_node', 'id': node_id, 'x': rng.uniform(0, 5000), 'y': rng.uniform(0, 2000)}
+            else:
+                op = {'op': 'add_edge', 'source': rng.choice(node_ids), 'target': rng.choice(node_ids)}
+            value = {'seq': seq, 'ack': graph.version, 'ops': [[seq, op]], 'selected': None}
+            started = time.perf_counter()
+            _receive(graph, sync, value, 'canvas')
+            applied.append(time.perf_counter() - started)
+            if sync['error']:
+                rejected += 1
+                sync['resync'] = False  # measure the steady state, not the resync
+                sync['error'] = None
+            diff_sizes.append(len(json.dumps(_outgoing(graph, catalogue, sync, None, 560, 'canvas'))))
+            full_sizes.append(len(json.dumps(graph.snapshot())))
+        started = time.perf_counter()
+        try:
+            graph.topological_order()
+        except GraphError:
+            pass
+        topo = time.perf_counter() - started
+        print(f"{count:>5} {len(graph.edges()):>5} {statistics.median(applied) * 1e6:>7.0f}us {max(applied) * 1e3:>6.2f}ms"
+              f" {rejected:>8} {statistics.mean(diff_sizes):>9.0f}B {statistics.mean(full_sizes) / 1024:>8.1f}KB"
+              f" {topo * 1e3:>5.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Small plans next to a big batch plan on shared API keys.
+#
+# Simulates sessions the way the app runs them: each on its own thread with
+# its own asyncio.run, calling services.providers against the local provider
+# mock, which serves at most --provider-concurrency requests at once like a
+# per-key provider limit. One "big" session requests --big-images images at
+# once; shortly after, --small sessions each generate a small plan (four
+# concept elements one after another, then --small-images images). Runs
+# once with the scheduler effectively off (calls queue at the provider in
+# arrival order) and once with fair-share slots matching the provider limit,
+# and reports how long the small plans and the batch take. Usage:
+#
+#     python benchmarks/fair_share.py --big-images 40 --small 3 --provider-concurrency 8
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, BENCHMARKS)
+sys.path.insert(0, ROOT)
+
+from mock_providers import MockProviders  # noqa: E402
+
+KEYS = {'openai': 'shared-openai-key', 'replicate': 'shared-replicate-key'}
+ELEMENTS = ['game concept', 'world concept', 'character concepts', 'plot']
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else 0.0
+
+
+def run_session(name, work, results):
+    from services.scheduler import Flow, current_flow
+
+    async def main():
+        current_flow.set(Flow(name, 1.0))
+        started = time.perf_counter()
+        await work()
+        results[name] = time.perf_counter() - started
+
+    asyncio.run(main())
+
+
+def scenario(providers, big_images, small, small_images, delay):
+    async def big():
+        await asyncio.gather(*(providers.image(KEYS, 'dall-e-3', f"big {i}", (1024, 1024)) for i in range(big_images)))
+
+    async def small_plan():
+        for element in ELEMENTS:
+            await providers.chat(KEYS, 'gpt-4', "You are a game designer.", f"Create a detailed {element}.")
+        await asyncio.gather(*(providers.image(KEYS, 'dall-e-3', f"small {i}", (1024, 1024)) for i in range(small_images)))
+
+    results = {}
+    threads = [threading.Thread(target=run_session, args=('big', big, results))]
+    threads[0].start()
+    time.sleep(delay)
+    for i in range(small):
+        threads.append(threading.Thread(target=run_session, args=(f"small{i}", small_plan, results)))
+        threads[-1].start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--big-images", type=int, default=40)
+    parser.add_argument("--small", type=int, default=3, help="small plans started after the batch")
+    parser.add_argument("--small-images", type=int, default=4)
+    parser.add_argument("--provider-concurrency", type=int, default=8)
+    parser.add_argument("--chat-latency", type=float, default=0.3)
+    parser.add_argument("--image-latency", type=float, default=1.0)
+    parser.add_argument("--delay", type=float, default=0.5, help="seconds between the batch and the small plans")
+    args = parser.parse_args()
+
+    mock = MockProviders(chat_latency=args.chat_latency, image_latency=args.image_latency, jitter=0.1,
+                         concurrency=args.provider_concurrency)
+    mock.start()
+    os.environ.update(mock.environ(), GAMEDEV_METRICS_PORT='0', GAMEDEV_LOG_LEVEL='WARNING')
+
+    from services import providers, scheduler
+
+    print(f"{'mode':<12} {'small p50':>9} {'small max':>9} {'batch':>7}")
+    for mode, slots in (('unscheduled', 10 ** 6), ('fair-share', args.provider_concurrency)):
+        scheduler._scheduler = scheduler.FairScheduler(concurrency={'openai': slots})
+        results = scenario(providers, args.big_images, args.small, args.small_images, args.delay)
+        smalls = [seconds for name, seconds in results.items() if name != 'big']
+        print(f"{mode:<12} {pct(smalls, 50):>8.2f}s {max(smalls):>8.2f}s {results['big']:>6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
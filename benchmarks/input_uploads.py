@@ -0,0 +1,76 @@
+# Bytes sent for workflow input images (services/input_media.py).
+#
+# Builds a photo-like test image of each --size, normalises it for the
+# upscale node and compares what --runs workflow runs send to Replicate:
+# before, every run inlined the raw upload as a base64 data URI; now the
+# normalised image is uploaded once and later runs pass its file URL.
+# Uploads go to a local stand-in for the file API, so no key is needed.
+# Usage:
+#
+#     python benchmarks/input_uploads.py --size 1024 3000 6000 --runs 10
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('GAMEDEV_DATA_DIR', tempfile.mkdtemp(prefix='input-uploads-'))
+
+from presets import get_available_nodes  # noqa: E402
+from services import input_media  # noqa: E402
+from services.predictions import get_prediction_manager  # noqa: E402
+
+
+def photo(side, seed=1):
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:side, 0:side * 3 // 4] / side
+    base = np.stack([np.sin(6 * x + 3 * y), np.cos(5 * y), np.sin(4 * x * y)], axis=2) * 90 + 128
+    pixels = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=95)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, nargs='+', default=[1024, 3000, 6000])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    sent = []
+
+    async def upload(api_key, data, filename, content_type):
+        sent.append(len(data))
+        return f"https://api.replicate.com/v1/files/{len(sent)}", None
+
+    get_prediction_manager().upload = upload
+    media = input_media.get_input_media()
+    max_side = get_available_nodes()['upscale'].max_input_side
+    print(f"{'side':>5} {'upload':>8} {'normalised':>10} {'first add':>9} {'re-add':>7}"
+          f" {'data URIs':>10} {'file API':>9} {'uploads':>8}")
+    for side in args.size:
+        raw = photo(side)
+        started = time.perf_counter()
+        digest, mime = media.add(raw, max_side)
+        first = time.perf_counter() - started
+        started = time.perf_counter()
+        media.add(raw, max_side)
+        again = time.perf_counter() - started
+        del sent[:]
+        for _ in range(args.runs):
+            asyncio.run(media.file_url({'replicate': 'benchmark'}, digest, mime))
+        inline = len(raw) * 4 / 3 * args.runs
+        print(f"{side:>5} {len(raw) / 1024:>6.0f}KB {len(media.blobs.get(digest)) / 1024:>8.0f}KB"
+              f" {first * 1000:>7.0f}ms {again * 1000:>5.1f}ms {inline / 1048576:>8.1f}MB"
+              f" {sum(sent) / 1048576:>7.1f}MB {len(sent):>5}/{args.runs:<2}")
+
+
+if __name__ == "__main__":
+    main()
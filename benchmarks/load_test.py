@@ -0,0 +1,164 @@
+# Multi-user load test for app.py.
+#
+# Starts the local provider mock (benchmarks/mock_providers.py), then for each
+# concurrency level runs a fresh process (one "server") in which N simulated
+# users drive their own AppTest session through the real script at the same
+# time: load the page, fill the form, submit (generate_game_plan against the
+# mock), then rerun the Results tab a few times. Reports per-rerun latency
+# percentiles, event-loop lag (how late a 5 ms heartbeat task on each
+# generation event loop wakes up, i.e. time the loop was blocked), plan
+# throughput and peak RSS as concurrency scales. Usage:
+#
+#     python benchmarks/load_test.py --users 1,2,4,8 --plans 2 --reruns 5
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, BENCHMARKS)
+
+from mock_providers import MockProviders  # noqa: E402
+
+CHILD = r'''
+import asyncio, json, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.testing.v1 import AppTest
+
+users, plans, reruns = int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3])
+HEARTBEAT = 0.005
+lags = []
+
+
+# Event loop that runs a heartbeat task next to the main coroutine
+class ProbedLoop(asyncio.SelectorEventLoop):
+    _probing = False
+
+    def run_until_complete(self, future):
+        if self._probing:
+            return super().run_until_complete(future)
+        self._probing = True
+
+        async def heartbeat():
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(HEARTBEAT)
+                lags.append(max(0.0, time.perf_counter() - started - HEARTBEAT))
+
+        probe = self.create_task(heartbeat())
+        try:
+            return super().run_until_complete(future)
+        finally:
+            probe.cancel()
+
+
+class ProbedPolicy(asyncio.DefaultEventLoopPolicy):
+    _loop_factory = ProbedLoop
+
+
+asyncio.set_event_loop_policy(ProbedPolicy())
+
+
+def rss_mb():
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+peak = [rss_mb()]
+done = threading.Event()
+
+
+def sample_memory():
+    while not done.wait(0.1):
+        peak[0] = max(peak[0], rss_mb())
+
+
+timings = {"load": [], "submit": [], "rerun": []}
+errors = []
+
+
+def timed(kind, at):
+    started = time.perf_counter()
+    at.run()
+    timings[kind].append(time.perf_counter() - started)
+    if at.exception:
+        errors.append(str(at.exception[0].message))
+
+
+def user(index):
+    at = AppTest.from_file("app.py", default_timeout=600)
+    at.session_state["api_keys"] = {"openai": "mock", "replicate": "mock"}
+    timed("load", at)
+    at.number_input(key="image_count_Enemy").set_value(2)
+    at.number_input(key="image_count_Background").set_value(1)
+    at.number_input(key="script_count_Player").set_value(1)
+    at.checkbox(key="unity").check()
+    for plan in range(plans):
+        at.text_area[0].input(f"user {index} plan {plan}: a co-op dungeon crawler")
+        at.button(key="FormSubmitter:generation_form-Generate Game Plan").click()
+        timed("submit", at)
+        for _ in range(reruns):
+            timed("rerun", at)
+
+
+threading.Thread(target=sample_memory, daemon=True).start()
+started = time.perf_counter()
+with ThreadPoolExecutor(max_workers=users) as pool:
+    list(pool.map(user, range(users)))
+wall = time.perf_counter() - started
+done.set()
+print(json.dumps({"timings": timings, "lags": lags, "wall": wall, "peak_rss_mb": peak[0], "errors": errors[:5]}))
+'''
+
+
+def pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run_level(users, plans, reruns, mock_env):
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(os.environ, GAMEDEV_DATA_DIR=data_dir, GAMEDEV_METRICS_PORT='0', GAMEDEV_LOG_LEVEL='WARNING', **mock_env)
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD, str(users), str(plans), str(reruns)],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", default="1,2,4,8", help="comma-separated concurrency levels")
+    parser.add_argument("--plans", type=int, default=2, help="plans generated per user")
+    parser.add_argument("--reruns", type=int, default=5, help="Results tab reruns after each plan")
+    parser.add_argument("--chat-latency", type=float, default=0.3)
+    parser.add_argument("--image-latency", type=float, default=0.6)
+    args = parser.parse_args()
+
+    mock = MockProviders(chat_latency=args.chat_latency, image_latency=args.image_latency)
+    mock.start()
+
+    print(f"{'users':>5} {'plans/min':>9} {'submit p50':>10} {'p95':>7} {'rerun p50':>9} {'p95':>7} {'p99':>7}"
+          f" {'lag p99':>8} {'lag max':>8} {'blocked':>8} {'peak RSS':>9} {'errors':>6}")
+    for users in [int(u) for u in args.users.split(',')]:
+        result = run_level(users, args.plans, args.reruns, mock.environ())
+        t, lags = result["timings"], result["lags"]
+        throughput = len(t["submit"]) / result["wall"] * 60
+        print(f"{users:>5} {throughput:>9.1f} {pct(t['submit'], 50):>9.2f}s {pct(t['submit'], 95):>6.2f}s"
+              f" {pct(t['rerun'], 50) * 1000:>7.0f}ms {pct(t['rerun'], 95) * 1000:>5.0f}ms {pct(t['rerun'], 99) * 1000:>5.0f}ms"
+              f" {pct(lags, 99) * 1000:>6.1f}ms {max(lags, default=0) * 1000:>6.0f}ms {sum(lags):>7.2f}s"
+              f" {result['peak_rss_mb']:>7.0f}MB {len(result['errors']):>6}")
+        for error in result["errors"]:
+            print(f"      error: {error}")
+
+
+if __name__ == "__main__":
+    main()
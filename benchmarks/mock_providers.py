@@ -0,0 +1,262 @@
+# Local mock of the OpenAI and Replicate endpoints used by the app.
+#
+# Serves chat completions, DALL-E image generations, Replicate predictions
+# (create / get / cancel, for both model and version refs) and the generated
+# files themselves, with configurable latency so load tests exercise the real
+# HTTP clients without API keys or cost. Like Replicate, a prediction created
+# with a `webhook` gets its completed state POSTed there (signed when a
+# webhook secret is set); `webhook_drop` loses a fraction of those calls to
+# exercise polling fallbacks. `concurrency` caps how many chat and image
+# requests are served at once (the rest wait in arrival order), like a
+# provider's per-key limits. Point the app at it with
+#
+#     OPENAI_BASE_URL=http://127.0.0.1:8900/v1 REPLICATE_BASE_URL=http://127.0.0.1:8900
+#
+# Run standalone:
+#
+#     python benchmarks/mock_providers.py --port 8900 --chat-latency 0.3 --image-latency 0.6
+import argparse
+import asyncio
+import base64
+import contextlib
+import hashlib
+import hmac
+import itertools
+import json
+import random
+import threading
+import time
+from io import BytesIO
+
+from aiohttp import web
+
+PNG_SIZE = (512, 512)
+AUDIO_BYTES = 256 * 1024
+
+
+def _png(seed, size=PNG_SIZE):
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    blocks = (rng.random((16, 16, 3)) * 255).astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(blocks).resize(size, Image.NEAREST).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _origin(request):
+    return f"{request.scheme}://{request.host}"
+
+
+class MockProviders:
+    def __init__(self, chat_latency=0.3, image_latency=0.6, music_latency=2.0, jitter=0.3, text_bytes=2000,
+                 webhook_secret=None, webhook_drop=0.0, concurrency=None):
+        self.chat_latency = chat_latency
+        self.image_latency = image_latency
+        self.music_latency = music_latency
+        self.jitter = jitter
+        self.text_bytes = text_bytes
+        self.webhook_secret = webhook_secret
+        self.webhook_drop = webhook_drop
+        self._slots = asyncio.Semaphore(concurrency) if concurrency else contextlib.nullcontext()
+        self.requests = 0
+        self.webhooks_sent = 0
+        self._ids = itertools.count(1)
+        self._predictions = {}
+        self._files = {}
+        self._runner = None
+        self._loop = None
+        self.base_url = None
+
+    def _delay(self, latency):
+        return max(0.0, latency * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def _file_url(self, origin, extension):
+        return f"{origin}/files/{next(self._ids)}.{extension}"
+
+    def _text(self, prompt):
+        line = f"Mock answer for: {prompt[:80]}\n"
+        return line * max(1, self.text_bytes // len(line))
+
+    async def chat(self, request):
+        self.requests += 1
+        body = await request.json()
+        async with self._slots:
+            await asyncio.sleep(self._delay(self.chat_latency))
+        prompt = body['messages'][-1]['content']
+        return web.json_response({
+            'id': f"chatcmpl-{next(self._ids)}", 'object': 'chat.completion', 'model': body.get('model'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': self._text(prompt)}, 'finish_reason': 'stop'}],
+        })
+
+    async def images(self, request):
+        self.requests += 1
+        await request.json()
+        async with self._slots:
+            await asyncio.sleep(self._delay(self.image_latency))
+        return web.json_response({'created': int(time.time()), 'data': [{'url': self._file_url(_origin(request), 'png')}]})
+
+    # Replicate predictions finish after the model's latency; output depends on the model
+    def _output(self, origin, model, input):
+        if 'musicgen' in model:
+            return self._file_url(origin, 'mp3')
+        if 'llama' in model:
+            text = self._text(input.get('prompt', ''))
+            return [text[i:i + 8] for i in range(0, len(text), 8)]  # streamed tokens
+        if 'sdxl' in model:
+            return [self._file_url(origin, 'png')]
+        return self._file_url(origin, 'png')
+
+    def _latency(self, model):
+        if 'musicgen' in model:
+            return self.music_latency
+        if 'llama' in model:
+            return self.chat_latency
+        return self.image_latency
+
+    def _prediction_json(self, origin, prediction):
+        now = time.time()
+        if prediction['status'] in ('starting', 'processing') and now >= prediction['ready_at']:
+            prediction['status'] = 'succeeded'
+            prediction['output'] = self._output(origin, prediction['model'], prediction['input'])
+            prediction['completed_at'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now))
+        base = f"{origin}/v1/predictions/{prediction['id']}"
+        return {
+            'id': prediction['id'], 'model': prediction['model'], 'version': prediction['version'],
+            'status': prediction['status'], 'input': prediction['input'], 'output': prediction.get('output'),
+            'logs': '', 'error': None, 'metrics': {}, 'created_at': prediction['created_at'],
+            'started_at': prediction['created_at'], 'completed_at': prediction.get('completed_at'),
+            'urls': {'get': base, 'cancel': f"{base}/cancel"},
+        }
+
+    async def create_prediction(self, request):
+        self.requests += 1
+        body = await request.json()
+        if 'owner' in request.match_info:
+            model, version = f"{request.match_info['owner']}/{request.match_info['name']}", 'latest'
+        else:
+            model, version = 'unknown/model', body.get('version', '')
+        prediction = {
+            'id': f"mock{next(self._ids)}", 'model': model, 'version': version, 'status': 'starting',
+            'input': body.get('input') or {}, 'ready_at': time.time() + self._delay(self._latency(model)),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        }
+        self._predictions[prediction['id']] = prediction
+        if body.get('webhook'):
+            asyncio.ensure_future(self._deliver_webhook(_origin(request), prediction, body['webhook']))
+        return web.json_response(self._prediction_json(_origin(request), prediction), status=201)
+
+    def _signature_headers(self, body):
+        webhook_id = f"msg_{next(self._ids)}"
+        timestamp = str(int(time.time()))
+        secret = base64.b64decode(self.webhook_secret.split('_', 1)[1])
+        digest = hmac.new(secret, f"{webhook_id}.{timestamp}.{body}".encode(), hashlib.sha256).digest()
+        return {'webhook-id': webhook_id, 'webhook-timestamp': timestamp,
+                'webhook-signature': 'v1,' + base64.b64encode(digest).decode()}
+
+    # POST the finished prediction to its webhook, as Replicate does
+    async def _deliver_webhook(self, origin, prediction, url):
+        import aiohttp
+
+        await asyncio.sleep(max(0.0, prediction['ready_at'] - time.time()))
+        if prediction['status'] == 'canceled' or random.random() < self.webhook_drop:
+            return
+        body = json.dumps(self._prediction_json(origin, prediction))
+        headers = {'Content-Type': 'application/json'}
+        if self.webhook_secret:
+            headers.update(self._signature_headers(body))
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(url, data=body, headers=headers) as response:
+                    await response.read()
+            self.webhooks_sent += 1
+        except aiohttp.ClientError:
+            pass
+
+    async def get_prediction(self, request):
+        self.requests += 1
+        prediction = self._predictions.get(request.match_info['id'])
+        if prediction is None:
+            return web.json_response({'detail': 'Not found.'}, status=404)
+        return web.json_response(self._prediction_json(_origin(request), prediction))
+
+    async def cancel_prediction(self, request):
+        self.requests += 1
+        prediction = self._predictions.get(request.match_info['id'])
+        if prediction is None:
+            return web.json_response({'detail': 'Not found.'}, status=404)
+        if prediction['status'] in ('starting', 'processing'):
+            prediction['status'] = 'canceled'
+        return web.json_response(self._prediction_json(_origin(request), prediction))
+
+    async def file(self, request):
+        name = request.match_info['name']
+        body = self._files.get(name)
+        if body is None:
+            file_id, _, extension = name.partition('.')
+            body = _png(int(file_id)) if extension == 'png' else bytes(AUDIO_BYTES)
+            self._files[name] = body
+        content_type = 'image/png' if name.endswith('.png') else 'audio/mpeg'
+        return web.Response(body=body, content_type=content_type)
+
+    # Serve `body` at /files/<name> instead of a generated file
+    def add_file(self, name, body):
+        self._files[name] = body
+
+    def app(self):
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post('/v1/chat/completions', self.chat)
+        app.router.add_post('/v1/images/generations', self.images)
+        app.router.add_post('/v1/predictions', self.create_prediction)
+        app.router.add_post('/v1/models/{owner}/{name}/predictions', self.create_prediction)
+        app.router.add_get('/v1/predictions/{id}', self.get_prediction)
+        app.router.add_post('/v1/predictions/{id}/cancel', self.cancel_prediction)
+        app.router.add_get('/files/{name}', self.file)
+        return app
+
+    # Serve on a background thread; returns the base URL
+    def start(self, host='127.0.0.1', port=0):
+        started = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._runner = web.AppRunner(self.app(), access_log=None)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, host, port)
+            self._loop.run_until_complete(site.start())
+            bound_port = self._runner.addresses[0][1]
+            self.base_url = f"http://{host}:{bound_port}"
+            started.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=serve, name='mock-providers', daemon=True).start()
+        started.wait()
+        return self.base_url
+
+    # Environment variables that point the app at this server
+    def environ(self):
+        return {'OPENAI_BASE_URL': f"{self.base_url}/v1", 'REPLICATE_BASE_URL': self.base_url}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--chat-latency", type=float, default=0.3)
+    parser.add_argument("--image-latency", type=float, default=0.6)
+    parser.add_argument("--music-latency", type=float, default=2.0)
+    parser.add_argument("--webhook-secret", help="sign webhook calls with this whsec_... secret")
+    parser.add_argument("--webhook-drop", type=float, default=0.0, help="fraction of webhook calls to drop")
+    parser.add_argument("--concurrency", type=int, help="chat/image requests served at once")
+    args = parser.parse_args()
+
+    mock = MockProviders(args.chat_latency, args.image_latency, args.music_latency,
+                         webhook_secret=args.webhook_secret, webhook_drop=args.webhook_drop,
+                         concurrency=args.concurrency)
+    web.run_app(mock.app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
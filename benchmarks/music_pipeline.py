@@ -0,0 +1,76 @@
+# Cost of post-processing a generated track (services/audio.py).
+#
+# Builds a synthetic track of --seconds: an intro followed by a repeating
+# 6-second phrase, encoded as WAV and, when ffmpeg is available, as MP3 like
+# MusicGen's output. Times process_music (decode, peaks, loop search, loop
+# encode) and reports the loop it found, which should be a multiple of 6 s,
+# and the size of the waveform preview against the audio. Usage:
+#
+#     python benchmarks/music_pipeline.py --seconds 30 120 300
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import audio  # noqa: E402
+
+RATE = 32000
+PHRASE_SECONDS = 6.0
+
+
+def synthetic_track(seconds, seed=1):
+    rng = np.random.default_rng(seed)
+
+    def note(frequency, length):
+        t = np.arange(int(length * RATE)) / RATE
+        return (np.sin(2 * np.pi * frequency * t) + 0.3 * np.sin(4 * np.pi * frequency * t)) * np.exp(-3 * t)
+
+    intro = np.concatenate([note(rng.uniform(100, 300), 0.5) for _ in range(6)])
+    phrase = np.concatenate([note(f, PHRASE_SECONDS / 16) for f in rng.choice([220, 247, 262, 294, 330, 392, 440], 16)])
+    repeats = int(np.ceil((seconds - 3) / PHRASE_SECONDS))
+    track = np.concatenate([intro] + [phrase] * repeats)[:int(seconds * RATE)]
+    track = track + 0.01 * rng.standard_normal(len(track))
+    return (np.stack([track, track * 0.8], axis=1) * 0.4).astype(np.float32)
+
+
+def to_mp3(wav):
+    command = [audio.FFMPEG, '-v', 'error', '-f', 'wav', '-i', 'pipe:0', '-f', 'mp3', '-b:a', '192k', 'pipe:1']
+    return subprocess.run(command, input=wav, capture_output=True, check=True).stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, nargs='+', default=[30, 120, 300])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    if not audio.FFMPEG:
+        print("ffmpeg not found: timing WAV input only (set GAMEDEV_FFMPEG to time MP3 decoding)")
+    print(f"{'input':<5} {'length':>7} {'audio':>9} {'p50':>7} {'loop':>17} {'loop len':>8} {'score':>5} {'peaks':>7}")
+    for seconds in args.seconds:
+        wav = audio.encode_wav(synthetic_track(seconds), RATE)
+        inputs = {'wav': wav}
+        if audio.FFMPEG:
+            inputs['mp3'] = to_mp3(wav)
+        for kind, data in inputs.items():
+            timings = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                result = audio.process_music(data)
+                timings.append(time.perf_counter() - started)
+            loop = result['loop']
+            score = '-' if loop['score'] is None else f"{loop['score']:.2f}"
+            preview = len(json.dumps(result['peaks']))
+            print(f"{kind:<5} {seconds:>6.0f}s {len(data) / 1024:>7.0f}KB {sorted(timings)[len(timings) // 2]:>6.2f}s"
+                  f" {loop['start']:>7.2f}-{loop['end']:<8.2f} {loop['end'] - loop['start']:>7.2f}s {score:>5}"
+                  f" {preview / 1024:>5.1f}KB")
+
+
+if __name__ == "__main__":
+    main()
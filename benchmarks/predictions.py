@@ -0,0 +1,105 @@
+# Compare ways of waiting for many concurrent Replicate predictions.
+#
+# Runs N predictions against the local Replicate stand-in
+# (benchmarks/mock_providers.py) three ways: the client's own per-call poll
+# loop (prediction.async_wait, the previous behaviour), the prediction
+# manager with adaptive polling only, and the manager with a signed webhook
+# receiver (some callbacks dropped so the polling safety net is exercised).
+# Reports wall time, how late completion was noticed after the prediction
+# actually finished, and API requests per prediction. Usage:
+#
+#     python benchmarks/predictions.py --predictions 1000 --latency 3 --webhook-drop 0.05
+import argparse
+import asyncio
+import base64
+import os
+import socket
+import sys
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+sys.path.insert(0, BENCHMARKS)
+
+from mock_providers import MockProviders  # noqa: E402
+
+MODEL = "black-forest-labs/flux-pro"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# Previous behaviour: a client and a poll loop per call
+async def poll_loop_run(tag):
+    import replicate
+
+    client = replicate.Client(api_token='mock')
+    prediction = await client.models.predictions.async_create(model=MODEL, input={'prompt': 'x', 'tag': tag})
+    await prediction.async_wait()
+    return prediction.status
+
+
+async def manager_run(manager, tag):
+    result = await manager.run('mock', MODEL, {'prompt': 'x', 'tag': tag})
+    return result['status']
+
+
+def run_mode(mock, label, count, make_call):
+    finished = {}
+
+    async def one(call, tag):
+        status = await call(tag)
+        finished[tag] = (time.time(), status)
+
+    async def main():
+        call = make_call()
+        await asyncio.gather(*(one(call, tag) for tag in range(count)))
+
+    requests_before = mock.requests
+    started = time.perf_counter()
+    asyncio.run(main())
+    wall = time.perf_counter() - started
+
+    ready = {p['input'].get('tag'): p['ready_at'] for p in mock._predictions.values() if 'ready_at' in p}
+    delays = sorted(max(0.0, finished[tag][0] - ready[tag]) for tag in finished if tag in ready)
+    ok = sum(1 for _, status in finished.values() if status == 'succeeded')
+    mock._predictions.clear()
+    print(f"{label:24} wall {wall:6.2f}s  ok {ok}/{count}  noticed late p50 {delays[len(delays) // 2]:.2f}s"
+          f" p95 {delays[int(len(delays) * 0.95) - 1]:.2f}s  requests/prediction {(mock.requests - requests_before) / count:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--predictions", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=3.0, help="mean prediction run time in seconds")
+    parser.add_argument("--webhook-drop", type=float, default=0.05)
+    args = parser.parse_args()
+
+    secret = 'whsec_' + base64.b64encode(os.urandom(24)).decode()
+    mock = MockProviders(image_latency=args.latency, webhook_secret=secret, webhook_drop=args.webhook_drop)
+    mock.start()
+    os.environ.update(mock.environ())
+    os.environ.setdefault('GAMEDEV_METRICS_PORT', '0')
+    os.environ.setdefault('GAMEDEV_LOG_LEVEL', 'WARNING')
+
+    from services.predictions import PredictionManager
+
+    run_mode(mock, "client poll loop", args.predictions,
+             lambda: poll_loop_run)
+
+    polling = PredictionManager(webhook_url=None)
+    run_mode(mock, "manager, polling", args.predictions, lambda: (lambda tag: manager_run(polling, tag)))
+    run_mode(mock, "manager, polling (warm)", args.predictions, lambda: (lambda tag: manager_run(polling, tag)))
+
+    port = free_port()
+    webhooks = PredictionManager(webhook_url=f"http://127.0.0.1:{port}/replicate/webhook", port=port, secret=secret)
+    run_mode(mock, "manager, webhook", args.predictions, lambda: (lambda tag: manager_run(webhooks, tag)))
+    run_mode(mock, "manager, webhook (warm)", args.predictions, lambda: (lambda tag: manager_run(webhooks, tag)))
+    print(f"webhook manager: {webhooks.stats()}")
+
+
+if __name__ == "__main__":
+    main()
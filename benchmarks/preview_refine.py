@@ -0,0 +1,75 @@
+# Time to first results with preview-then-refine images (services/refinement.py).
+#
+# Generates --images images the classic way (every image rendered with the
+# high-quality model before any is shown) and tiered (PREVIEW_MODEL previews
+# first, refined in the background by a Refiner, with --reject of them
+# stopped as soon as their previews show). The image task is replaced by a
+# stand-in that sleeps each model's typical latency times --scale, so the
+# numbers show the scheduling only. Usage:
+#
+#     python benchmarks/preview_refine.py --images 12 --model dall-e-3 --reject 0.25
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import tasks  # noqa: E402
+from services.providers import IMAGE_PRICES  # noqa: E402
+from services.refinement import PREVIEW_MODEL, Refiner  # noqa: E402
+
+# Typical seconds per image
+LATENCY = {'dall-e-3': 12.0, 'SD Flux-1': 8.0, PREVIEW_MODEL: 1.5}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=12)
+    parser.add_argument("--model", default='dall-e-3', choices=[m for m in LATENCY if m != PREVIEW_MODEL])
+    parser.add_argument("--reject", type=float, default=0.25)
+    parser.add_argument("--scale", type=float, default=0.1)
+    args = parser.parse_args()
+
+    async def image(payload, api_keys):
+        await asyncio.sleep(LATENCY[payload['model']] * args.scale)
+        return f"https://images.example/{payload['model']}/{payload['prompt']}.png"
+
+    tasks.HANDLERS['image'] = image
+    keys = {'openai': 'benchmark', 'replicate': 'benchmark'}
+
+    def payload(model, index):
+        return {'model': model, 'prompt': f"image {index}", 'size': [1024, 1024]}
+
+    async def render(model):
+        return await asyncio.gather(*[tasks.dispatch('image', payload(model, i), keys) for i in range(args.images)])
+
+    started = time.perf_counter()
+    asyncio.run(render(args.model))
+    classic = time.perf_counter() - started
+
+    started = time.perf_counter()
+    previews = asyncio.run(render(PREVIEW_MODEL))
+    first = time.perf_counter() - started
+    refiner = Refiner()
+    for i, preview in enumerate(previews):
+        refiner.start(f"image_{i}", preview, lambda i=i: tasks.dispatch('image', payload(args.model, i), keys),
+                      IMAGE_PRICES[args.model])
+    for i in range(int(args.images * args.reject)):
+        refiner.cancel(f"image_{i}")
+    while refiner.active:
+        time.sleep(0.01)
+    final = time.perf_counter() - started
+    stats = refiner.stats()
+
+    full_cost = args.images * IMAGE_PRICES[args.model]
+    tiered_cost = args.images * IMAGE_PRICES[PREVIEW_MODEL] + stats['done'] * IMAGE_PRICES[args.model]
+    print(f"{'':<8} {'results shown':>13} {'all final':>9} {'spend':>8}")
+    print(f"{'classic':<8} {classic:>12.2f}s {classic:>8.2f}s {full_cost:>7.3f}$")
+    print(f"{'tiered':<8} {first:>12.2f}s {final:>8.2f}s {tiered_cost:>7.3f}$"
+          f"  ({stats['done']} refined, {stats['cancelled']} stopped)")
+
+
+if __name__ == "__main__":
+    main()
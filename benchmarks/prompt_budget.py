@@ -0,0 +1,148 @@
+# Compare per-plan prompt size and assembly time before and after the
+# prompt engine (services/prompt_engine.py).
+#
+# Builds every prompt of one plan (text elements, images, scripts, music) for a
+# long generated game concept, once with the previous f-string prompts, which
+# embed the whole concept in every image and music prompt, and once with the
+# budgeted templates. Reports input tokens per plan for each image model, how
+# many prompts exceed DALL-E 3's 4000-character limit, the time to assemble the
+# image prompts (built five times per plan by the generation, dedup, texture
+# and catalog steps) and the prefill time implied by the token counts. Usage:
+#
+#     python benchmarks/prompt_budget.py --concept-tokens 2000 --images 2 --prefill-ms 30
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from services import prompt_engine  # noqa: E402
+from services.prompt_engine import count_tokens  # noqa: E402
+from services.prompts import (  # noqa: E402
+    IMAGE_PROMPTS, IMAGE_SIZES, IMAGE_TYPES, SCRIPT_DESCRIPTIONS, SCRIPT_TYPES, SYSTEM_PROMPT,
+    build_image_requests, build_script_requests, element_prompt, music_prompt, system_prompt,
+)
+from services.providers import IMAGE_MODELS  # noqa: E402
+
+DALLE_PROMPT_LIMIT = 4000
+IMAGE_BUILDS_PER_PLAN = 5
+ELEMENTS = ['game_concept', 'world_concept', 'character_concepts', 'plot']
+SECTIONS = ['Overview', 'Setting', 'Characters', 'Core Mechanics', 'Progression', 'Enemies', 'Art Style', 'Audio']
+NOUNS = ['lantern', 'volcano', 'forge', 'crystal', 'moth', 'ember', 'golem', 'tunnel', 'relic', 'tide', 'sunstone',
+         'cavern', 'ash', 'bridge', 'shrine', 'spirit', 'ore', 'beacon', 'map', 'guild']
+VERBS = ['reveals', 'guards', 'powers', 'reshapes', 'hides', 'awakens', 'feeds', 'shatters', 'links', 'echoes']
+
+
+# Markdown concept of roughly `tokens` tokens, like a long game_concept result
+def make_concept(tokens, seed=7):
+    rng = random.Random(seed)
+    lines = ["# Game Title: Ember Hollow", ""]
+    while count_tokens('\n'.join(lines)) < tokens:
+        lines += [f"## {rng.choice(SECTIONS)}"]
+        for _ in range(4):
+            a, b, c = rng.sample(NOUNS, 3)
+            lines.append(f"Each {a} {rng.choice(VERBS)} the {b} near the {c}, so players must plan every descent "
+                         f"around the {rng.choice(NOUNS)} and the {rng.choice(NOUNS)}.")
+        lines.append("")
+    return '\n'.join(lines)
+
+
+def legacy_image_requests(customization, game_concept):
+    results = {}
+    for img_type in customization['image_types']:
+        for i in range(customization['image_count'].get(img_type, 0)):
+            prompt = f"{IMAGE_PROMPTS[img_type]} The design should fit the following game concept: {game_concept}. Variation {i + 1}"
+            results[f"{img_type.lower()}_image_{i + 1}"] = (prompt, IMAGE_SIZES[img_type])
+    return results
+
+
+def legacy_chat_prompts(customization, user_prompt):
+    prompts = []
+    for element in ELEMENTS:
+        prompts.append((SYSTEM_PROMPT.format(role="game design"),
+                        f"Create a detailed {element.replace('_', ' ')} for the following game concept: {user_prompt}"))
+    for script_type in customization['script_types']:
+        for code_type in ('unity', 'unreal'):
+            prompts.append((SYSTEM_PROMPT.format(role="game development"),
+                            f"{SCRIPT_DESCRIPTIONS[script_type]} The script should be for {code_type.capitalize()}. Generate ONLY the code, without any explanations or comments outside the code. Ensure the code is complete and can be directly used in a project."))
+    return prompts
+
+
+def engine_chat_prompts(customization, user_prompt):
+    prompts = [(system_prompt("game design"), element_prompt(element, user_prompt)) for element in ELEMENTS]
+    for script_type, desc in build_script_requests(customization).values():
+        prompts.append((system_prompt("game development"), desc))
+    return prompts
+
+
+def customization_for(model, images):
+    return {
+        'image_model': model,
+        'image_types': list(IMAGE_TYPES),
+        'image_count': {t: images for t in IMAGE_TYPES},
+        'script_types': list(SCRIPT_TYPES),
+        'script_count': {t: 1 for t in SCRIPT_TYPES},
+        'code_types': {'unity': True, 'unreal': True, 'blender': False},
+    }
+
+
+def timed_builds(build, customization, concept):
+    started = time.perf_counter()
+    for _ in range(IMAGE_BUILDS_PER_PLAN):
+        requests = build(customization, concept)
+    return requests, time.perf_counter() - started
+
+
+def measure(model, concept, images, chat_model):
+    customization = customization_for(model, images)
+    user_prompt = "A co-op dungeon crawler inside a living volcano"
+    rows = {}
+    for label in ('before', 'after'):
+        if label == 'before':
+            requests, seconds = timed_builds(legacy_image_requests, customization, concept)
+            chat = legacy_chat_prompts(customization, user_prompt)
+            music = f"Create background music for the game: {concept}"
+        else:
+            prompt_engine._summaries.clear()  # first plan with this concept pays for the summary
+            requests, seconds = timed_builds(build_image_requests, customization, concept)
+            chat = engine_chat_prompts(customization, user_prompt)
+            music = music_prompt(concept)
+        image_prompts = [prompt for prompt, _ in requests.values()]
+        rows[label] = {
+            'chat': sum(count_tokens(system, chat_model) + count_tokens(prompt, chat_model) for system, prompt in chat),
+            'image': sum(count_tokens(prompt, model) for prompt in image_prompts),
+            'music': count_tokens(music),
+            'over_limit': sum(len(prompt) > DALLE_PROMPT_LIMIT for prompt in image_prompts) if model == 'dall-e-3' else 0,
+            'build_ms': seconds * 1000,
+        }
+        rows[label]['total'] = rows[label]['chat'] + rows[label]['image'] + rows[label]['music']
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concept-tokens", type=int, default=2000, help="size of the generated game concept")
+    parser.add_argument("--images", type=int, default=2, help="variations per image type")
+    parser.add_argument("--chat-model", default="gpt-4")
+    parser.add_argument("--prefill-ms", type=float, default=30.0, help="prompt processing time per 1k input tokens")
+    args = parser.parse_args()
+
+    concept = make_concept(args.concept_tokens)
+    print(f"concept: {count_tokens(concept)} tokens, {len(concept)} chars;"
+          f" tokenizer: {'tiktoken' if prompt_engine._encoding() else 'local estimate'}")
+    print(f"{'image model':<15} {'':<7} {'chat':>6} {'image':>7} {'music':>6} {'total':>7} {'>4000ch':>8}"
+          f" {'build':>8} {'prefill':>8}")
+    for model in IMAGE_MODELS:
+        rows = measure(model, concept, args.images, args.chat_model)
+        for label, row in rows.items():
+            prefill = row['total'] * args.prefill_ms / 1000 / 1000
+            print(f"{model if label == 'before' else '':<15} {label:<7} {row['chat']:>6} {row['image']:>7} {row['music']:>6}"
+                  f" {row['total']:>7} {row['over_limit']:>8} {row['build_ms']:>6.2f}ms {prefill:>7.2f}s")
+        print(f"{'':<15} {'saved':<7} {1 - rows['after']['total'] / rows['before']['total']:>30.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# Full-plan benchmark on recorded provider traffic (services/cassettes.py).
+#
+# `record` runs the load test's user flow (benchmarks/load_test.py: load the
+# page, fill the form, generate a plan, rerun the Results tab) against the
+# local provider mock with GAMEDEV_CASSETTE_MODE=record and prints what the
+# cassette holds. To record real provider traffic instead, run the app itself
+# with GAMEDEV_CASSETTE=<file> GAMEDEV_CASSETTE_MODE=record.
+# `replay` runs the same flow with the provider URLs pointed at a closed
+# port, so any request missing from the cassette fails instead of reaching
+# the network, once per latency scale and user count. Runs on identical
+# traffic are comparable across scheduling changes. Usage:
+#
+#     python benchmarks/replay_plan.py record plan.cassette --plans 2
+#     python benchmarks/replay_plan.py replay plan.cassette --scale 1 0.5 0 --users 1,4
+import argparse
+import json
+import os
+import statistics
+import sys
+import zipfile
+from collections import defaultdict
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+
+from load_test import pct, run_level  # noqa: E402
+from mock_providers import MockProviders  # noqa: E402
+
+OFFLINE = {'OPENAI_BASE_URL': 'http://127.0.0.1:9/v1', 'REPLICATE_BASE_URL': 'http://127.0.0.1:9'}
+
+
+def describe(path):
+    with zipfile.ZipFile(path) as archive:
+        interactions = [json.loads(line) for line in archive.read('interactions.jsonl').decode().splitlines() if line]
+        stored = sum(info.compress_size for info in archive.infolist())
+        raw = sum(info.file_size for info in archive.infolist())
+    print(f"{path}: {len(interactions)} requests, {raw / 1024:.0f} KiB of bodies stored in {os.path.getsize(path) / 1024:.0f} KiB"
+          f" ({stored / max(raw, 1):.0%} after compression)")
+    routes = defaultdict(list)
+    for item in interactions:
+        route = item['path'].split('?')[0]
+        if route.startswith('/files/') or '.' in route.rsplit('/', 1)[-1]:
+            route = 'asset download'
+        elif item['method'] == 'GET' and '/predictions/' in route:
+            route = 'prediction poll'
+        routes[(item['method'], route)].append(item['duration'])
+    print(f"{'method':<6} {'endpoint':<40} {'count':>5} {'p50':>7} {'max':>7}")
+    for (method, route), durations in sorted(routes.items()):
+        print(f"{method:<6} {route:<40} {len(durations):>5} {statistics.median(durations):>6.2f}s {max(durations):>6.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("mode", choices=['record', 'replay'])
+    parser.add_argument("cassette")
+    parser.add_argument("--plans", type=int, default=1, help="plans generated per user")
+    parser.add_argument("--reruns", type=int, default=2, help="Results tab reruns after each plan")
+    parser.add_argument("--users", default="1", help="comma-separated concurrency levels (replay)")
+    parser.add_argument("--scale", type=float, nargs='+', default=[1.0], help="latency scales (replay)")
+    parser.add_argument("--chat-latency", type=float, default=0.3)
+    parser.add_argument("--image-latency", type=float, default=0.6)
+    args = parser.parse_args()
+    cassette = os.path.abspath(args.cassette)
+
+    if args.mode == 'record':
+        mock = MockProviders(chat_latency=args.chat_latency, image_latency=args.image_latency)
+        mock.start()
+        env = dict(mock.environ(), GAMEDEV_CASSETTE=cassette, GAMEDEV_CASSETTE_MODE='record')
+        result = run_level(1, args.plans, args.reruns, env)
+        print(f"recorded {len(result['timings']['submit'])} plans, submit p50 {pct(result['timings']['submit'], 50):.2f}s,"
+              f" {len(result['errors'])} errors")
+        describe(cassette)
+        return
+
+    describe(cassette)
+    print(f"{'scale':>5} {'users':>5} {'plans/min':>9} {'submit p50':>10} {'max':>7} {'errors':>6}")
+    for scale in args.scale:
+        for users in [int(u) for u in args.users.split(',')]:
+            env = dict(OFFLINE, GAMEDEV_CASSETTE=cassette, GAMEDEV_CASSETTE_MODE='replay',
+                       GAMEDEV_CASSETTE_LATENCY_SCALE=str(scale))
+            result = run_level(users, args.plans, args.reruns, env)
+            submits = result['timings']['submit']
+            print(f"{scale:>5} {users:>5} {len(submits) / result['wall'] * 60:>9.1f} {pct(submits, 50):>9.2f}s"
+                  f" {max(submits):>6.2f}s {len(result['errors']):>6}")
+            for error in result['errors']:
+                print(f"      error: {error}")
+
+
+if __name__ == "__main__":
+    main()
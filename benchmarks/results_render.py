@@ -0,0 +1,110 @@
+# Per-rerun cost of the Results tab for a large plan.
+#
+# Serves --images full-size images from the local provider mock, puts a plan
+# with that many images and --scripts scripts (plus the text elements) into
+# an AppTest session and reruns the script --reruns times, as every widget
+# interaction does. Reports the rerun time and what each rerun sends to the
+# browser: the number of elements, their serialized size and the bytes of
+# media (images) registered for download. Usage:
+#
+#     python benchmarks/results_render.py --images 50 --scripts 36 --reruns 5
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from io import BytesIO
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, BENCHMARKS)
+
+from mock_providers import MockProviders  # noqa: E402
+
+CHILD = r'''
+import json, sys, time
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.testing.v1 import AppTest
+
+base, images, scripts, reruns = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4])
+media = [0]
+store = MemoryMediaFileStorage.load_and_get_id
+
+
+def counted(self, path_or_data, mimetype, kind, filename=None):
+    media[0] += len(path_or_data) if isinstance(path_or_data, bytes) else 0
+    return store(self, path_or_data, mimetype, kind, filename)
+
+
+MemoryMediaFileStorage.load_and_get_id = counted
+
+types = ["character", "enemy", "background", "item"]
+code = "\n".join(f"    public float value{i} = {i}.0f; // tuning for the generated behaviour" for i in range(120))
+text = " ".join(["The volcano's heart pulses with ember light while the guilds race for sunstone."] * 40)
+plan = {
+    "game_concept": text, "world_concept": text, "character_concepts": text, "plot": text,
+    "images": {f"{types[i % 4]}_image_{i // 4 + 1}": f"{base}/files/{i}.png" for i in range(images)},
+    "scripts": {f"script_{i}_unity.cs": "public class Generated {\n" + code + "\n}" for i in range(scripts)},
+    "additional_elements": {"storyline": text, "dialogue": text},
+    "music": None,
+}
+
+at = AppTest.from_file("app.py", default_timeout=600)
+at.session_state["api_keys"] = {"openai": "mock", "replicate": "mock"}
+at.session_state["game_plan"] = plan
+at.run()  # first render fills the caches (and the export ZIP)
+rows = []
+for _ in range(reruns):
+    media[0] = 0
+    started = time.perf_counter()
+    at.run()
+    seconds = time.perf_counter() - started
+    nodes = [node for node in at.main if hasattr(node, "proto") and node.proto is not None]
+    rows.append({"seconds": seconds, "elements": len(nodes), "proto_bytes": sum(node.proto.ByteSize() for node in nodes),
+                 "media_bytes": media[0], "errors": [str(e.message) for e in at.exception]})
+print(json.dumps(rows))
+'''
+
+
+# 1024x1024 PNG with gradients and grain, about the size of a generated image
+def generated_png(seed):
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:1024, 0:1024]
+    pixels = np.stack([(x + seed * 37) % 256, (y * 2 + seed) % 256, (x + y) % 256], axis=-1).astype(np.int16)
+    pixels += rng.integers(-12, 12, pixels.shape, dtype=np.int16)
+    buffer = BytesIO()
+    Image.fromarray(pixels.clip(0, 255).astype(np.uint8)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--scripts", type=int, default=36)
+    parser.add_argument("--reruns", type=int, default=5)
+    args = parser.parse_args()
+
+    mock = MockProviders()
+    base = mock.start()
+    for i in range(args.images):
+        mock.add_file(f"{i}.png", generated_png(i))
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(os.environ, GAMEDEV_DATA_DIR=data_dir, GAMEDEV_METRICS_PORT='0', GAMEDEV_LOG_LEVEL='WARNING')
+        output = subprocess.run([sys.executable, "-c", CHILD, base, str(args.images), str(args.scripts), str(args.reruns)],
+                                cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+    rows = json.loads(output.strip().splitlines()[-1])
+    seconds = sorted(row['seconds'] for row in rows)
+    last = rows[-1]
+    print(f"{args.images} images, {args.scripts} scripts: rerun p50 {seconds[len(seconds) // 2] * 1000:.0f}ms,"
+          f" max {seconds[-1] * 1000:.0f}ms; {last['elements']} elements, {last['proto_bytes'] / 1024:.0f} KiB of"
+          f" elements and {last['media_bytes'] / 1024:.0f} KiB of images per rerun")
+    for error in last['errors']:
+        print(f"  error: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# Measure server memory as simulated sessions accumulate.
+#
+# Drives N AppTest sessions in one process (like one Streamlit server), each
+# submitting the form once with fake providers that return large text, and
+# keeps every session's state alive. Reports process RSS, the traced Python
+# heap (RSS also includes AppTest's own per-session overhead) and the size
+# of the plan held in each session's state, with plans kept in the shared
+# content store (default) and, for comparison, inline in session state.
+# Usage:
+#
+#     python benchmarks/session_memory.py --sessions 50 --text-kb 64
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r'''
+import asyncio, gc, json, pickle, sys, tracemalloc
+from streamlit.testing.v1 import AppTest
+from services import providers
+
+sessions, text_kb = int(sys.argv[1]), int(sys.argv[2])
+calls = [0]
+
+async def chat(api_keys, model, system, prompt):
+    calls[0] += 1
+    line = f"{calls[0]} {prompt[:60]}\n"
+    return line * (text_kb * 1024 // len(line))
+
+providers.chat = chat
+
+def rss_mb():
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def session():
+    at = AppTest.from_file("app.py", default_timeout=120)
+    at.session_state["api_keys"] = {"openai": "x", "replicate": "y"}
+    at.run()
+    at.number_input(key="script_count_Player").set_value(2)
+    for key in ("unity", "unreal", "blender"):
+        at.checkbox(key=key).check()
+    for checkbox in at.checkbox:
+        if checkbox.label in ("Detailed Storyline", "Sample Dialogue", "Game Mechanics Description", "Level Design Document"):
+            checkbox.check()
+    at.text_area[0].input(f"session {len(alive)} platformer")
+    at.button(key="FormSubmitter:generation_form-Generate Game Plan").click().run()
+    if at.exception:
+        raise SystemExit(str(at.exception))
+    # A real server keeps the session state, not the rendered element tree
+    return at.session_state
+
+def sample(count):
+    gc.collect()
+    return {"sessions": count, "rss_mb": rss_mb(), "heap_mb": tracemalloc.get_traced_memory()[0] / 2 ** 20}
+
+alive = []
+tracemalloc.start(1)
+samples = [sample(0)]
+for i in range(sessions):
+    alive.append(session())
+    if (i + 1) % 10 == 0 or i + 1 == sessions:
+        samples.append(sample(i + 1))
+state_bytes = len(pickle.dumps(alive[-1]["game_plan"]))
+print(json.dumps({"samples": samples, "state_bytes": state_bytes}))
+'''
+
+
+def run(sessions, text_kb, inline):
+    env = dict(os.environ, GAMEDEV_METRICS_PORT='0')
+    env['GAMEDEV_STORE_INLINE_LIMIT'] = str(sys.maxsize) if inline else env.get('GAMEDEV_STORE_INLINE_LIMIT', '512')
+    with tempfile.TemporaryDirectory() as data_dir:
+        env['GAMEDEV_DATA_DIR'] = data_dir
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD, str(sessions), str(text_kb)],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--text-kb", type=int, default=64, help="size of each generated text result")
+    args = parser.parse_args()
+
+    for label, inline in (("content store", False), ("inline state", True)):
+        result = run(args.sessions, args.text_kb, inline)
+        print(f"{label}: plan held per session {result['state_bytes'] / 1024:.1f} KiB")
+        print(f"  {'sessions':>8} {'RSS MiB':>9} {'heap MiB':>9}")
+        for s in result["samples"]:
+            print(f"  {s['sessions']:>8} {s['rss_mb']:>9.1f} {s['heap_mb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
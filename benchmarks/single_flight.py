@@ -0,0 +1,71 @@
+# Provider calls saved by single-flight deduplication (services/singleflight.py).
+#
+# --sessions threads each run a plan of --requests chat requests at once, as
+# Streamlit sessions do, drawing prompts from a pool of --distinct so that
+# sessions overlap. The chat task is replaced by a stand-in that sleeps
+# --latency seconds, so the numbers show only the dispatch layer: provider
+# calls made, requests coalesced and the added overhead per request.
+# Usage:
+#
+#     python benchmarks/single_flight.py --sessions 20 --requests 12 --distinct 30
+import argparse
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import tasks  # noqa: E402
+from services.singleflight import get_single_flight  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=12)
+    parser.add_argument("--distinct", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    calls = []
+
+    async def chat(payload, api_keys):
+        calls.append(payload['prompt'])
+        await asyncio.sleep(args.latency)
+        return f"reply to {payload['prompt']}"
+
+    tasks.HANDLERS['chat'] = chat
+    keys = {'openai': 'benchmark'}
+    rng = random.Random(1)
+    plans = [[f"prompt {rng.randrange(args.distinct)}" for _ in range(args.requests)] for _ in range(args.sessions)]
+    timings = []
+
+    def session(prompts):
+        async def run():
+            started = time.perf_counter()
+            await asyncio.gather(*[tasks.dispatch('chat', {'model': 'gpt-4', 'system': 's', 'prompt': prompt}, keys)
+                                   for prompt in prompts])
+            timings.append(time.perf_counter() - started)
+        asyncio.run(run())
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=session, args=(plan,)) for plan in plans]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    requests = args.sessions * args.requests
+    stats = get_single_flight().stats()
+    print(f"requests:          {requests}")
+    print(f"provider calls:    {len(calls)} ({len(calls) / requests:.0%} of requests)")
+    print(f"coalesced:         {stats['coalesced']}")
+    print(f"wall time:         {elapsed:.2f}s (plan p50 {sorted(timings)[len(timings) // 2]:.3f}s,"
+          f" overhead {(max(timings) - args.latency) * 1000:.1f}ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Measure cold start and per-rerun script time of app.py.
+#
+# Each sample runs in a fresh interpreter so the first run pays for every
+# module import and cache fill, exactly like the first session after a
+# server restart. Before timing, the script checks that app.py and the
+# services/ and components/ modules do not import any HEAVY_IMPORTS at
+# module level; those belong inside the functions that use them. Usage:
+#
+#     python benchmarks/startup.py --samples 5 --reruns 20
+import argparse
+import ast
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imported lazily, never at module level
+HEAVY_IMPORTS = ('numpy', 'PIL', 'replicate', 'aiohttp', 'requests', 'openai', 'anthropic', 'zipfile')
+
+CHILD = r'''
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+
+reruns = int(sys.argv[1])
+at = AppTest.from_file("app.py", default_timeout=60)
+started = time.perf_counter()
+at.run()
+cold = time.perf_counter() - started
+if at.exception:
+    raise SystemExit(str(at.exception))
+times = []
+for _ in range(reruns):
+    started = time.perf_counter()
+    at.run()
+    times.append(time.perf_counter() - started)
+print(json.dumps({"cold": cold, "reruns": times}))
+'''
+
+
+# ["path:line module"] for each module-level import of a HEAVY_IMPORTS package
+def heavy_imports():
+    paths = [os.path.join(ROOT, 'app.py')] + sorted(
+        glob.glob(os.path.join(ROOT, 'services', '*.py')) + glob.glob(os.path.join(ROOT, 'components', '*.py')))
+    found = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            tree = ast.parse(f.read(), path)
+        for node in tree.body:
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                if name.split('.')[0] in HEAVY_IMPORTS:
+                    found.append(f"{os.path.relpath(path, ROOT)}:{node.lineno} {name}")
+    return found
+
+
+def run_sample(reruns):
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, str(reruns)],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--reruns", type=int, default=20)
+    args = parser.parse_args()
+
+    found = heavy_imports()
+    if found:
+        raise SystemExit("module-level heavy imports:\n  " + "\n  ".join(found))
+
+    colds, reruns = [], []
+    for _ in range(args.samples):
+        sample = run_sample(args.reruns)
+        colds.append(sample["cold"])
+        reruns.extend(sample["reruns"])
+
+    reruns.sort()
+    print(f"cold start:  median {statistics.median(colds) * 1000:.1f} ms over {len(colds)} processes")
+    print(f"rerun:       p50 {reruns[len(reruns) // 2] * 1000:.1f} ms, "
+          f"p95 {reruns[int(len(reruns) * 0.95) - 1] * 1000:.1f} ms over {len(reruns)} reruns")
+
+
+if __name__ == "__main__":
+    main()
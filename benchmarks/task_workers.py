@@ -0,0 +1,96 @@
+# Throughput of the durable task queue against the number of workers.
+#
+# Starts the local provider mock, fills a fresh queue (services/task_queue.py)
+# with --tasks generation tasks the way the app submits them in queue mode
+# (chat and image calls from --sessions sessions) once 1, 2, 4, ... worker
+# processes (worker.py, --slots tasks each) have started, and times how long
+# they take to drain it. Reports tasks per second, the speedup over one
+# worker, and how many tasks failed or ran more than once. Usage:
+#
+#     python benchmarks/task_workers.py --tasks 240 --workers 1 2 4 --slots 4
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, BENCHMARKS)
+sys.path.insert(0, ROOT)
+
+from mock_providers import MockProviders  # noqa: E402
+
+KEYS = {'openai': 'bench-openai-key', 'replicate': 'bench-replicate-key'}
+
+
+def fill(queue, tasks, sessions):
+    for i in range(tasks):
+        flow = f"session{i % sessions}"
+        if i % 3 == 2:
+            payload = {'model': 'dall-e-3', 'prompt': f"Concept art {i}", 'size': [1024, 1024], 'flow': flow}
+            queue.submit('image', payload, flow, KEYS)
+        else:
+            payload = {'task': 'plot', 'model': 'gpt-4', 'system': "You are a game designer.",
+                       'prompt': f"Create a detailed plot {i}.", 'flow': flow}
+            queue.submit('chat', payload, flow, KEYS)
+
+
+def drain(queue_path, workers, slots, tasks, sessions, env, warmup):
+    from services.task_queue import TaskQueue
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(queue_path + suffix):
+            os.remove(queue_path + suffix)
+    queue = TaskQueue(queue_path)
+    processes = [subprocess.Popen([sys.executable, os.path.join(ROOT, 'worker.py'), '--slots', str(slots)],
+                                  env=env, cwd=ROOT) for _ in range(workers)]
+    try:
+        time.sleep(warmup)  # workers are long-running; leave their start-up out
+        started = time.perf_counter()
+        fill(queue, tasks, sessions)
+        while True:
+            counts = queue.counts()
+            if counts.get('done', 0) + counts.get('failed', 0) >= tasks:
+                break
+            time.sleep(0.05)
+        seconds = time.perf_counter() - started
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+    attempts = queue._db().execute("SELECT SUM(attempts) FROM tasks").fetchone()[0]
+    return seconds, counts.get('failed', 0), attempts - tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tasks", type=int, default=240)
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--workers", type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument("--slots", type=int, default=4, help="tasks run at once per worker")
+    parser.add_argument("--chat-latency", type=float, default=0.5)
+    parser.add_argument("--image-latency", type=float, default=0.8)
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds to let the workers start")
+    args = parser.parse_args()
+
+    mock = MockProviders(chat_latency=args.chat_latency, image_latency=args.image_latency, jitter=0.1)
+    mock.start()
+    data_dir = tempfile.mkdtemp(prefix='gamedev-queue-')
+    queue_path = os.path.join(data_dir, 'tasks.sqlite3')
+    env = dict(os.environ, **mock.environ(), GAMEDEV_DATA_DIR=data_dir, GAMEDEV_QUEUE_PATH=queue_path,
+               GAMEDEV_METRICS_PORT='0', GAMEDEV_LOG_LEVEL='WARNING')
+
+    print(f"{'workers':>7} {'slots':>5} {'seconds':>8} {'tasks/s':>8} {'speedup':>8} {'failed':>6} {'retried':>7}")
+    baseline = None
+    for workers in args.workers:
+        seconds, failed, retried = drain(queue_path, workers, args.slots, args.tasks, args.sessions, env, args.warmup)
+        rate = args.tasks / seconds
+        baseline = baseline or rate
+        print(f"{workers:>7} {args.slots:>5} {seconds:>7.2f}s {rate:>8.1f} {rate / baseline:>7.2f}x {failed:>6} {retried:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import streamlit as st
+
+from services.catalog import ASSET_KINDS
+
+PAGE_SIZE = 8
+
+
+# Type list and match count only change when the catalogue does, so they are
+# cached per catalogue version rather than queried on every rerun
+@st.cache_data(show_spinner=False, max_entries=64)
+def _asset_types(_catalog, version, kind):
+    return _catalog.asset_types(kind)
+
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def _count(_catalog, version, query, kind, asset_type):
+    return _catalog.count(query, kind, asset_type)
+
+
+def _reset_pages():
+    st.session_state['asset_browser_cursors'] = [None]
+
+
+def display_asset_browser(catalog):
+    if 'asset_browser_cursors' not in st.session_state:
+        _reset_pages()
+
+    query = st.text_input("Search assets", key="asset_browser_query", on_change=_reset_pages,
+                          help="Full-text search over names, prompts, scripts and documents.")
+    kind = st.selectbox("Kind", ['All'] + ASSET_KINDS, key="asset_browser_kind", on_change=_reset_pages)
+    kind = None if kind == 'All' else kind
+    asset_type = st.selectbox("Type", ['All'] + _asset_types(catalog, catalog.version, kind), key="asset_browser_type",
+                              on_change=_reset_pages)
+    asset_type = None if asset_type == 'All' else asset_type
+
+    # Keyset pagination: the cursor stack holds the `before_id` for each visited page
+    cursors = st.session_state['asset_browser_cursors']
+    page = len(cursors) - 1
+    rows = catalog.search(query, kind, asset_type, before_id=cursors[-1], limit=PAGE_SIZE + 1)
+    has_next = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+
+    st.caption(f"{_count(catalog, catalog.version, query, kind, asset_type)} assets · page {page + 1}")
+    for row in rows:
+        if row['kind'] == 'image':
+            thumb = catalog.blob(row['thumbnail_hash'])
+            if thumb:
+                st.image(thumb, caption=row['name'], width='stretch')
+            else:
+                st.write(f"🖼️ {row['name']}")
+        else:
+            st.write(f"{'🎵' if row['kind'] == 'music' else '📄'} {row['name']}")
+        if row['content_hash'] and st.checkbox("Load download", key=f"asset_browser_dl_{row['id']}"):
+            # Full-size content is read from disk only when asked for
+            extension = {'image': 'png', 'music': 'mp3', 'text': 'txt'}.get(row['kind'])
+            st.download_button(
+                "Download",
+                catalog.blob(row['content_hash']) or b'',
+                file_name=row['name'] if row['kind'] == 'script' else f"{row['name']}.{extension}",
+                mime=row['mime'],
+                key=f"asset_browser_download_{row['id']}"
+            )
+
+    previous_col, next_col = st.columns(2)
+    if previous_col.button("◀ Prev", disabled=page == 0, key="asset_browser_prev"):
+        cursors.pop()
+        st.rerun()
+    if next_col.button("Next ▶", disabled=not has_next, key="asset_browser_next"):
+        cursors.append(rows[-1]['id'])
+        st.rerun()
@@ -1,6 +1,91 @@
+import os
+
 import streamlit as st
+import streamlit.components.v1 as components
+
+from services.graph import GraphError
+
+# Drag-and-drop node editor (canvas_frontend/index.html). The frame keeps its
+# own copy of the graph between reruns, so each rerun sends it only the ops
+# it has not acknowledged plus the run statuses that changed since the last
+# rerun, and it sends back only its own edits. A full snapshot goes out on first render, when the
+# frame reloads or when one of its edits is rejected (e.g. a cycle).
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'canvas_frontend')
+_workflow_canvas = components.declare_component('workflow_canvas', path=FRONTEND_DIR)
+# Node params (prompts, input images) are not drawn, so they are not sent
+CANVAS_OPS = ('add_node', 'move_node', 'remove_node', 'add_edge', 'remove_edge')
+
+
+def _new_sync():
+    return {'seq': 0, 'ack': None, 'applied_seq': 0, 'snapshot_id': 0, 'resync': True,
+            'status_sent': (None, 0), 'selected': None, 'error': None}
+
+
+# Apply the edits in the frame's latest value that have not been applied yet
+def _receive(graph, sync, value, key):
+    if not value or value.get('seq', 0) <= sync['seq']:
+        return
+    sync['seq'] = value['seq']
+    sync['ack'] = value.get('ack')
+    sync['selected'] = value.get('selected')
+    sync['error'] = None
+    if value.get('resync'):
+        sync['resync'] = True
+    for op_seq, op in value.get('ops') or []:
+        if op_seq <= sync['applied_seq']:
+            continue
+        sync['applied_seq'] = op_seq
+        try:
+            graph.apply(op, origin=key)
+        except GraphError as e:
+            sync['error'] = str(e)
+            sync['resync'] = True  # undo the rejected edit in the frame
+
+
+# Args for this rerun: a snapshot, or the ops and statuses since the frame's acks
+def _outgoing(graph, catalogue, sync, run, height, key):
+    args = {'version': graph.version, 'seq': sync['seq'], 'applied_seq': sync['applied_seq'],
+            'height': height, 'error': sync['error']}
+    ops = None if sync['resync'] or sync['ack'] is None else graph.ops_since(sync['ack'], origin=key)
+    if ops is None:
+        if sync['resync']:
+            sync['snapshot_id'] += 1
+            sync['resync'] = False
+        snapshot = graph.snapshot()
+        snapshot['nodes'] = [{field: node[field] for field in ('id', 'kind', 'x', 'y')} for node in snapshot['nodes']]
+        args.update(snapshot=snapshot, snapshot_id=sync['snapshot_id'], catalogue={
+            kind: {'label': spec.name, 'input': spec.input_type, 'output': spec.output_type}
+            for kind, spec in catalogue.items()
+        })
+    else:
+        args['ops'] = [(version, op) for version, op in ops if op['op'] in CANVAS_OPS]
+    # Statuses are streamed as sent: the frame only loses them when it reloads,
+    # and then it gets a snapshot followed by every status of the run
+    if run is not None:
+        run_id, status_version = sync['status_sent'] if 'snapshot' not in args else (None, 0)
+        args.update(run=run.id, status_version=run.version,
+                    status=run.changes_since(status_version if run_id == run.id else -1))
+        sync['status_sent'] = (run.id, run.version)
+    return args
+
+
+# Show the canvas for `graph` (services/graph.Graph) with node kinds from
+# `catalogue` (presets.AINode by kind) and the node statuses of `run`.
+# Returns the id of the selected node, or None.
+def display_canvas(graph, catalogue, run=None, key="workflow_canvas", height=560):
+    sync_key = f"{key}_sync"
+    if sync_key not in st.session_state:
+        st.session_state[sync_key] = _new_sync()
+    sync = st.session_state[sync_key]
+    _receive(graph, sync, st.session_state.get(key), key)
+    _workflow_canvas(**_outgoing(graph, catalogue, sync, run, height, key), key=key, default=None)
+    if sync['selected'] not in graph.nodes:
+        sync['selected'] = None
+    return sync['selected']
+
 
-def display_canvas():
-    st.write("Interactive Canvas")
-    st.text("Canvas for workflow building. Nodes can be dragged and dropped here.")
-    # Placeholder for react-flow or similar implementation.
+# Make the canvas resend a full snapshot, e.g. after the graph was replaced
+def reset_canvas(key="workflow_canvas"):
+    sync = st.session_state.get(f"{key}_sync")
+    if sync is not None:
+        sync.update(ack=None, resync=True, selected=None, error=None)
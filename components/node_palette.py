@@ -1,8 +1,11 @@
 import streamlit as st
 
-def display_node_palette():
+# One button per node kind in the catalogue; returns the kind to add, or None
+def display_node_palette(catalogue):
     st.write("Node Palette")
-    st.button("Add Text Input Node")
-    st.button("Add Image Input Node")
-    st.button("Add Text-to-Image Processing Node")
-    st.button("Add Output Node")
+    added = None
+    for kind, spec in catalogue.items():
+        if st.button(f"Add {spec.name}", key=f"palette_{kind}", width='stretch',
+                     help=f"{spec.input_type} → {spec.output_type} with {spec.model.split(':')[0]}"):
+            added = kind
+    return added
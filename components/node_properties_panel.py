@@ -1,9 +1,40 @@
 import streamlit as st
 
-def display_node_properties_panel():
+from services.input_media import DEFAULT_MAX_SIDE, InputImageError, get_input_media
+
+# Properties of the selected workflow node (a services/graph node, with its
+# presets.AINode `spec`); returns the node's params as edited. An uploaded
+# input image is normalised for the node's model once per file
+# (services/input_media.py) and referenced by the hash of the result.
+def display_node_properties_panel(node_id, node, spec):
     st.write("Node Properties")
-    st.text_input("Prompt", key="prompt", help="Enter the prompt to generate the image.")
-    st.slider("Guidance Scale", 0.0, 20.0, 7.5, key="guidance_scale", help="Adjusts the influence of the prompt on image generation.")
-    st.number_input("Steps", min_value=1, max_value=100, value=50, key="steps", help="Number of steps for generating the image.")
-    st.text_input("Image Dimensions", value="512x512", key="image_dimensions", help="Specify the dimensions of the output image.")
-    st.file_uploader("Input Image", type=["png", "jpg"], key="input_image", help="Upload an input image for transformation.")
+    st.caption(f"{spec.name} · {node_id}")
+    params = dict(node['params'])
+    if spec.input_type == 'text':
+        params['prompt'] = st.text_input("Prompt", value=params.get('prompt', ''), key=f"node_{node_id}_prompt",
+                                         help="Enter the prompt to generate the output.")
+    if 'guidance_scale' in spec.inputs:
+        params['guidance_scale'] = st.slider("Guidance Scale", 0.0, 20.0, params.get('guidance_scale', 7.5),
+                                             key=f"node_{node_id}_guidance_scale",
+                                             help="Adjusts the influence of the prompt on image generation.")
+    if 'steps' in spec.inputs:
+        params['steps'] = st.number_input("Steps", min_value=1, max_value=100, value=params.get('steps', 50),
+                                          key=f"node_{node_id}_steps", help="Number of steps for generating the image.")
+    if 'dimensions' in spec.inputs:
+        params['dimensions'] = st.text_input("Image Dimensions", value=params.get('dimensions', '512x512'),
+                                             key=f"node_{node_id}_dimensions",
+                                             help="Specify the dimensions of the output image.")
+    if spec.input_type == 'image':
+        upload = st.file_uploader("Input Image", type=["png", "jpg"], key=f"node_{node_id}_input_image",
+                                  help="Upload an input image for transformation. Used when no image node is connected.")
+        if upload is None:
+            params['input_image'] = params['input_image_type'] = params['input_upload'] = None
+        elif params.get('input_upload') != upload.file_id:
+            try:
+                params['input_image'], params['input_image_type'] = get_input_media().add(
+                    upload.getvalue(), spec.max_input_side or DEFAULT_MAX_SIDE)
+                params['input_upload'] = upload.file_id
+            except InputImageError as e:
+                st.error(str(e))
+                params['input_image'] = params['input_image_type'] = params['input_upload'] = None
+    return params
@@ -0,0 +1,111 @@
+import streamlit as st
+
+from services.content_store import resolve
+
+TEXT_ELEMENTS = [
+    ('game_concept', "📖 Game Concept"),
+    ('world_concept', "🌍 World Concept"),
+    ('character_concepts', "🦸 Character Concepts"),
+    ('plot', "🎭 Plot"),
+]
+SECTIONS = ['All', 'Text', 'Images', 'Scripts']
+IMAGES_PER_PAGE = 12
+IMAGE_COLUMNS = 4
+SCRIPTS_PER_PAGE = 10
+
+
+def _reset_pages():
+    st.session_state['results_images_page'] = 0
+    st.session_state['results_scripts_page'] = 0
+
+
+def _turn(key, step):
+    st.session_state[key] = st.session_state.get(key, 0) + step
+
+
+# Page controls for `total` items; returns the slice bounds of the current page
+def _pager(key, total, per_page):
+    pages = max(1, -(-total // per_page))
+    page = min(st.session_state.get(key, 0), pages - 1)
+    st.session_state[key] = page
+    if pages > 1:
+        previous_col, label_col, next_col = st.columns([1, 2, 1])
+        previous_col.button("◀ Prev", disabled=page == 0, key=f"{key}_prev", on_click=_turn, args=(key, -1))
+        label_col.caption(f"Page {page + 1} of {pages} · {total} items")
+        next_col.button("Next ▶", disabled=page >= pages - 1, key=f"{key}_next", on_click=_turn, args=(key, 1))
+    return page * per_page, (page + 1) * per_page
+
+
+def _image_type(name):
+    return name.partition('_image_')[0]
+
+
+# Text is only sent to the browser while its toggle is on
+def _text_elements(game_plan):
+    for element, label in TEXT_ELEMENTS:
+        if element in game_plan and st.toggle(label, key=f"results_text_{element}"):
+            st.write(game_plan[element])
+    for element_name, element_content in game_plan.get('additional_elements', {}).items():
+        if st.toggle(f"🔧 {element_name.capitalize()}", key=f"results_extra_{element_name}"):
+            st.write(element_content)
+
+
+# One page of image thumbnails; a full-size image is sent only when asked for.
+# Previews still being refined can have their refinement stopped.
+def _images(images, thumbnail, full_image, refiner):
+    st.markdown("### 🖼️ Generated Images")
+    image_type = st.selectbox("Image type", ['All'] + sorted({_image_type(name) for name in images}),
+                              key="results_image_type", on_change=_reset_pages)
+    names = [name for name in images if image_type == 'All' or _image_type(name) == image_type]
+    start, end = _pager('results_images_page', len(names), IMAGES_PER_PAGE)
+    columns = st.columns(IMAGE_COLUMNS)
+    for index, name in enumerate(names[start:end]):
+        url = images[name]
+        with columns[index % IMAGE_COLUMNS]:
+            if not (isinstance(url, str) and url.startswith('http')):
+                st.write(f"{name}: {url}")
+                continue
+            try:
+                st.image(thumbnail(url), caption=name, width='stretch')
+            except Exception as e:
+                st.warning(f"Unable to load image: {name}")
+                st.error(f"Error: {str(e)}")
+                continue
+            if refiner is not None and refiner.state(name) == 'refining':
+                st.caption("Preview · refining in the background")
+                st.button("Stop refining", key=f"results_refine_stop_{name}", on_click=refiner.cancel, args=(name,),
+                          help="Keep this preview and stop paying for its high-quality render.")
+            if st.checkbox("Full size", key=f"results_full_{name}"):
+                st.image(full_image(url), width='stretch')
+
+
+# One page of scripts; code is sent only while its toggle is on
+def _scripts(scripts):
+    st.markdown("### 💻 Generated Scripts")
+    language = st.selectbox("Language", ['All'] + sorted({name.split('.')[-1] for name in scripts}),
+                            key="results_script_language", on_change=_reset_pages)
+    names = [name for name in scripts if language == 'All' or name.split('.')[-1] == language]
+    start, end = _pager('results_scripts_page', len(names), SCRIPTS_PER_PAGE)
+    for name in names[start:end]:
+        code = scripts[name]
+        lines = code.count('\n') + 1
+        if st.toggle(f"View {name} ({lines} lines)", key=f"results_script_{name}"):
+            st.code(code, language=name.split('.')[-1])
+
+
+# Paginated, filterable view of a plan's text, images and scripts. Runs as a
+# fragment, so paging, filtering and opening items rerun only this view.
+# Streamlit keeps a fragment's arguments between reruns, so it takes the
+# session's plan handles and resolves the text itself on each run.
+# `thumbnail(url)` and `full_image(url)` return image bytes; `refiner` is the
+# session's services/refinement.Refiner, if any.
+@st.fragment
+def display_results(plan_handles, thumbnail, full_image, refiner=None):
+    game_plan = resolve(plan_handles)
+    section = st.selectbox("Show", SECTIONS, key="results_section")
+    if section in ('All', 'Text'):
+        _text_elements(game_plan)
+    if section in ('All', 'Images') and game_plan.get('images'):
+        _images(game_plan['images'], thumbnail, full_image, refiner)
+    if section in ('All', 'Scripts') and game_plan.get('scripts'):
+        _scripts(game_plan['scripts'])
@@ -1,5 +1,125 @@
 import streamlit as st
 
-def manage_workflow():
-    st.write("Workflow Management")
-    st.text("Handles node connections, edge creation, validation, and execution.")
+from components.canvas import display_canvas, reset_canvas
+from components.node_palette import display_node_palette
+from components.node_properties_panel import display_node_properties_panel
+from presets import get_available_nodes, get_presets
+from services.graph import Graph, GraphError
+from services.workflows import FINAL_STATES, start_workflow
+
+STATUS_INTERVAL = 0.5
+COLUMN_SPACING = 230
+ROW_SPACING = 80
+
+
+def _session_graph(catalogue):
+    if 'workflow_graph' not in st.session_state:
+        st.session_state['workflow_graph'] = Graph(kinds=set(catalogue))
+    return st.session_state['workflow_graph']
+
+
+# A preset's node sequence as a chain laid out left to right
+def _preset_graph(preset, catalogue):
+    graph = Graph(kinds=set(catalogue))
+    previous = None
+    for index, spec in enumerate(preset.node_sequence):
+        node_id = graph.new_id(spec.key)
+        graph.apply({'op': 'add_node', 'id': node_id, 'kind': spec.key, 'x': index * COLUMN_SPACING, 'y': 0})
+        if previous is not None:
+            graph.apply({'op': 'add_edge', 'source': previous, 'target': node_id})
+        previous = node_id
+    return graph
+
+
+# New nodes go below the lowest one, so they never cover an existing node
+def _add_node(graph, kind):
+    y = max((node['y'] for node in graph.nodes.values()), default=-ROW_SPACING) + ROW_SPACING
+    graph.apply({'op': 'add_node', 'id': graph.new_id(kind), 'kind': kind, 'x': 0, 'y': y})
+
+
+def _outputs(run, graph, catalogue):
+    outputs = run.outputs()
+    if not outputs:
+        return
+    with st.expander(f"Outputs ({len(outputs)})", expanded=run.finished):
+        for node_id, url in outputs.items():
+            kind = run.nodes[node_id]['kind']
+            st.caption(f"{catalogue[kind].name} · {node_id}")
+            if catalogue[kind].output_type == 'video':
+                st.video(url)
+            else:
+                st.image(url, width='stretch')
+
+
+def _run_controls(api_keys, graph, catalogue, flow, selected):
+    run = st.session_state.get('workflow_run')
+    running = run is not None and not run.finished
+    if st.button("▶ Run Workflow", disabled=running, width='stretch'):
+        if not api_keys.get('replicate'):
+            st.error("Please enter and save a Replicate API key.")
+        else:
+            try:
+                st.session_state['workflow_run'] = run = start_workflow(graph, catalogue, api_keys, flow)
+                running = True
+            except GraphError as e:
+                st.error(str(e))
+    if running:
+        if st.button("⏹ Cancel Run", width='stretch'):
+            run.cancel()
+        if selected in run.statuses and run.statuses[selected]['state'] not in FINAL_STATES:
+            if st.button(f"Cancel {selected}", width='stretch', help="Cancel this node and everything downstream of it."):
+                run.cancel([selected])
+    if run is not None:
+        counts = run.counts()
+        st.caption(" · ".join(f"{count} {state}" for state, count in counts.items() if count))
+        failed = {node_id: status['error'] for node_id, status in run.statuses.items() if status['state'] == 'failed'}
+        for node_id, error in failed.items():
+            st.error(f"{node_id}: {error}")
+    return run
+
+
+def _editor(api_keys, catalogue, flow):
+    graph = _session_graph(catalogue)
+    palette_col, canvas_col, panel_col = st.columns([1.2, 4, 1.6])
+    with palette_col:
+        presets = get_presets()
+        preset = st.selectbox("Preset", presets, format_func=lambda p: p.name, key="workflow_preset")
+        if st.button("Load Preset", width='stretch'):
+            graph = st.session_state['workflow_graph'] = _preset_graph(preset, catalogue)
+            reset_canvas()
+        kind = display_node_palette(catalogue)
+        if kind is not None:
+            _add_node(graph, kind)
+
+    with canvas_col:
+        run = st.session_state.get('workflow_run')
+        selected = display_canvas(graph, catalogue, run)
+
+    with panel_col:
+        if selected is not None:
+            node = graph.nodes[selected]
+            params = display_node_properties_panel(selected, node, catalogue[node['kind']])
+            if params != node['params']:
+                graph.apply({'op': 'set_params', 'id': selected, 'params': params})
+        else:
+            st.caption("Select a node to edit its properties.")
+        run = _run_controls(api_keys, graph, catalogue, flow, selected)
+
+    if run is not None:
+        _outputs(run, graph, catalogue)
+        # Stop polling for statuses once the run is over
+        if run.finished and st.session_state.get('workflow_polling'):
+            st.session_state['workflow_polling'] = False
+            st.rerun()
+        if not run.finished and not st.session_state.get('workflow_polling'):
+            st.session_state['workflow_polling'] = True
+            st.rerun()
+
+
+# The workflow editor: presets, node palette, canvas, node properties and
+# run controls. It runs as a fragment so canvas edits rerun only the editor;
+# while a run is in progress the fragment reruns every STATUS_INTERVAL to
+# stream node statuses to the canvas.
+def manage_workflow(api_keys, flow=None):
+    polling = st.session_state.get('workflow_polling', False)
+    st.fragment(_editor, run_every=STATUS_INTERVAL if polling else None)(api_keys, get_available_nodes(), flow)
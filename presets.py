@@ -3,13 +3,30 @@ class Preset:
         self.name = name
         self.node_sequence = node_sequence
 
+# A Replicate model usable as a workflow node. `input_type` and `output_type`
+# are 'text', 'image' or 'video'; `inputs` maps node properties to model
+# inputs beyond the prompt or image ('dimensions' maps to width and height);
+# uploaded input images are shrunk to `max_input_side` before being sent.
+class AINode:
+    def __init__(self, key, name, model, input_type, output_type, inputs=None, max_input_side=None):
+        self.key = key
+        self.name = name
+        self.model = model
+        self.input_type = input_type
+        self.output_type = output_type
+        self.inputs = inputs or {}
+        self.max_input_side = max_input_side
+
 # Define the available nodes (ensure these match the nodes from the main app)
 def get_available_nodes():
     return {
         "flux": AINode("flux", "Flux Schnell", "black-forest-labs/flux-schnell", "text", "image"),
-        "sdxl": AINode("sdxl", "Stable Diffusion XL", "stability-ai/sdxl:a00d0b7dcbb9c3fbb34ba87d2d5b46c56969c84a628bf778a7fdaec30b1b99c5", "text", "image"),
-        "upscale": AINode("upscale", "Image Upscaling", "nightmareai/real-esrgan:42fed1c4974146d4d2414e2be2c5277c7fcf05fcc3a73abf41610695738c1d7b", "image", "image"),
-        "remove-bg": AINode("remove-bg", "Remove Background", "cjwbw/rembg:fb8af171cfa1616ddcf1242c093f9c46bcada5ad4cf6f2fbe8b81b330ec5c003", "image", "image"),
+        "sdxl": AINode("sdxl", "Stable Diffusion XL", "stability-ai/sdxl:a00d0b7dcbb9c3fbb34ba87d2d5b46c56969c84a628bf778a7fdaec30b1b99c5", "text", "image",
+                       {"guidance_scale": "guidance_scale", "steps": "num_inference_steps", "dimensions": ("width", "height")}),
+        "upscale": AINode("upscale", "Image Upscaling", "nightmareai/real-esrgan:42fed1c4974146d4d2414e2be2c5277c7fcf05fcc3a73abf41610695738c1d7b", "image", "image",
+                          max_input_side=1440),
+        "remove-bg": AINode("remove-bg", "Remove Background", "cjwbw/rembg:fb8af171cfa1616ddcf1242c093f9c46bcada5ad4cf6f2fbe8b81b330ec5c003", "image", "image",
+                            max_input_side=2048),
         "video": AINode("video", "Video Generation", "anotherjesse/zeroscope-v2-xl:9f747673945c62801b13b84701c783929c0ee784e4748ec062204894dda1a351", "text", "video"),
     }
 
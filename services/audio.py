@@ -0,0 +1,230 @@
+# Post-processing for generated music.
+# A track is downloaded once and decoded once, in the shared process pool.
+# From the decoded samples this module computes:
+#   * peaks: min/max of the mono mix over PEAK_BUCKETS equal slices, enough
+#     to draw a waveform without sending the audio to the browser;
+#   * a loop: the pair of points (start, end) where the music repeats itself
+#     best. Frames of log band energies are compared all-against-all; the
+#     diagonal of that self-similarity matrix at lag L, averaged over
+#     LOOP_MATCH_SECONDS, says how well the audio at t matches the audio at
+#     t + L. The longest loop scoring within LOOP_TOLERANCE of the best one is
+#     kept and its end is aligned to the waveform by cross-correlation. Tracks
+#     without a convincing repeat fall back to looping the whole track.
+#   * the loop itself, trimmed to [start, end) with its last CROSSFADE_SECONDS
+#     blended (equal power) into the audio just before `start`, so playing
+#     it on repeat has no seam. It is written as 16-bit WAV: MP3 encoders pad
+#     the first and last frames, which breaks gapless looping.
+# WAV is decoded with the standard library; anything else (MusicGen returns
+# MP3) needs an ffmpeg binary, found on PATH or set with GAMEDEV_FFMPEG.
+# Without one the track is still stored and played locally, just without
+# waveform or loop.
+import os
+import shutil
+import subprocess
+import wave
+from io import BytesIO
+
+FFMPEG = os.environ.get('GAMEDEV_FFMPEG') or shutil.which('ffmpeg')
+DECODE_RATE = 44100
+DECODE_TIMEOUT = 120
+PEAK_BUCKETS = 400
+ANALYSIS_RATE = 11025
+FRAME_SIZE = 2048
+MAX_FRAMES = 2000
+BANDS = 24
+MIN_LOOP_SECONDS = 4.0
+LOOP_MATCH_SECONDS = 2.0
+LOOP_TOLERANCE = 0.02
+MIN_LOOP_SCORE = 0.6
+CROSSFADE_SECONDS = 0.05
+
+
+class AudioDecodeError(Exception):
+    pass
+
+
+def _decode_wav(data):
+    import numpy as np
+
+    with wave.open(BytesIO(data)) as reader:
+        channels = reader.getnchannels()
+        width = reader.getsampwidth()
+        rate = reader.getframerate()
+        frames = reader.readframes(reader.getnframes())
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype='<i2').astype(np.float32) / 32768
+    elif width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        samples = ((raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)) << 8 >> 8).astype(np.float32) / 8388608
+    elif width == 4:
+        samples = np.frombuffer(frames, dtype='<i4').astype(np.float32) / 2147483648
+    else:
+        raise AudioDecodeError(f"Unsupported WAV sample width: {width} bytes")
+    return samples.reshape(-1, channels), rate
+
+
+def _decode_ffmpeg(data):
+    import numpy as np
+
+    command = [FFMPEG, '-v', 'error', '-i', 'pipe:0', '-f', 's16le', '-acodec', 'pcm_s16le',
+               '-ac', '2', '-ar', str(DECODE_RATE), 'pipe:1']
+    try:
+        result = subprocess.run(command, input=data, capture_output=True, timeout=DECODE_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise AudioDecodeError(f"ffmpeg failed: {str(e)}") from e
+    if result.returncode != 0 or not result.stdout:
+        raise AudioDecodeError(f"ffmpeg failed: {result.stderr.decode('utf-8', 'replace').strip()[-200:]}")
+    return np.frombuffer(result.stdout, dtype='<i2').astype(np.float32).reshape(-1, 2) / 32768, DECODE_RATE
+
+
+# Float samples in [-1, 1] shaped (frames, channels), and the sample rate
+def decode(data):
+    if data[:4] == b'RIFF' and data[8:12] == b'WAVE':
+        return _decode_wav(data)
+    if not FFMPEG:
+        raise AudioDecodeError("No decoder for this audio format (install ffmpeg or set GAMEDEV_FFMPEG).")
+    return _decode_ffmpeg(data)
+
+
+def encode_wav(samples, rate):
+    import numpy as np
+
+    pcm = (np.clip(samples, -1, 1) * 32767).round().astype('<i2')
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as writer:
+        writer.setnchannels(samples.shape[1])
+        writer.setsampwidth(2)
+        writer.setframerate(rate)
+        writer.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+# Min and max of the mono mix over `buckets` equal slices of the track
+def peaks(samples, buckets=PEAK_BUCKETS):
+    import numpy as np
+
+    mono = samples.mean(axis=1)
+    buckets = max(1, min(buckets, len(mono)))
+    usable = len(mono) // buckets * buckets
+    slices = mono[:usable].reshape(buckets, -1)
+    return {
+        'min': np.round(slices.min(axis=1), 3).tolist(),
+        'max': np.round(slices.max(axis=1), 3).tolist(),
+    }
+
+
+# Unit-length log band energy vectors, one per hop of the mono signal
+def _features(mono, hop):
+    import numpy as np
+
+    count = 1 + (len(mono) - FRAME_SIZE) // hop
+    frames = np.lib.stride_tricks.as_strided(
+        mono, shape=(count, FRAME_SIZE), strides=(mono.strides[0] * hop, mono.strides[0]))
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(FRAME_SIZE).astype(np.float32), axis=1))
+    edges = np.unique(np.geomspace(2, spectrum.shape[1], BANDS + 1).astype(int))
+    energies = np.log1p(np.add.reduceat(spectrum ** 2, edges[:-1], axis=1))
+    energies -= energies.mean(axis=0)
+    energies /= np.linalg.norm(energies, axis=1, keepdims=True) + 1e-9
+    return energies.astype(np.float32)
+
+
+# Best (start, lag, score) in frames: the pair of windows LOOP_MATCH_SECONDS
+# long that are most alike, preferring the longest lag among near-ties
+def _best_repeat(features, min_lag, window):
+    import numpy as np
+
+    similarity = features @ features.T
+    candidates = []
+    for lag in range(min_lag, len(features) - window + 1):
+        sums = np.cumsum(np.concatenate(([0.0], np.diagonal(similarity, lag))))
+        means = (sums[window:] - sums[:-window]) / window
+        start = int(means.argmax())
+        candidates.append((float(means[start]), start, lag))
+    if not candidates:
+        return None
+    top = max(score for score, _, _ in candidates)
+    score, start, lag = max((c for c in candidates if c[0] >= top - LOOP_TOLERANCE), key=lambda c: c[2])
+    return start, lag, score
+
+
+# Shift `end` by up to `reach` samples so the audio after it lines up with
+# the audio after `start` (normalised FFT cross-correlation of the mono signal)
+def _align(mono, start, end, reach):
+    import numpy as np
+
+    size = min(FRAME_SIZE * 8, len(mono) - end - reach, len(mono) - start)
+    if size <= 0 or end - reach < 0:
+        return end
+    reference = mono[start:start + size]
+    search = mono[end - reach:end + reach + size]
+    length = 1 << int(np.ceil(np.log2(len(search) + size)))
+    correlation = np.fft.irfft(np.fft.rfft(search, length) * np.conj(np.fft.rfft(reference, length)), length)
+    energy = np.cumsum(np.concatenate(([0.0], search.astype(np.float64) ** 2)))
+    energy = np.sqrt(energy[size:size + 2 * reach + 1] - energy[:2 * reach + 1]) + 1e-9
+    offset = int((correlation[:2 * reach + 1] / energy).argmax())
+    return end - reach + offset
+
+
+# Loop points in samples and their similarity score (None when the whole
+# track is looped)
+def find_loop(samples, rate):
+    import numpy as np
+
+    crossfade = int(CROSSFADE_SECONDS * rate)
+    whole = (min(crossfade, len(samples) // 2), len(samples), None)
+    step = max(1, rate // ANALYSIS_RATE)
+    mono = samples.mean(axis=1)
+    usable = len(mono) // step * step
+    analysis = np.ascontiguousarray(mono[:usable].reshape(-1, step).mean(axis=1))
+    analysis_rate = rate / step
+    if len(analysis) < FRAME_SIZE * 4:
+        return whole
+    hop = max(FRAME_SIZE // 4, int(np.ceil((len(analysis) - FRAME_SIZE) / MAX_FRAMES)))
+    features = _features(analysis, hop)
+    frame_seconds = hop / analysis_rate
+    window = max(1, int(LOOP_MATCH_SECONDS / frame_seconds))
+    repeat = _best_repeat(features, max(1, int(MIN_LOOP_SECONDS / frame_seconds)), window)
+    if repeat is None or repeat[2] < MIN_LOOP_SCORE:
+        return whole
+    start_frame, lag, score = repeat
+    start = max(start_frame * hop * step, crossfade)
+    end = _align(mono, start, start + lag * hop * step, hop * step)
+    if end - start < MIN_LOOP_SECONDS * rate or end > len(samples):
+        return whole
+    return start, end, score
+
+
+# Samples [start, end) whose tail is crossfaded into the audio leading up to
+# `start`, so the last sample flows into the first when repeated
+def make_loop(samples, rate, start, end):
+    import numpy as np
+
+    crossfade = min(int(CROSSFADE_SECONDS * rate), start, (end - start) // 2)
+    loop = samples[start:end].copy()
+    if crossfade:
+        t = np.linspace(0, np.pi / 2, crossfade, dtype=np.float32)[:, None]
+        loop[-crossfade:] = loop[-crossfade:] * np.cos(t) + samples[start - crossfade:start] * np.sin(t)
+    return loop
+
+
+# Decode a track and compute its preview and loop. Runs in the process pool.
+# Returns {'duration', 'rate', 'peaks', 'loop': {'start', 'end', 'score'}, 'loop_wav'}
+# in seconds, or {'error'} when the track cannot be decoded.
+def process_music(data):
+    try:
+        samples, rate = decode(data)
+    except (AudioDecodeError, wave.Error, EOFError) as e:
+        return {'error': str(e)}
+    if not len(samples):
+        return {'error': "The track has no audio."}
+    start, end, score = find_loop(samples, rate)
+    return {
+        'duration': round(len(samples) / rate, 3),
+        'rate': rate,
+        'peaks': peaks(samples),
+        'loop': {'start': round(start / rate, 3), 'end': round(end / rate, 3),
+                 'score': None if score is None else round(score, 3)},
+        'loop_wav': encode_wav(make_loop(samples, rate, start, end), rate),
+    }
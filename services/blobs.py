@@ -0,0 +1,57 @@
+# Content-addressed blob storage on local disk.
+# Blobs are stored under <root>/<first two hex chars>/<sha256> so identical
+# content is written once no matter how many plans or sessions refer to it.
+import hashlib
+import os
+import tempfile
+
+DATA_DIR = os.environ.get(
+    'GAMEDEV_DATA_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+)
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobDir:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    # Store bytes and return their hash; writes are atomic via rename
+    def put(self, data):
+        digest = content_hash(data)
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def get(self, digest):
+        try:
+            with open(self.path(digest), 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+
+_blob_dir = None
+
+
+# Process-wide blob directory under DATA_DIR shared by the catalogue and post-processors
+def get_blob_dir():
+    global _blob_dir
+    if _blob_dir is None:
+        _blob_dir = BlobDir(os.path.join(DATA_DIR, 'blobs'))
+    return _blob_dir
@@ -0,0 +1,245 @@
+# Record and replay of provider HTTP traffic.
+# With GAMEDEV_CASSETTE=<file> and GAMEDEV_CASSETTE_MODE=record, every request
+# the provider clients make (OpenAI calls and asset downloads through
+# aiohttp, Replicate calls through the SDK's httpx transport) goes out as
+# usual and is captured with its timing: when it started and how long its
+# response took. At exit (or on save()) the cassette is written as a zip of
+# one JSON line per request plus the response bodies, each distinct body
+# stored once and deflated unless it is already-compressed media. Each
+# process records its own cassette.
+# With GAMEDEV_CASSETTE_MODE=replay nothing goes to the network: requests
+# are answered from the cassette after their recorded latency times
+# GAMEDEV_CASSETTE_LATENCY_SCALE (0 answers at once). A request is matched by
+# method, path and body, falling back to the next recorded request to the
+# same endpoint when the body differs (e.g. prompts with random seeds), and
+# cycling through them when a replay makes more requests than were
+# recorded. A prediction poll returns the state the prediction had at the same
+# scaled time after its creation. Recording and replay use polling rather than
+# webhooks, so the whole prediction lifecycle goes through the client.
+import asyncio
+import atexit
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from urllib.parse import urlsplit
+
+from services.blobs import content_hash
+from services.metrics import log_event
+
+CASSETTE_PATH = os.environ.get('GAMEDEV_CASSETTE')
+CASSETTE_MODE = os.environ.get('GAMEDEV_CASSETTE_MODE', 'replay')
+LATENCY_SCALE = float(os.environ.get('GAMEDEV_CASSETTE_LATENCY_SCALE', '1.0'))
+INDEX_NAME = 'interactions.jsonl'
+POLL_TOLERANCE = 0.1
+STORED_TYPES = ('image/', 'audio/', 'video/', 'application/zip', 'application/octet-stream')
+
+
+class CassetteMiss(Exception):
+    pass
+
+
+def _path(url):
+    parts = urlsplit(url)
+    return f"{parts.path}?{parts.query}" if parts.query else parts.path
+
+
+# Digest of a request body; JSON is normalised so key order does not matter
+def _body_digest(body):
+    if not body:
+        return None
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':')).encode('utf-8')
+    except ValueError:
+        pass
+    return content_hash(body)[:16]
+
+
+class Cassette:
+    def __init__(self, path, mode, latency_scale=LATENCY_SCALE):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self.interactions = []
+        self._bodies = {}
+        self.misses = 0
+        if mode == 'replay':
+            self._load()
+        else:
+            atexit.register(self.save)
+
+    def _load(self):
+        import zipfile
+
+        with zipfile.ZipFile(self.path) as archive:
+            lines = archive.read(INDEX_NAME).decode('utf-8').splitlines()
+            self.interactions = [json.loads(line) for line in lines if line]
+            self._bodies = {name[len('bodies/'):]: archive.read(name)
+                            for name in archive.namelist() if name.startswith('bodies/')}
+        self._exact = defaultdict(deque)
+        self._routes = defaultdict(list)
+        self._used = set()
+        self._cycles = defaultdict(int)
+        self._created = {}
+        self._anchors = {}
+        for index, item in enumerate(self.interactions):
+            route = (item['method'], item['path'])
+            self._exact[route + (item['body'],)].append(index)
+            self._routes[route].append(index)
+            if item.get('creates'):
+                self._created[item['creates']] = item['offset'] + item['duration']
+
+    # Send a request through the cassette. `send()` makes the real request and
+    # returns (status, content type, body bytes); so does this.
+    async def exchange(self, method, url, body, send):
+        if self.mode == 'replay':
+            return await self._replay(method, url, body)
+        started = time.monotonic()
+        status, content_type, content = await send()
+        self._record(method, url, body, started, status, content_type, content)
+        return status, content_type, content
+
+    def _record(self, method, url, body, started, status, content_type, content):
+        path = _path(url)
+        digest = content_hash(content)[:16] if content else None
+        item = {
+            'method': method,
+            'path': path,
+            'body': _body_digest(body),
+            'status': status,
+            'type': content_type,
+            'response': digest,
+            'offset': round(started - self._started, 4),
+            'duration': round(time.monotonic() - started, 4),
+        }
+        if method == 'POST' and path.endswith('/predictions') and content:
+            try:
+                created = json.loads(content)
+            except ValueError:
+                created = None
+            if isinstance(created, dict) and created.get('id'):
+                item['creates'] = created['id']
+        with self._lock:
+            self.interactions.append(item)
+            if digest:
+                self._bodies[digest] = (content, content_type or '')
+
+    async def _replay(self, method, url, body):
+        index = self._match(method, _path(url), _body_digest(body))
+        item = self.interactions[index]
+        if self.latency_scale:
+            await asyncio.sleep(item['duration'] * self.latency_scale)
+        if item.get('creates'):
+            with self._lock:
+                self._anchors[item['creates']] = time.monotonic()
+        return item['status'], item['type'], self._bodies[item['response']] if item['response'] else b''
+
+    def _match(self, method, path, digest):
+        with self._lock:
+            route = self._routes.get((method, path))
+            if not route:
+                self.misses += 1
+                log_event('cassette_miss', method=method, path=path)
+                raise CassetteMiss(f"No recorded response for {method} {path}")
+            prediction = path.rstrip('/').rsplit('/', 1)[-1]
+            if method == 'GET' and prediction in self._created:
+                return self._poll(prediction, route)
+            exact = self._exact[(method, path, digest)]
+            while exact:
+                index = exact.popleft()
+                if index not in self._used:
+                    self._used.add(index)
+                    return index
+            for index in route:
+                if index not in self._used:
+                    self._used.add(index)
+                    return index
+            cycle = self._cycles[(method, path)]
+            self._cycles[(method, path)] += 1
+            return route[cycle % len(route)]
+
+    # Latest recorded poll of a prediction sent no later, in scaled time since
+    # its creation, than this one is since its replayed creation (within
+    # POLL_TOLERANCE, as the same polling schedule drifts by a few ms)
+    def _poll(self, prediction, polls):
+        anchor = self._anchors.get(prediction)
+        elapsed = time.monotonic() - anchor if anchor is not None else float('inf')
+        chosen = polls[0]
+        for index in polls:
+            sent = self.interactions[index]['offset'] - self._created[prediction]
+            if sent * self.latency_scale <= elapsed + POLL_TOLERANCE:
+                chosen = index
+        return chosen
+
+    def save(self):
+        import zipfile
+
+        with self._lock:
+            interactions = list(self.interactions)
+            bodies = dict(self._bodies)
+        if self.mode != 'record' or not interactions:
+            return
+        temporary = f"{self.path}.tmp"
+        with zipfile.ZipFile(temporary, 'w') as archive:
+            index = '\n'.join(json.dumps(item, separators=(',', ':')) for item in interactions)
+            archive.writestr(INDEX_NAME, index, compress_type=zipfile.ZIP_DEFLATED)
+            for digest, (content, content_type) in bodies.items():
+                compression = zipfile.ZIP_STORED if content_type.startswith(STORED_TYPES) else zipfile.ZIP_DEFLATED
+                archive.writestr(f"bodies/{digest}", content, compress_type=compression)
+        os.replace(temporary, self.path)
+        log_event('cassette_saved', path=self.path, interactions=len(interactions), bodies=len(bodies))
+
+    def stats(self):
+        with self._lock:
+            return {'mode': self.mode, 'interactions': len(self.interactions), 'bodies': len(self._bodies),
+                    'misses': self.misses}
+
+
+# httpx transport for the Replicate client that records or replays through
+# `cassette`; `wrapped` is the real transport used when recording
+def httpx_transport(cassette, wrapped=None):
+    import httpx
+
+    class CassetteTransport(httpx.AsyncBaseTransport):
+        def __init__(self):
+            self.wrapped = wrapped or httpx.AsyncHTTPTransport()
+
+        async def handle_async_request(self, request):
+            body = await request.aread()
+
+            async def send():
+                response = await self.wrapped.handle_async_request(request)
+                try:
+                    content = await response.aread()
+                finally:
+                    await response.aclose()
+                return response.status_code, response.headers.get('content-type'), content
+
+            status, content_type, content = await cassette.exchange(request.method, str(request.url), body, send)
+            headers = {'content-type': content_type} if content_type else {}
+            return httpx.Response(status, headers=headers, content=content, request=request)
+
+        async def aclose(self):
+            await self.wrapped.aclose()
+
+    return CassetteTransport()
+
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+
+# Process-wide cassette, or None when GAMEDEV_CASSETTE is not set
+def get_cassette():
+    global _cassette
+    if not CASSETTE_PATH:
+        return None
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette(CASSETTE_PATH, CASSETTE_MODE)
+        return _cassette
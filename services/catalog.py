@@ -0,0 +1,381 @@
+# Persistent local catalogue of generated plans and assets.
+# Plan and asset metadata live in SQLite with an FTS5 index over names,
+# prompts and text bodies; image/audio/text content lives in a
+# content-addressed blob directory. Listing uses keyset pagination on the
+# asset id so page N costs the same as page 1 with tens of thousands of rows.
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from services.blobs import DATA_DIR, BlobDir, content_hash
+from services.metrics import CACHE_LOOKUPS, DOWNLOADED_BYTES
+from services.phash import DUPLICATE_DISTANCE, HashIndex, phash
+
+CATALOG_PATH = os.path.join(DATA_DIR, 'catalog.sqlite3')
+THUMBNAIL_SIZE = (256, 256)
+DOWNLOAD_WORKERS = 8
+
+ASSET_KINDS = ['image', 'script', 'text', 'music']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    prompt TEXT NOT NULL,
+    customization TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS assets (
+    id INTEGER PRIMARY KEY,
+    plan_id INTEGER NOT NULL REFERENCES plans(id),
+    created_at REAL NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    asset_type TEXT,
+    model TEXT,
+    prompt TEXT,
+    source_url TEXT,
+    content_hash TEXT,
+    thumbnail_hash TEXT,
+    mime TEXT,
+    size_bytes INTEGER,
+    width INTEGER,
+    height INTEGER,
+    phash INTEGER
+);
+CREATE INDEX IF NOT EXISTS assets_kind_id ON assets(kind, id);
+CREATE INDEX IF NOT EXISTS assets_type_id ON assets(asset_type, id);
+CREATE INDEX IF NOT EXISTS assets_plan ON assets(plan_id);
+CREATE INDEX IF NOT EXISTS assets_hash ON assets(content_hash);
+CREATE INDEX IF NOT EXISTS assets_source_url ON assets(source_url);
+CREATE VIRTUAL TABLE IF NOT EXISTS assets_fts USING fts5(
+    name, asset_type, prompt, body, tokenize='unicode61'
+);
+"""
+
+
+# Columns added after the first release, created on older databases
+MIGRATIONS = {
+    'phash': 'ALTER TABLE assets ADD COLUMN phash INTEGER',
+}
+
+
+# SQLite integers are signed 64-bit; store unsigned hashes in two's complement
+def _to_signed(value):
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+# Turn free text into a safe FTS5 query: every word is a quoted prefix term
+def fts_query(text):
+    terms = [t.replace('"', '""') for t in text.split() if t.strip()]
+    return ' '.join(f'"{t}"*' for t in terms)
+
+
+def _fetch(url):
+    import requests
+
+    response = requests.get(url, timeout=60)
+    response.raise_for_status()
+    DOWNLOADED_BYTES.inc('catalog', amount=len(response.content))
+    return response.content
+
+
+# Thumbnail PNG bytes plus the original dimensions
+def thumbnail(data):
+    from PIL import Image
+
+    image = Image.open(BytesIO(data))
+    width, height = image.size
+    image.thumbnail(THUMBNAIL_SIZE)
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue(), width, height
+
+
+class Catalog:
+    def __init__(self, path=CATALOG_PATH, blob_root=None):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.blobs = BlobDir(blob_root or os.path.join(os.path.dirname(path) or '.', 'blobs'))
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._hash_index = None
+        # Bumped on every write, so callers can cache query results per version
+        self.version = 0
+        with self._write_lock:
+            conn = self._conn()
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(assets)')}
+            if columns:
+                for column, statement in MIGRATIONS.items():
+                    if column not in columns:
+                        conn.execute(statement)
+                conn.commit()
+            conn.executescript(SCHEMA)
+
+    # One connection per thread; Streamlit runs each session's script in its own thread
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # Download remote media concurrently (unless already in `downloaded`) and
+    # store it in the blob directory.
+    # Returns {url: (content_hash, thumbnail_hash, size_bytes, width, height, phash)}.
+    def _store_media(self, urls, images, downloaded):
+        def store(url):
+            try:
+                data = downloaded[url] if url in downloaded else _fetch(url)
+            except Exception:
+                return url, None
+            digest = self.blobs.put(data)
+            thumb_hash, width, height, image_hash = None, None, None, None
+            if url in images:
+                try:
+                    thumb, width, height = thumbnail(data)
+                    thumb_hash = self.blobs.put(thumb)
+                    image_hash = phash(data)
+                except Exception:
+                    pass
+            return url, (digest, thumb_hash, len(data), width, height, image_hash)
+
+        if not urls:
+            return {}
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+            return {url: info for url, info in pool.map(store, urls) if info is not None}
+
+    # Drop rows already in the catalogue: media by source URL, text and
+    # scripts by kind, name and content hash
+    def _new_rows(self, rows):
+        conn = self._conn()
+        fresh = []
+        for row in rows:
+            if row.get('source_url'):
+                existing = conn.execute('SELECT 1 FROM assets WHERE source_url = ? LIMIT 1', (row['source_url'],))
+            else:
+                existing = conn.execute(
+                    'SELECT 1 FROM assets WHERE content_hash = ? AND kind = ? AND name = ? LIMIT 1',
+                    (row['content_hash'], row['kind'], row['name']))
+            if existing.fetchone() is None:
+                fresh.append(row)
+        return fresh
+
+    # Store a generated plan; `prompts` optionally maps image name -> prompt text
+    # and `downloaded` maps asset URLs to bytes already fetched for this plan.
+    # Assets already catalogued (e.g. reused when a plan is resubmitted) are
+    # not recorded again; returns the new plan id, or None if nothing was new.
+    def record_plan(self, user_prompt, customization, game_plan, prompts=None, downloaded=None):
+        prompts = prompts or {}
+        now = time.time()
+        rows = []
+
+        for key, value in game_plan.items():
+            if key in ('images', 'scripts', 'music') or not isinstance(value, str) or value.startswith('Error'):
+                continue
+            rows.append({'name': key, 'kind': 'text', 'asset_type': key, 'model': customization.get('chat_model'),
+                         'body': value, 'mime': 'text/plain'})
+
+        for name, code in (game_plan.get('scripts') or {}).items():
+            if isinstance(code, str) and not code.startswith('Error'):
+                rows.append({'name': name, 'kind': 'script', 'asset_type': name.rsplit('.', 1)[-1],
+                             'model': customization.get('code_model'), 'body': code, 'mime': 'text/plain'})
+
+        image_urls = {}
+        for name, url in (game_plan.get('images') or {}).items():
+            if isinstance(url, str) and url.startswith('http'):
+                image_urls[url] = name
+                rows.append({'name': name, 'kind': 'image', 'asset_type': name.split('_image_')[0],
+                             'model': customization.get('image_model'), 'prompt': prompts.get(name),
+                             'source_url': url, 'mime': 'image/png'})
+
+        music_url = game_plan.get('music')
+        if isinstance(music_url, str) and music_url.startswith('http'):
+            rows.append({'name': 'background_music', 'kind': 'music', 'asset_type': 'music',
+                         'model': 'meta/musicgen', 'source_url': music_url, 'mime': 'audio/mpeg'})
+
+        for row in rows:
+            if row.get('body') is not None:
+                data = row['body'].encode('utf-8')
+                row.update(content_hash=content_hash(data), size_bytes=len(data))
+        rows = self._new_rows(rows)
+        if not rows:
+            return None
+
+        media = self._store_media([r['source_url'] for r in rows if r.get('source_url')], image_urls, downloaded or {})
+        for row in rows:
+            if row.get('body') is not None:
+                self.blobs.put(row['body'].encode('utf-8'))
+            elif row.get('source_url') in media:
+                digest, thumb_hash, size_bytes, width, height, image_hash = media[row['source_url']]
+                row.update(content_hash=digest, thumbnail_hash=thumb_hash, size_bytes=size_bytes,
+                           width=width, height=height, phash=image_hash)
+
+        with self._write_lock:
+            conn = self._conn()
+            with conn:
+                plan_id = conn.execute(
+                    'INSERT INTO plans (created_at, prompt, customization) VALUES (?, ?, ?)',
+                    (now, user_prompt, json.dumps(customization, default=str))
+                ).lastrowid
+                for row in rows:
+                    asset_id = conn.execute(
+                        'INSERT INTO assets (plan_id, created_at, name, kind, asset_type, model, prompt, source_url,'
+                        ' content_hash, thumbnail_hash, mime, size_bytes, width, height, phash)'
+                        ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (plan_id, now, row['name'], row['kind'], row.get('asset_type'), row.get('model'),
+                         row.get('prompt'), row.get('source_url'), row.get('content_hash'),
+                         row.get('thumbnail_hash'), row.get('mime'), row.get('size_bytes'),
+                         row.get('width'), row.get('height'),
+                         None if row.get('phash') is None else _to_signed(row['phash']))
+                    ).lastrowid
+                    if row.get('phash') is not None and self._hash_index is not None:
+                        self._hash_index.add(asset_id, row['phash'])
+                    conn.execute(
+                        'INSERT INTO assets_fts (rowid, name, asset_type, prompt, body) VALUES (?, ?, ?, ?, ?)',
+                        (asset_id, row['name'], row.get('asset_type') or '',
+                         ' '.join(filter(None, [user_prompt, row.get('prompt')])), row.get('body') or '')
+                    )
+            self.version += 1
+        return plan_id
+
+    # Point the image assets recorded from `old_url` (e.g. a preview) at the
+    # image at `new_url`, downloading and storing it; returns how many
+    # assets were updated. The old pHash stays in a loaded hash index.
+    def replace_image(self, old_url, new_url, model=None, downloaded=None):
+        media = self._store_media([new_url], {new_url}, downloaded or {})
+        if new_url not in media:
+            return 0
+        digest, thumb_hash, size_bytes, width, height, image_hash = media[new_url]
+        with self._write_lock:
+            conn = self._conn()
+            with conn:
+                ids = [row[0] for row in conn.execute(
+                    "SELECT id FROM assets WHERE kind = 'image' AND source_url = ?", (old_url,))]
+                conn.executemany(
+                    'UPDATE assets SET source_url = ?, model = COALESCE(?, model), content_hash = ?, thumbnail_hash = ?,'
+                    ' size_bytes = ?, width = ?, height = ?, phash = ? WHERE id = ?',
+                    [(new_url, model, digest, thumb_hash, size_bytes, width, height,
+                      None if image_hash is None else _to_signed(image_hash), asset_id) for asset_id in ids])
+            if image_hash is not None and self._hash_index is not None:
+                for asset_id in ids:
+                    self._hash_index.add(asset_id, image_hash)
+            self.version += 1
+        return len(ids)
+
+    def _where(self, text, kind, asset_type, plan_id):
+        clauses, params = [], []
+        if text and fts_query(text):
+            clauses.append('a.id IN (SELECT rowid FROM assets_fts WHERE assets_fts MATCH ?)')
+            params.append(fts_query(text))
+        if kind:
+            clauses.append('a.kind = ?')
+            params.append(kind)
+        if asset_type:
+            clauses.append('a.asset_type = ?')
+            params.append(asset_type)
+        if plan_id:
+            clauses.append('a.plan_id = ?')
+            params.append(plan_id)
+        return clauses, params
+
+    # One page of assets, newest first. Pass the last id of the previous page
+    # as `before_id` to get the next page.
+    def search(self, text=None, kind=None, asset_type=None, plan_id=None, before_id=None, limit=20):
+        clauses, params = self._where(text, kind, asset_type, plan_id)
+        if before_id:
+            clauses.append('a.id < ?')
+            params.append(before_id)
+        where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        rows = self._conn().execute(
+            f'SELECT a.*, p.prompt AS plan_prompt FROM assets a JOIN plans p ON p.id = a.plan_id'
+            f' {where} ORDER BY a.id DESC LIMIT ?',
+            params + [limit]
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self, text=None, kind=None, asset_type=None, plan_id=None):
+        clauses, params = self._where(text, kind, asset_type, plan_id)
+        where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        return self._conn().execute(f'SELECT COUNT(*) FROM assets a {where}', params).fetchone()[0]
+
+    def asset_types(self, kind=None):
+        if kind:
+            rows = self._conn().execute(
+                'SELECT DISTINCT asset_type FROM assets WHERE kind = ? ORDER BY asset_type', (kind,)
+            )
+        else:
+            rows = self._conn().execute('SELECT DISTINCT asset_type FROM assets ORDER BY asset_type')
+        return [row[0] for row in rows if row[0]]
+
+    # Image hash index over the whole catalogue, loaded on first use
+    def hash_index(self):
+        with self._write_lock:
+            if self._hash_index is None:
+                index = HashIndex()
+                for asset_id, value in self._conn().execute('SELECT id, phash FROM assets WHERE phash IS NOT NULL'):
+                    index.add(asset_id, _to_unsigned(value))
+                self._hash_index = index
+            return self._hash_index
+
+    # [(asset id, source URL, pHash)] of the catalogued images at `urls`
+    def image_hashes(self, urls):
+        urls = [url for url in dict.fromkeys(urls) if isinstance(url, str)]
+        rows = []
+        for start in range(0, len(urls), 500):
+            chunk = urls[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            rows.extend(self._conn().execute(
+                f"SELECT id, source_url, phash FROM assets WHERE kind = 'image' AND phash IS NOT NULL"
+                f" AND source_url IN ({marks})", chunk))
+        return [(asset_id, url, _to_unsigned(value)) for asset_id, url, value in rows]
+
+    # Catalogued images whose pHash is within max_distance: [(asset_id, distance)]
+    def similar_images(self, value, max_distance=DUPLICATE_DISTANCE):
+        return self.hash_index().query(value, max_distance)
+
+    # Stored bytes for a remote asset URL, so exports do not download it again
+    def content_for_url(self, url):
+        row = self._conn().execute(
+            'SELECT content_hash FROM assets WHERE source_url = ? AND content_hash IS NOT NULL ORDER BY id DESC LIMIT 1',
+            (url,)
+        ).fetchone()
+        data = self.blobs.get(row[0]) if row else None
+        CACHE_LOOKUPS.inc('asset_library', 'miss' if data is None else 'hit')
+        return data
+
+    # Stored thumbnail of a remote image URL, for previews without the full image
+    def thumbnail_for_url(self, url):
+        row = self._conn().execute(
+            'SELECT thumbnail_hash FROM assets WHERE source_url = ? AND thumbnail_hash IS NOT NULL ORDER BY id DESC LIMIT 1',
+            (url,)
+        ).fetchone()
+        data = self.blobs.get(row[0]) if row else None
+        CACHE_LOOKUPS.inc('thumbnail', 'miss' if data is None else 'hit')
+        return data
+
+    def blob(self, digest):
+        return self.blobs.get(digest) if digest else None
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+# Process-wide catalogue shared by all sessions
+def get_catalog():
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = Catalog()
+        return _catalog
@@ -0,0 +1,148 @@
+# Shared, size-bounded store for per-session results.
+# Sessions keep only small TextRef handles in st.session_state; the text and
+# bytes they point to live here, content-addressed so identical results are
+# stored once across sessions. A small in-memory LRU tier serves hot content
+# and a larger on-disk tier holds the rest; both evict least recently used
+# content across all sessions once over budget. A handle whose content has
+# been evicted resolves to an "Error: ..." string, which the incremental
+# planner treats as unusable, so the next submit regenerates it.
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from services.blobs import DATA_DIR, BlobDir, content_hash
+
+STORE_DIR = os.path.join(DATA_DIR, 'session_store')
+MEMORY_LIMIT = int(float(os.environ.get('GAMEDEV_STORE_MEMORY_MB', '16')) * 1024 * 1024)
+DISK_LIMIT = int(float(os.environ.get('GAMEDEV_STORE_DISK_MB', '512')) * 1024 * 1024)
+INLINE_LIMIT = int(os.environ.get('GAMEDEV_STORE_INLINE_LIMIT', '512'))
+EXPIRED = "Error: This result expired from the session store; generate the plan again to restore it."
+
+TextRef = namedtuple('TextRef', ['digest', 'size'])
+
+
+class ContentStore:
+    def __init__(self, root=STORE_DIR, memory_limit=MEMORY_LIMIT, disk_limit=DISK_LIMIT):
+        self.blobs = BlobDir(root)
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._load_disk_index()
+
+    # Rebuild the disk LRU order from file access times after a restart
+    def _load_disk_index(self):
+        entries = []
+        for shard in os.scandir(self.blobs.root):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.is_file() and not entry.name.startswith('tmp'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, digest, size in sorted(entries):
+            self._disk[digest] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def _remember(self, digest, data):
+        if digest in self._memory:
+            self._memory.move_to_end(digest)
+            return
+        if len(data) > self.memory_limit // 4:
+            return  # large blobs are served from disk only
+        self._memory[digest] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.disk_limit and len(self._disk) > 1:
+            digest, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(self.blobs.path(digest))
+            except FileNotFoundError:
+                pass
+
+    def put(self, data):
+        digest = content_hash(data)
+        with self._lock:
+            if digest in self._disk:
+                self._disk.move_to_end(digest)
+            else:
+                self.blobs.put(data)
+                self._disk[digest] = len(data)
+                self._disk_bytes += len(data)
+                self._evict_disk()
+            self._remember(digest, data)
+        return digest
+
+    def get(self, digest):
+        with self._lock:
+            data = self._memory.get(digest)
+            if data is not None:
+                self._memory.move_to_end(digest)
+                if digest in self._disk:
+                    self._disk.move_to_end(digest)
+                return data
+            if digest not in self._disk:
+                return None
+            self._disk.move_to_end(digest)
+        data = self.blobs.get(digest)
+        if data is None:
+            with self._lock:
+                self._disk_bytes -= self._disk.pop(digest, 0)
+            return None
+        try:
+            os.utime(self.blobs.path(digest))
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self._remember(digest, data)
+        return data
+
+    def stats(self):
+        with self._lock:
+            return {
+                'memory_items': len(self._memory), 'memory_bytes': self._memory_bytes,
+                'disk_items': len(self._disk), 'disk_bytes': self._disk_bytes,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+# Process-wide store shared by all sessions
+def get_content_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ContentStore()
+        return _store
+
+
+# Copy of a plan with every long string replaced by a TextRef handle
+def externalize(value, store=None):
+    store = store or get_content_store()
+    if isinstance(value, dict):
+        return {key: externalize(item, store) for key, item in value.items()}
+    if isinstance(value, str) and len(value) > INLINE_LIMIT:
+        data = value.encode('utf-8')
+        return TextRef(store.put(data), len(data))
+    return value
+
+
+# Inverse of externalize; evicted content comes back as an "Error: ..." string
+def resolve(value, store=None):
+    store = store or get_content_store()
+    if isinstance(value, dict):
+        return {key: resolve(item, store) for key, item in value.items()}
+    if isinstance(value, TextRef):
+        data = store.get(value.digest)
+        return EXPIRED if data is None else data.decode('utf-8')
+    return value
@@ -0,0 +1,145 @@
+# Export-time image optimisation.
+# Every exported image is downscaled to the size requested for its asset
+# type, re-encoded as the smallest lossless PNG we can get (palette mode
+# when it has at most 256 colours, otherwise max zlib effort) and optionally
+# given WebP/AVIF variants. Work runs in the shared process pool; results
+# are cached by (content hash, options) in the blob store so unchanged
+# assets are never re-optimised.
+import json
+import os
+import threading
+from io import BytesIO
+
+from services.blobs import DATA_DIR, content_hash, get_blob_dir
+from services.metrics import CACHE_LOOKUPS
+from services.prompts import IMAGE_SIZES
+from services.workers import parallel_map
+
+CACHE_DIR = os.path.join(DATA_DIR, 'export_cache')
+CACHE_VERSION = 1
+WEBP_QUALITY = 90
+AVIF_QUALITY = 70
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+# Requested size for an image name such as "background_image_2"
+def target_size(name):
+    prefix = name.split('_image_')[0]
+    for img_type, size in IMAGE_SIZES.items():
+        if img_type.lower() == prefix:
+            return size
+    return None
+
+
+def _encode(image, format, **params):
+    buffer = BytesIO()
+    image.save(buffer, format=format, **params)
+    return buffer.getvalue()
+
+
+# Lossless palette conversion when the image uses at most 256 distinct colours
+def _palette_image(image):
+    import numpy as np
+    from PIL import Image
+
+    rgba = np.asarray(image.convert('RGBA'))
+    packed = rgba.view(np.uint32).reshape(-1)
+    colours, inverse = np.unique(packed, return_inverse=True)
+    if len(colours) > 256:
+        return None
+    palette_rgba = colours.view(np.uint8).reshape(-1, 4)
+    indices = inverse.reshape(rgba.shape[:2]).astype(np.uint8)
+    paletted = Image.fromarray(indices, 'P')
+    paletted.putpalette(palette_rgba[:, :3].ravel().tolist())
+    if (palette_rgba[:, 3] < 255).any():
+        paletted.info['transparency'] = bytes(palette_rgba[:, 3].tolist())
+    return paletted
+
+
+# Worker entry point: optimise one image. Returns (name, {extension: bytes}).
+def optimize_image(item):
+    from PIL import Image
+
+    name, data, options = item
+    image = Image.open(BytesIO(data))
+    image.load()
+    original_size = image.size
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+    size = target_size(name) if options.get('downscale') else None
+    if size and (image.width > size[0] or image.height > size[1]):
+        image.thumbnail(size, Image.LANCZOS)
+
+    candidates = [_encode(image, 'PNG', optimize=True, compress_level=9)]
+    paletted = _palette_image(image)
+    if paletted is not None:
+        candidates.append(_encode(paletted, 'PNG', optimize=True))
+    if image.size == original_size and data.startswith(PNG_SIGNATURE):
+        candidates.append(data)  # never make an unscaled PNG bigger
+    outputs = {'png': min(candidates, key=len)}
+
+    if options.get('webp'):
+        outputs['webp'] = _encode(image, 'WEBP', quality=WEBP_QUALITY, method=6)
+    if options.get('avif'):
+        try:
+            outputs['avif'] = _encode(image, 'AVIF', quality=AVIF_QUALITY)
+        except (KeyError, OSError, ValueError):
+            pass  # Pillow built without AVIF support
+    return name, outputs
+
+
+def _cache_key(name, data, options):
+    settings = {k: bool(options.get(k)) for k in ('downscale', 'webp', 'avif')}
+    settings['size'] = target_size(name) if options.get('downscale') else None
+    settings = json.dumps(settings, sort_keys=True)
+    return content_hash(data + f"|v{CACHE_VERSION}|{settings}".encode('utf-8'))
+
+
+def _cache_get(key):
+    try:
+        with open(os.path.join(CACHE_DIR, f"{key}.json"), 'r') as file:
+            manifest = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    blobs = get_blob_dir()
+    outputs = {ext: blobs.get(digest) for ext, digest in manifest.items()}
+    return outputs if all(value is not None for value in outputs.values()) else None
+
+
+def _cache_put(key, outputs):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    blobs = get_blob_dir()
+    manifest = {ext: blobs.put(body) for ext, body in outputs.items()}
+    path = os.path.join(CACHE_DIR, f"{key}.json")
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, path)
+
+
+# Optimise {name: image bytes}; returns {file name: bytes} for the ZIP, e.g.
+# "enemy_image_1.png" and, when enabled, "webp/enemy_image_1.webp".
+def optimize_images(images, options):
+    files = {}
+    todo = []
+    keys = {}
+    for name, data in images.items():
+        keys[name] = _cache_key(name, data, options)
+        cached = _cache_get(keys[name])
+        CACHE_LOOKUPS.inc('export', 'miss' if cached is None else 'hit')
+        if cached is None:
+            todo.append((name, data, options))
+        else:
+            files.update(_file_names(name, cached))
+    for name, outputs in parallel_map(optimize_image, todo):
+        _cache_put(keys[name], outputs)
+        files.update(_file_names(name, outputs))
+    return files
+
+
+def _file_names(name, outputs):
+    return {
+        (f"{name}.png" if ext == 'png' else f"{ext}/{name}.{ext}"): body
+        for ext, body in outputs.items()
+    }
@@ -0,0 +1,171 @@
+# Workflow graph state for the canvas.
+# Nodes live in a dict by id and edges in successor/predecessor adjacency
+# maps, so moving a node is O(1), removing one is O(degree) and adding an
+# edge checks for a cycle with one O(V+E) reachability search. Every edit is
+# an op (a small JSON dict) applied through apply(); accepted ops are
+# numbered with the graph's version and kept in a bounded log, so a client
+# that has seen version v is brought up to date with ops_since(v) instead
+# of a full snapshot. Ops:
+#   {'op': 'add_node', 'id', 'kind', 'x', 'y'}
+#   {'op': 'move_node', 'id', 'x', 'y'}
+#   {'op': 'remove_node', 'id'}
+#   {'op': 'add_edge', 'source', 'target'}
+#   {'op': 'remove_edge', 'source', 'target'}
+#   {'op': 'set_params', 'id', 'params'}
+import itertools
+import threading
+from collections import deque
+
+LOG_SIZE = 1000
+OPS = ('add_node', 'move_node', 'remove_node', 'add_edge', 'remove_edge', 'set_params')
+
+
+class GraphError(Exception):
+    pass
+
+
+class Graph:
+    def __init__(self, kinds=None, log_size=LOG_SIZE):
+        self.kinds = kinds  # allowed node kinds, or None for any
+        self.nodes = {}
+        self.successors = {}
+        self.predecessors = {}
+        self.version = 0
+        self._log = deque(maxlen=log_size)
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+
+    def new_id(self, kind):
+        with self._lock:
+            while True:
+                node_id = f"{kind}-{next(self._ids)}"
+                if node_id not in self.nodes:
+                    return node_id
+
+    def edges(self):
+        return [(source, target) for source, targets in self.successors.items() for target in targets]
+
+    # Apply an op and log it with the new version; raises GraphError if the
+    # op is invalid (unknown node, duplicate id, cycle...). `origin` tags who
+    # made it, so a client is not sent back its own edits.
+    def apply(self, op, origin=None):
+        with self._lock:
+            if op.get('op') not in OPS:
+                raise GraphError(f"Unknown graph op: {op.get('op')}")
+            try:
+                op = getattr(self, f"_{op['op']}")(op)
+            except (KeyError, TypeError, ValueError) as e:
+                raise GraphError(f"Malformed {op['op']} op: {e!r}") from e
+            self.version += 1
+            self._log.append((self.version, origin, op))
+            return self.version
+
+    def _node(self, node_id):
+        if node_id not in self.nodes:
+            raise GraphError(f"No node {node_id}")
+        return self.nodes[node_id]
+
+    def _add_node(self, op):
+        node_id, kind = op['id'], op['kind']
+        if node_id in self.nodes:
+            raise GraphError(f"Node {node_id} already exists")
+        if self.kinds is not None and kind not in self.kinds:
+            raise GraphError(f"Unknown node kind: {kind}")
+        self.nodes[node_id] = {'kind': kind, 'x': float(op.get('x', 0)), 'y': float(op.get('y', 0)),
+                               'params': dict(op.get('params') or {})}
+        self.successors[node_id] = set()
+        self.predecessors[node_id] = set()
+        return dict(op, x=self.nodes[node_id]['x'], y=self.nodes[node_id]['y'])
+
+    def _move_node(self, op):
+        node = self._node(op['id'])
+        node['x'], node['y'] = float(op['x']), float(op['y'])
+        return {'op': 'move_node', 'id': op['id'], 'x': node['x'], 'y': node['y']}
+
+    def _remove_node(self, op):
+        node_id = op['id']
+        self._node(node_id)
+        for target in self.successors.pop(node_id):
+            self.predecessors[target].discard(node_id)
+        for source in self.predecessors.pop(node_id):
+            self.successors[source].discard(node_id)
+        del self.nodes[node_id]
+        return {'op': 'remove_node', 'id': node_id}
+
+    def _add_edge(self, op):
+        source, target = op['source'], op['target']
+        self._node(source)
+        self._node(target)
+        if target in self.successors[source]:
+            raise GraphError(f"{source} is already connected to {target}")
+        if source == target or self.reaches(target, source):
+            raise GraphError(f"Connecting {source} to {target} would create a cycle")
+        self.successors[source].add(target)
+        self.predecessors[target].add(source)
+        return {'op': 'add_edge', 'source': source, 'target': target}
+
+    def _remove_edge(self, op):
+        source, target = op['source'], op['target']
+        if target not in self.successors.get(source, ()):
+            raise GraphError(f"{source} is not connected to {target}")
+        self.successors[source].discard(target)
+        self.predecessors[target].discard(source)
+        return {'op': 'remove_edge', 'source': source, 'target': target}
+
+    def _set_params(self, op):
+        self._node(op['id'])['params'].update(op['params'])
+        return {'op': 'set_params', 'id': op['id'], 'params': dict(op['params'])}
+
+    # Whether `target` can be reached from `start` along edges (iterative DFS)
+    def reaches(self, start, target):
+        seen = {start}
+        stack = [start]
+        while stack:
+            node_id = stack.pop()
+            if node_id == target:
+                return True
+            for successor in self.successors[node_id]:
+                if successor not in seen:
+                    seen.add(successor)
+                    stack.append(successor)
+        return False
+
+    # Node ids in dependency order (Kahn's algorithm)
+    def topological_order(self):
+        with self._lock:
+            remaining = {node_id: len(sources) for node_id, sources in self.predecessors.items()}
+            ready = deque(node_id for node_id, count in remaining.items() if count == 0)
+            order = []
+            while ready:
+                node_id = ready.popleft()
+                order.append(node_id)
+                for target in self.successors[node_id]:
+                    remaining[target] -= 1
+                    if remaining[target] == 0:
+                        ready.append(target)
+            if len(order) != len(self.nodes):
+                raise GraphError("The workflow has a cycle")
+            return order
+
+    # Ops after `version` as [(version, op)], leaving out those made by
+    # `origin`; None when the log no longer reaches back that far
+    def ops_since(self, version, origin=None):
+        with self._lock:
+            if version > self.version:
+                return None
+            if version < self.version and (not self._log or self._log[0][0] > version + 1):
+                return None
+            return [(v, op) for v, op_origin, op in self._log if v > version and (origin is None or op_origin != origin)]
+
+    # Snapshot and topological order of the same version of the graph
+    def ordered_snapshot(self):
+        with self._lock:
+            return self.snapshot(), self.topological_order()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'version': self.version,
+                'nodes': [dict(node, id=node_id, params=dict(node['params'])) for node_id, node in self.nodes.items()],
+                'edges': [{'source': source, 'target': target} for source, target in self.edges()],
+            }
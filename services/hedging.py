@@ -0,0 +1,178 @@
+# Hedged requests, provider failover and circuit breaking.
+# The hedger keeps recent latencies per model. When hedging is on and a call
+# runs past the configured latency percentile, a backup request is fired
+# (to the fallback model, or the same model if none is configured) and the
+# first successful result wins; the loser is cancelled. A per-model circuit
+# breaker stops routing to a model that keeps failing until it cools down,
+# then lets a single trial request through: success closes it, failure
+# opens it for another cooldown.
+import asyncio
+import threading
+import time
+from collections import deque
+
+from services.metrics import PROVIDER_RETRIES
+from services.perf import percentile
+from services.providers import ProviderError, provider_for
+
+MIN_SAMPLES = 5
+DEFAULT_HEDGE_DELAY = 10.0
+
+
+class LatencyTracker:
+    def __init__(self, maxlen=200):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=maxlen)
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    # Latency at the given percentile, or None until enough samples exist
+    def percentile(self, pct):
+        with self._lock:
+            if len(self._samples) < MIN_SAMPLES:
+                return None
+            samples = sorted(self._samples)
+        return percentile(samples, pct)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, cooldown=60.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def _admits(self):
+        if self._opened_at is None:
+            return True
+        return not self._probing and time.monotonic() - self._opened_at >= self.cooldown
+
+    # Closed, or open long enough that one trial request may go through
+    # and none is in flight yet. Does not claim the trial; see acquire().
+    def allows(self):
+        with self._lock:
+            return self._admits()
+
+    # Claim permission for one request: always when closed; when open, only
+    # the single half-open trial after the cooldown, until it finishes
+    def acquire(self):
+        with self._lock:
+            if not self._admits():
+                return False
+            if self._opened_at is not None:
+                self._probing = True
+            return True
+
+    # A request ended without a verdict (e.g. a cancelled hedge), so the trial slot is free again
+    def release(self):
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    # A failed trial re-opens the circuit for another cooldown
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+
+class Hedger:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._breakers = {}
+
+    def latency(self, model):
+        with self._lock:
+            return self._latency.setdefault(model, LatencyTracker())
+
+    def breaker(self, model):
+        with self._lock:
+            return self._breakers.setdefault(model, CircuitBreaker())
+
+    # Models to try in order: healthy ones first, open circuits last
+    def candidates(self, primary, fallback=None):
+        models = [primary]
+        if fallback and fallback != primary:
+            models.append(fallback)
+        healthy = [m for m in models if self.breaker(m).allows()]
+        return healthy + [m for m in models if m not in healthy]
+
+    async def _timed(self, model, call):
+        breaker = self.breaker(model)
+        if not breaker.acquire():
+            raise ProviderError(f"{model} keeps failing; its circuit breaker is open.")
+        started = time.perf_counter()
+        try:
+            result = await call(model)
+        except ProviderError:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        self.latency(model).record(time.perf_counter() - started)
+        breaker.record_success()
+        return result
+
+    # Call `call(model)` with failover, and with hedging when `hedge_pct` is set
+    async def run(self, call, primary, fallback=None, hedge_pct=None):
+        models = self.candidates(primary, fallback)
+        if hedge_pct is None:
+            error = None
+            for i, model in enumerate(models):
+                if i:
+                    PROVIDER_RETRIES.inc(provider_for(model), model, 'failover')
+                try:
+                    return await self._timed(model, call)
+                except ProviderError as e:
+                    error = e
+            raise error
+
+        first = models[0]
+        backup = models[1] if len(models) > 1 else first
+        delay = self.latency(first).percentile(hedge_pct) or DEFAULT_HEDGE_DELAY
+
+        pending = {asyncio.ensure_future(self._timed(first, call))}
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done or next(iter(done)).exception() is not None:
+            # Primary is slow or already failed: fire the backup
+            PROVIDER_RETRIES.inc(provider_for(backup), backup, 'hedge')
+            pending.add(asyncio.ensure_future(self._timed(backup, call)))
+
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+_hedger = Hedger()
+
+
+# Process-wide hedger so latency history and breakers survive reruns and sessions
+def get_hedger():
+    return _hedger
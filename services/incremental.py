@@ -0,0 +1,56 @@
+# Incremental plan regeneration.
+# Every generated result is keyed by its location in the plan and fingerprinted
+# by the inputs that produced it (prompt text, size, model, ...). On the next
+# run only results whose fingerprint changed are regenerated; the rest are
+# carried over from the previous plan. Because image and music prompts embed
+# the game concept, regenerating the concept invalidates them automatically.
+import hashlib
+import json
+
+from services.metrics import CACHE_LOOKUPS
+
+
+# Stable hash of the inputs that produce one result
+def fingerprint(*inputs):
+    payload = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# Whether a stored result is worth carrying over
+def is_usable(value):
+    if value is None:
+        return False
+    if isinstance(value, str) and value.startswith('Error'):
+        return False
+    return True
+
+
+class IncrementalPlan:
+    def __init__(self, previous_plan=None, previous_inputs=None):
+        self.previous_plan = previous_plan or {}
+        self.previous_inputs = previous_inputs or {}
+        self.inputs = {}
+        self.reused = []
+
+    def _lookup(self, section, name):
+        if section is None:
+            return self.previous_plan.get(name)
+        return (self.previous_plan.get(section) or {}).get(name)
+
+    # Record the inputs for a result and return (True, old value) when it can be reused
+    def check(self, section, name, *inputs):
+        key = name if section is None else f"{section}/{name}"
+        fp = fingerprint(*inputs)
+        self.inputs[key] = fp
+        if self.previous_inputs.get(key) == fp:
+            value = self._lookup(section, name)
+            if is_usable(value):
+                self.reused.append(key)
+                CACHE_LOOKUPS.inc('plan', 'hit')
+                return True, value
+        CACHE_LOOKUPS.inc('plan', 'miss')
+        return False, None
+
+    # Forget the inputs of a result so the next run regenerates it
+    def invalidate(self, section, name):
+        self.inputs.pop(name if section is None else f"{section}/{name}", None)
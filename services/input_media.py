@@ -0,0 +1,199 @@
+# Input images for workflow nodes.
+# An upload is normalised once: EXIF orientation applied, shrunk to the
+# largest side its model makes use of and re-encoded (JPEG, or PNG when it
+# has transparency). The result goes into the blob store, and the mapping
+# from (upload hash, max side) to it is kept in SQLite, so uploading the
+# same file again costs one hash. When a node runs, the normalised image is
+# sent to Replicate's file API once per (content, API key); runs in any
+# session reuse the file URL until it is about to expire. Expired URLs are
+# dropped and the least recently used ones are evicted past MAX_UPLOADS.
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from io import BytesIO
+
+from services.blobs import DATA_DIR, content_hash, get_blob_dir
+from services.metrics import CACHE_LOOKUPS
+from services.providers import ProviderError, upload_file
+
+INPUT_MEDIA_PATH = os.path.join(DATA_DIR, 'input_media.sqlite3')
+DEFAULT_MAX_SIDE = 2048
+JPEG_QUALITY = 92
+ORIENTATION_TAG = 0x0112
+# Replicate keeps uploaded files for a day; used when it does not say
+UPLOAD_TTL = float(os.environ.get('GAMEDEV_UPLOAD_TTL', str(23 * 3600)))
+# A URL closer than this to expiring is not handed to a new prediction
+UPLOAD_MARGIN = 3600
+MAX_UPLOADS = int(os.environ.get('GAMEDEV_MAX_UPLOADS', '5000'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS normalized (
+    source TEXT NOT NULL,
+    max_side INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    mime TEXT NOT NULL,
+    PRIMARY KEY (source, max_side)
+);
+CREATE TABLE IF NOT EXISTS uploads (
+    digest TEXT NOT NULL,
+    key_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (digest, key_id)
+);
+CREATE INDEX IF NOT EXISTS uploads_last_used ON uploads(last_used);
+"""
+
+
+class InputImageError(Exception):
+    pass
+
+
+# Orient, shrink and re-encode image bytes; returns (bytes, mime type). The
+# original is kept when it is already upright, small enough and no larger.
+def normalize_image(data, max_side=DEFAULT_MAX_SIDE):
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        original = Image.open(BytesIO(data))
+        changed = original.getexif().get(ORIENTATION_TAG, 1) != 1
+        image = ImageOps.exif_transpose(original)
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        raise InputImageError(f"Not a readable image: {e}") from e
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        changed = True
+    buffer = BytesIO()
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        image.save(buffer, format='PNG', optimize=True)
+        mime = 'image/png'
+    else:
+        image.convert('RGB').save(buffer, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+        mime = 'image/jpeg'
+    if not changed and original.format in ('PNG', 'JPEG') and len(data) <= buffer.tell():
+        return data, Image.MIME[original.format]
+    return buffer.getvalue(), mime
+
+
+# Expiry of a Replicate file as epoch seconds
+def _expiry(expires_at, now):
+    try:
+        return datetime.fromisoformat(expires_at.replace('Z', '+00:00')).timestamp()
+    except (AttributeError, ValueError):
+        return now + UPLOAD_TTL
+
+
+class InputMedia:
+    def __init__(self, path=INPUT_MEDIA_PATH, blobs=None, max_uploads=MAX_UPLOADS):
+        self.path = path
+        self.blobs = blobs or get_blob_dir()
+        self.max_uploads = max_uploads
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._pending = {}
+        with self._write_lock:
+            self._conn().executescript(SCHEMA)
+
+    # One connection per thread, as in services/catalog.py
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # Normalise uploaded bytes for a model taking images up to `max_side`;
+    # returns (blob hash, mime type). Raises InputImageError.
+    def add(self, data, max_side=DEFAULT_MAX_SIDE):
+        source = content_hash(data)
+        row = self._conn().execute('SELECT digest, mime FROM normalized WHERE source = ? AND max_side = ?',
+                                   (source, max_side)).fetchone()
+        hit = row is not None and self.blobs.exists(row[0])
+        CACHE_LOOKUPS.inc('input_image', 'hit' if hit else 'miss')
+        if hit:
+            return row[0], row[1]
+        normalized, mime = normalize_image(data, max_side)
+        digest = self.blobs.put(normalized)
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute('INSERT OR REPLACE INTO normalized VALUES (?, ?, ?, ?)', (source, max_side, digest, mime))
+            conn.commit()
+        return digest, mime
+
+    # Cached file URL of `digest` for `key_id` that is not about to expire,
+    # marking it used; None if there is none
+    def _cached_url(self, digest, key_id):
+        now = time.time()
+        row = self._conn().execute('SELECT url, expires_at FROM uploads WHERE digest = ? AND key_id = ?',
+                                   (digest, key_id)).fetchone()
+        if not row or row[1] - now <= UPLOAD_MARGIN:
+            return None
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute('UPDATE uploads SET last_used = ? WHERE digest = ? AND key_id = ?', (now, digest, key_id))
+            conn.commit()
+        return row[0]
+
+    # Remember an uploaded file URL, dropping expiring and least recently used ones
+    def _store_upload(self, digest, key_id, url, size_bytes, expires_at):
+        now = time.time()
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute('INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?)',
+                         (digest, key_id, url, size_bytes, _expiry(expires_at, now), now))
+            conn.execute('DELETE FROM uploads WHERE expires_at - ? <= ?', (now, UPLOAD_MARGIN))
+            conn.execute('DELETE FROM uploads WHERE rowid IN (SELECT rowid FROM uploads ORDER BY last_used DESC '
+                         'LIMIT -1 OFFSET ?)', (self.max_uploads,))
+            conn.commit()
+
+    # Replicate file URL for a normalised image (blob hash), uploading it
+    # with the caller's key only when no usable URL is cached. Concurrent
+    # calls for the same image on one event loop share one upload. SQLite
+    # and blob reads run in worker threads, off the shared event loop.
+    async def file_url(self, api_keys, digest, mime):
+        key_id = hashlib.sha256((api_keys.get('replicate') or '').encode('utf-8')).hexdigest()[:16]
+        url = await asyncio.to_thread(self._cached_url, digest, key_id)
+        CACHE_LOOKUPS.inc('input_upload', 'miss' if url is None else 'hit')
+        if url is not None:
+            return url
+        loop = asyncio.get_running_loop()
+        pending = self._pending.get((digest, key_id))
+        if pending is None or pending.get_loop() is not loop:
+            pending = self._pending[digest, key_id] = loop.create_task(self._upload(api_keys, digest, mime, key_id))
+            pending.add_done_callback(lambda task: self._pending.pop((digest, key_id), None))
+        return await asyncio.shield(pending)
+
+    async def _upload(self, api_keys, digest, mime, key_id):
+        data = await asyncio.to_thread(self.blobs.get, digest)
+        if data is None:
+            raise ProviderError("The uploaded input image is no longer available; upload it again.")
+        extension = 'png' if mime == 'image/png' else 'jpg'
+        url, expires_at = await upload_file(api_keys, data, f"{digest[:16]}.{extension}", mime)
+        await asyncio.to_thread(self._store_upload, digest, key_id, url, len(data), expires_at)
+        return url
+
+    def stats(self):
+        count, size = self._conn().execute('SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM uploads').fetchone()
+        return {'uploads': count, 'uploaded_bytes': size}
+
+
+_input_media = None
+_input_media_lock = threading.Lock()
+
+
+# Process-wide input image cache shared by all sessions
+def get_input_media():
+    global _input_media
+    with _input_media_lock:
+        if _input_media is None:
+            _input_media = InputMedia()
+        return _input_media
@@ -0,0 +1,271 @@
+# In-process metrics and structured logs.
+# Counters, gauges and histograms keep one shard per writing thread, so the
+# hot path is a plain dict update with no lock and no string formatting;
+# shards are only summed and rendered (Prometheus text format) when the
+# /metrics endpoint is scraped. Shards of finished threads are folded into
+# a base shard on scrape, since Streamlit starts a new thread per rerun.
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = int(os.environ.get('GAMEDEV_METRICS_PORT', '9464'))
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+
+
+# Label value escaping from the Prometheus text format: backslash, quote, newline
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Sharded:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._base = {}
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    # Snapshot of all shards as a list of dicts, folding dead threads into the base
+    def _collect(self):
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._merge(self._base, shard.copy())
+            self._shards = live
+            return [self._base.copy()] + [shard.copy() for _, shard in live]
+
+    def _label_text(self, values, extra=''):
+        pairs = [f'{k}="{_escape(v)}"' for k, v in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter(_Sharded):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, into, shard):
+        for key, value in shard.items():
+            into[key] = into.get(key, 0) + value
+
+    def values(self):
+        totals = {}
+        for shard in self._collect():
+            self._merge(totals, shard)
+        return totals
+
+    def render(self):
+        return [f'{self.name}{self._label_text(key)} {value}' for key, value in sorted(self.values().items())]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Sharded):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        row = shard.get(labels)
+        if row is None:
+            row = shard[labels] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                row[i] += 1
+                break
+        else:
+            row[len(self.buckets)] += 1
+        row[-1] += value
+
+    def _merge(self, into, shard):
+        for key, row in shard.items():
+            total = into.setdefault(key, [0] * len(row))
+            for i, value in enumerate(row):
+                total[i] += value
+
+    def render(self):
+        totals = {}
+        for shard in self._collect():
+            self._merge(totals, {key: list(row) for key, row in shard.items()})
+        lines = []
+        for key, row in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f'{self.name}_bucket{self._label_text(key, le)} {cumulative}')
+            count = cumulative + row[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f'{self.name}_bucket{self._label_text(key, le)} {count}')
+            lines.append(f'{self.name}_sum{self._label_text(key)} {row[-1]}')
+            lines.append(f'{self.name}_count{self._label_text(key)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+PROVIDER_REQUESTS = REGISTRY.register(Counter(
+    'gamedev_provider_requests_total', 'Provider API calls by outcome.', ('kind', 'provider', 'model', 'outcome')))
+PROVIDER_LATENCY = REGISTRY.register(Histogram(
+    'gamedev_provider_request_seconds', 'Provider API call latency.', ('kind', 'provider', 'model')))
+PROVIDER_RETRIES = REGISTRY.register(Counter(
+    'gamedev_provider_retries_total', 'Extra provider calls from failover and hedging.', ('provider', 'model', 'reason')))
+RATE_LIMITED = REGISTRY.register(Counter(
+    'gamedev_provider_rate_limited_total', 'Provider calls rejected with HTTP 429.', ('provider', 'model')))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'gamedev_cache_lookups_total', 'Cache lookups by cache and result.', ('cache', 'result')))
+DOWNLOADED_BYTES = REGISTRY.register(Counter(
+    'gamedev_downloaded_bytes_total', 'Bytes downloaded from provider asset URLs.', ('source',)))
+ZIP_BUILD_SECONDS = REGISTRY.register(Histogram(
+    'gamedev_zip_build_seconds', 'Time to build the export ZIP.', ()))
+ACTIVE_JOBS = REGISTRY.register(Gauge(
+    'gamedev_active_jobs', 'Game plans currently being generated.', ()))
+PREDICTIONS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'gamedev_predictions_in_flight', 'Replicate predictions awaiting completion.', ()))
+PREDICTION_POLLS = REGISTRY.register(Counter(
+    'gamedev_prediction_polls_total', 'Replicate prediction status polls.', ()))
+PREDICTION_COMPLETIONS = REGISTRY.register(Counter(
+    'gamedev_prediction_completions_total', 'Finished Replicate predictions by how completion was noticed.',
+    ('source', 'status')))
+SPECULATIONS = REGISTRY.register(Counter(
+    'gamedev_speculations_total', 'Speculative concept generations by outcome (hit, miss, started, discarded, skipped).',
+    ('element', 'outcome')))
+SPECULATION_WASTED_USD = REGISTRY.register(Counter(
+    'gamedev_speculation_wasted_usd_total', 'Estimated spend on discarded speculative generations.', ()))
+SCHEDULER_QUEUED = REGISTRY.register(Gauge(
+    'gamedev_scheduler_queued', 'Provider calls waiting for a fair-share slot.', ('provider',)))
+SCHEDULER_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'gamedev_scheduler_wait_seconds', 'Time provider calls waited for a fair-share slot.', ('provider',)))
+REFINEMENTS = REGISTRY.register(Counter(
+    'gamedev_refinements_total', 'Background high-quality renders of preview images by outcome.', ('outcome',)))
+REFINEMENT_SAVED_USD = REGISTRY.register(Counter(
+    'gamedev_refinement_saved_usd_total', 'Estimated spend avoided by cancelled refinements.', ()))
+COALESCED_REQUESTS = REGISTRY.register(Counter(
+    'gamedev_coalesced_requests_total', 'Generation requests served by an identical call already in flight.', ('kind',)))
+QUOTA_REJECTIONS = REGISTRY.register(Counter(
+    'gamedev_quota_rejections_total', 'Provider calls refused by an API key spend quota.', ('provider',)))
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {'ts': round(record.created, 3), 'level': record.levelname, 'event': record.getMessage()}
+        payload.update(getattr(record, 'fields', {}))
+        return json.dumps(payload, default=str)
+
+
+logger = logging.getLogger('gamedev')
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(_JsonFormatter())
+    logger.addHandler(_handler)
+    logger.setLevel(os.environ.get('GAMEDEV_LOG_LEVEL', 'INFO'))
+    logger.propagate = False
+
+
+# Emit one structured JSON log line; serialisation only happens if the level is enabled
+def log_event(event, level=logging.INFO, **fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields})
+
+
+# Context manager that logs an event with its latency and outcome.
+# Set `call.fields['outcome']` inside the block to report soft failures.
+class logged_call:
+    def __init__(self, event, **fields):
+        self.event = event
+        self.fields = fields
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.fields['latency_ms'] = round((time.perf_counter() - self._started) * 1000, 1)
+        if exc_type is not None:
+            self.fields['outcome'] = 'cancelled' if exc_type.__name__ == 'CancelledError' else 'error'
+            self.fields.setdefault('error', str(exc))
+        self.fields.setdefault('outcome', 'ok')
+        log_event(self.event, logging.WARNING if self.fields['outcome'] == 'error' else logging.INFO, **self.fields)
+        return False
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+# Serve /metrics on localhost once per process; returns the port or None
+def start_http_server(port=METRICS_PORT, host='127.0.0.1'):
+    global _server
+    with _server_lock:
+        if _server is None and port:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                log_event('metrics_server_unavailable', logging.WARNING, port=port, error=str(e))
+                return None
+            threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True).start()
+            log_event('metrics_server_started', port=_server.server_port)
+        return _server.server_port if _server else None
@@ -0,0 +1,53 @@
+# Script timing for cold start and per-rerun measurements.
+# Streamlit re-executes app.py on every interaction, but this module is only
+# imported once per process, so the state below survives across reruns.
+import threading
+import time
+from collections import deque
+
+_lock = threading.Lock()
+_rerun_times = deque(maxlen=200)
+_cold_start = None
+
+
+# Mark the start of a script run; returns a token for script_finished
+def script_started():
+    return time.perf_counter()
+
+
+# Record the duration of a script run started with script_started
+def script_finished(started):
+    global _cold_start
+    elapsed = time.perf_counter() - started
+    with _lock:
+        if _cold_start is None:
+            _cold_start = elapsed
+        else:
+            _rerun_times.append(elapsed)
+    return elapsed
+
+
+# Nearest-rank percentile of a sorted list
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+# Summary of cold start and rerun timings in milliseconds
+def timing_summary():
+    with _lock:
+        reruns = sorted(_rerun_times)
+        cold = _cold_start
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 1)
+
+    return {
+        'cold_start_ms': ms(cold),
+        'reruns': len(reruns),
+        'rerun_p50_ms': ms(percentile(reruns, 50)),
+        'rerun_p95_ms': ms(percentile(reruns, 95)),
+        'rerun_max_ms': ms(reruns[-1] if reruns else None),
+    }
@@ -0,0 +1,149 @@
+# Perceptual hashing and near-duplicate lookup for generated images.
+# pHash: 32x32 grayscale -> 2-D DCT (as two matrix products with a
+# precomputed DCT basis) -> top-left 8x8 coefficients above the median of
+# all but the DC term.
+# dHash: 9x8 grayscale -> sign of horizontal gradients. Both are 64-bit ints.
+# HashIndex keeps hashes in a NumPy uint64 array and answers radius queries
+# with one XOR + popcount over the whole array, which stays sub-millisecond
+# at tens of thousands of images.
+import threading
+from functools import cache
+from io import BytesIO
+
+from services.workers import parallel_map
+
+DUPLICATE_DISTANCE = 8
+HASH_SIZE = 8
+DCT_SIZE = 32
+
+PERTURBATIONS = [
+    "Use a clearly different composition and camera angle.",
+    "Use a distinctly different color palette and lighting.",
+    "Change the pose, silhouette and proportions noticeably.",
+]
+
+
+def _dct_matrix(n):
+    import numpy as np
+
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+# DCT basis and bit weights, built on first use so importing this module stays cheap
+@cache
+def _tables():
+    import numpy as np
+
+    weights = (1 << np.arange(HASH_SIZE * HASH_SIZE - 1, -1, -1, dtype=np.uint64)).astype(np.uint64)
+    return _dct_matrix(DCT_SIZE), weights
+
+
+def _bits_to_int(bits):
+    import numpy as np
+
+    return int((bits.ravel().astype(np.uint64) * _tables()[1]).sum())
+
+
+def _gray(data, size):
+    import numpy as np
+    from PIL import Image
+
+    image = Image.open(BytesIO(data)).convert('L').resize(size, Image.LANCZOS)
+    return np.asarray(image, dtype=np.float32)
+
+
+def phash(data):
+    import numpy as np
+
+    dct = _tables()[0]
+    pixels = _gray(data, (DCT_SIZE, DCT_SIZE))
+    coefficients = (dct @ pixels @ dct.T)[:HASH_SIZE, :HASH_SIZE]
+    return _bits_to_int(coefficients > np.median(coefficients.ravel()[1:]))
+
+
+def dhash(data):
+    pixels = _gray(data, (HASH_SIZE + 1, HASH_SIZE))
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+# Per-element popcount of a uint64 array
+@cache
+def _popcount():
+    import numpy as np
+
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count
+    byte_counts = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+    return lambda values: byte_counts[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+
+class HashIndex:
+    def __init__(self):
+        import numpy as np
+
+        self._lock = threading.Lock()
+        self._hashes = np.zeros(1024, dtype=np.uint64)
+        self._keys = []
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key, value):
+        with self._lock:
+            self._add(key, value)
+
+    def _add(self, key, value):
+        import numpy as np
+
+        count = len(self._keys)
+        if count == len(self._hashes):
+            self._hashes = np.concatenate([self._hashes, np.zeros_like(self._hashes)])
+        self._hashes[count] = np.uint64(value)
+        self._keys.append(key)
+
+    # [(key, distance)] within max_distance of value, nearest first
+    def query(self, value, max_distance=DUPLICATE_DISTANCE):
+        with self._lock:
+            return self._query(value, max_distance)
+
+    # Add value unless an indexed hash is within max_distance of it, as one
+    # step; returns those matches ([] when it was added)
+    def add_unless_near(self, key, value, max_distance=DUPLICATE_DISTANCE):
+        with self._lock:
+            matches = self._query(value, max_distance)
+            if not matches:
+                self._add(key, value)
+            return matches
+
+    def _query(self, value, max_distance):
+        import numpy as np
+
+        count = len(self._keys)
+        if not count:
+            return []
+        distances = _popcount()(self._hashes[:count] ^ np.uint64(value))
+        matches = np.flatnonzero(distances <= max_distance)
+        matches = matches[np.argsort(distances[matches], kind='stable')]
+        return [(self._keys[i], int(distances[i])) for i in matches]
+
+
+# Worker entry point: pHash of one encoded image, or None if it cannot be decoded
+def hash_image(item):
+    name, data = item
+    try:
+        return name, phash(data)
+    except Exception:
+        return name, None
+
+
+# pHash {name: image bytes} in the worker pool
+def hash_images(images):
+    return {name: value for name, value in parallel_map(hash_image, images.items(), min_parallel=8) if value is not None}
@@ -0,0 +1,296 @@
+# Replicate prediction manager.
+# Instead of every call holding its own poll loop open until the model
+# finishes, one background event loop tracks all in-flight predictions.
+# Completion is learned from a local webhook receiver when GAMEDEV_WEBHOOK_URL
+# is set (the public URL Replicate should call, e.g. a tunnel to
+# GAMEDEV_WEBHOOK_PORT) and GAMEDEV_WEBHOOK_SECRET (to check each call's
+# signature; without it no receiver is started), and from adaptive polling
+# otherwise or as a safety net: a prediction is first polled around its model's typical run time, then
+# at growing intervals, with caps on concurrent creates and polls so
+# thousands of predictions in flight do not stampede the API. Callers on any event loop
+# simply await the finished prediction; cancelling the caller cancels the
+# prediction on Replicate.
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from io import BytesIO
+
+from services.cassettes import get_cassette, httpx_transport
+from services.metrics import PREDICTION_COMPLETIONS, PREDICTION_POLLS, PREDICTIONS_IN_FLIGHT, log_event
+
+WEBHOOK_URL = os.environ.get('GAMEDEV_WEBHOOK_URL')
+WEBHOOK_HOST = os.environ.get('GAMEDEV_WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.environ.get('GAMEDEV_WEBHOOK_PORT', '9465'))
+WEBHOOK_SECRET = os.environ.get('GAMEDEV_WEBHOOK_SECRET')
+WEBHOOK_PATH = '/replicate/webhook'
+WEBHOOK_TOLERANCE = 300
+
+TERMINAL_STATUSES = ('succeeded', 'failed', 'canceled')
+MIN_POLL_INTERVAL = 0.5
+MAX_POLL_INTERVAL = 30.0
+POLL_BACKOFF = 1.5
+FIRST_POLL = 1.0
+WEBHOOK_GRACE = 10.0
+MAX_CONCURRENT_POLLS = 16
+MAX_CONCURRENT_CREATES = 32
+DURATION_ALPHA = 0.3
+
+
+class _Tracked:
+    def __init__(self, prediction_id, api_key, model, future, first_poll):
+        self.id = prediction_id
+        self.api_key = api_key
+        self.model = model
+        self.future = future
+        self.created = time.monotonic()
+        self.interval = first_poll
+        self.next_poll = self.created + first_poll
+
+
+class PredictionManager:
+    def __init__(self, webhook_url=WEBHOOK_URL, host=WEBHOOK_HOST, port=WEBHOOK_PORT, secret=WEBHOOK_SECRET):
+        self.webhook_url = webhook_url
+        self.host = host
+        self.port = port
+        self.secret = secret
+        self._lock = threading.Lock()
+        self._loop = None
+        self._clients = {}
+        self._tracked = {}
+        self._schedule = []
+        self._sequence = itertools.count()
+        self._wakeup = None
+        self._poll_slots = None
+        self._create_slots = None
+        self._durations = {}
+        self.polls = 0
+        self.completions = {'webhook': 0, 'poll': 0}
+
+    # Start the background loop (and webhook receiver) on first use
+    def start(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+            ready = threading.Event()
+            threading.Thread(target=self._serve, args=(ready,), name='replicate-predictions', daemon=True).start()
+            ready.wait()
+
+    def _serve(self, ready):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._wakeup = asyncio.Event()
+        self._poll_slots = asyncio.Semaphore(MAX_CONCURRENT_POLLS)
+        self._create_slots = asyncio.Semaphore(MAX_CONCURRENT_CREATES)
+        if self.webhook_url and not self.secret:
+            # An unsigned receiver would accept forged completions from anyone
+            log_event('webhook_receiver_unavailable', logging.WARNING, port=self.port,
+                      error="GAMEDEV_WEBHOOK_SECRET is not set; polling instead")
+            self.webhook_url = None
+        if self.webhook_url:
+            try:
+                loop.run_until_complete(self._start_receiver())
+            except OSError as e:
+                log_event('webhook_receiver_unavailable', logging.WARNING, port=self.port, error=str(e))
+                self.webhook_url = None
+        loop.create_task(self._poller())
+        self._loop = loop
+        ready.set()
+        loop.run_forever()
+
+    async def _start_receiver(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self._handle_webhook)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        log_event('webhook_receiver_started', host=self.host, port=self.port, url=self.webhook_url)
+
+    def _client(self, api_key):
+        import replicate
+
+        client = self._clients.get(api_key)
+        if client is None:
+            cassette = get_cassette()
+            options = {'transport': httpx_transport(cassette)} if cassette else {}
+            client = self._clients[api_key] = replicate.Client(api_token=api_key, **options)
+        return client
+
+    # Expected run time of a model from past predictions, if any
+    def expected_duration(self, model):
+        return self._durations.get(model)
+
+    def _first_poll(self, model):
+        expected = self._durations.get(model)
+        if self.webhook_url:
+            # Polling is only a safety net for lost webhook calls
+            return min(max(2 * expected, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL) if expected else WEBHOOK_GRACE
+        if expected:
+            return min(max(expected * 0.9, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL)
+        return FIRST_POLL
+
+    def _schedule_poll(self, entry):
+        heapq.heappush(self._schedule, (entry.next_poll, next(self._sequence), entry.id))
+        self._wakeup.set()
+
+    # Run a model and return the finished prediction as a dict with
+    # status, output and error. Safe to call from any event loop.
+    async def run(self, api_key, ref, input):
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self._run(api_key, ref, input), self._loop)
+        return await asyncio.wrap_future(future)
+
+    async def _run(self, api_key, ref, input):
+        client = self._client(api_key)
+        model, _, version = ref.partition(':')
+        params = {}
+        if self.webhook_url:
+            params = {'webhook': self.webhook_url, 'webhook_events_filter': ['completed']}
+        async with self._create_slots:
+            if version:
+                create = client.predictions.async_create(version=version, input=input, **params)
+            else:
+                create = client.models.predictions.async_create(model=model, input=input, **params)
+            create = asyncio.ensure_future(create)
+            try:
+                prediction = await asyncio.shield(create)
+            except asyncio.CancelledError:
+                # The request may already be on its way; cancel the prediction once its id is known
+                create.add_done_callback(lambda task: self._cancel_created(client, task))
+                raise
+        if prediction.status in TERMINAL_STATUSES:
+            return {'status': prediction.status, 'output': prediction.output, 'error': prediction.error}
+
+        entry = _Tracked(prediction.id, api_key, model, self._loop.create_future(), self._first_poll(model))
+        self._tracked[entry.id] = entry
+        PREDICTIONS_IN_FLIGHT.inc()
+        self._schedule_poll(entry)
+        try:
+            return await entry.future
+        except asyncio.CancelledError:
+            if self._tracked.pop(entry.id, None) is not None:
+                PREDICTIONS_IN_FLIGHT.dec()
+            await self._cancel(client, entry.id)
+            raise
+
+    async def _cancel(self, client, prediction_id):
+        try:
+            await client.predictions.async_cancel(prediction_id)
+        except Exception:
+            pass
+
+    def _cancel_created(self, client, create):
+        if create.cancelled() or create.exception() is not None:
+            return
+        if create.result().status not in TERMINAL_STATUSES:
+            asyncio.ensure_future(self._cancel(client, create.result().id))
+
+    # Upload bytes to Replicate's file API for use as a model input; returns
+    # the file's URL and expiry time (ISO string or None). Safe to call from
+    # any event loop.
+    async def upload(self, api_key, data, filename, content_type):
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self._upload(api_key, data, filename, content_type), self._loop)
+        return await asyncio.wrap_future(future)
+
+    async def _upload(self, api_key, data, filename, content_type):
+        async with self._create_slots:
+            file = await self._client(api_key).files.async_create(BytesIO(data), filename=filename, content_type=content_type)
+        return file.urls['get'], file.expires_at
+
+    def _complete(self, prediction_id, data, source):
+        entry = self._tracked.pop(prediction_id, None)
+        if entry is None or entry.future.done():
+            return
+        PREDICTIONS_IN_FLIGHT.dec()
+        status = data.get('status')
+        if status == 'succeeded':
+            duration = time.monotonic() - entry.created
+            previous = self._durations.get(entry.model)
+            self._durations[entry.model] = duration if previous is None else (
+                DURATION_ALPHA * duration + (1 - DURATION_ALPHA) * previous)
+        self.completions[source] += 1
+        PREDICTION_COMPLETIONS.inc(source, status)
+        entry.future.set_result({'status': status, 'output': data.get('output'), 'error': data.get('error')})
+
+    async def _poller(self):
+        while True:
+            now = time.monotonic()
+            while self._schedule and self._schedule[0][0] <= now:
+                due, _, prediction_id = heapq.heappop(self._schedule)
+                entry = self._tracked.get(prediction_id)
+                if entry is not None and entry.next_poll == due:
+                    asyncio.ensure_future(self._poll(entry))
+            self._wakeup.clear()
+            timeout = self._schedule[0][0] - now if self._schedule else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, entry):
+        async with self._poll_slots:
+            if entry.id not in self._tracked:
+                return
+            self.polls += 1
+            PREDICTION_POLLS.inc()
+            try:
+                prediction = await self._client(entry.api_key).predictions.async_get(entry.id)
+            except Exception as e:
+                log_event('prediction_poll_failed', logging.WARNING, prediction=entry.id, error=str(e))
+                prediction = None
+        if prediction is not None and prediction.status in TERMINAL_STATUSES:
+            self._complete(entry.id, {'status': prediction.status, 'output': prediction.output,
+                                      'error': prediction.error}, 'poll')
+        elif entry.id in self._tracked:
+            entry.interval = min(max(entry.interval * POLL_BACKOFF, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL)
+            entry.next_poll = time.monotonic() + entry.interval
+            self._schedule_poll(entry)
+
+    def _valid_signature(self, headers, body):
+        from replicate.webhook import WebhookSigningSecret, Webhooks, WebhookValidationError
+
+        try:
+            Webhooks.validate(headers=dict(headers), body=body, secret=WebhookSigningSecret(key=self.secret),
+                              tolerance=WEBHOOK_TOLERANCE)
+        except (WebhookValidationError, ValueError):
+            # ValueError (and binascii.Error) for a malformed timestamp or signature
+            return False
+        return True
+
+    async def _handle_webhook(self, request):
+        from aiohttp import web
+
+        body = await request.text()
+        if not self._valid_signature(request.headers, body):
+            return web.Response(status=401)
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        if data.get('status') in TERMINAL_STATUSES:
+            self._complete(data.get('id'), data, 'webhook')
+        return web.Response(status=200)
+
+    def stats(self):
+        return {'in_flight': len(self._tracked), 'polls': self.polls, 'completions': dict(self.completions)}
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+# Process-wide prediction manager shared by all sessions
+def get_prediction_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            # Cassettes see polls but not webhook calls
+            _manager = PredictionManager(webhook_url=None if get_cassette() else WEBHOOK_URL)
+        return _manager
@@ -0,0 +1,158 @@
+# Prompt assembly: compiled templates, local token counting and budgeted
+# concept summaries.
+# A long game concept is compressed once per plan to each target model's token
+# budget (an extractive summary, so it costs no extra model call) and reused by
+# every image and music prompt built from it. Templates put the text shared by
+# many calls first and the per-call part last, so repeated requests start with
+# an identical prefix that providers can cache.
+import math
+import re
+import string
+import threading
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+from services.blobs import content_hash
+from services.metrics import CACHE_LOOKUPS
+
+SUMMARY_CACHE_SIZE = 256
+
+# Models whose tokenizer is cl100k_base (used when tiktoken is installed)
+TIKTOKEN_MODELS = ('gpt-4', 'gpt-3.5-turbo', 'dall-e-3')
+
+_FORMATTER = string.Formatter()
+_TOKEN = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+_MARKUP = re.compile(r"^\s*(?:#+|[-*+>]|\d+[.)])\s+|[*_`#]+", re.MULTILINE)
+_SENTENCE = re.compile(r"(?<=[.!?])\s+|\s*\n\s*")
+_WORD = re.compile(r"[a-z][a-z'-]{2,}")
+STOPWORDS = frozenset(
+    "the and for with that this from into their there they them then than have has had will would "
+    "can could should each which while where when what who whom your you our are was were been being "
+    "its it's also such more most very some any all but not nor only over under about after before "
+    "game player players".split()
+)
+
+
+class Template:
+    # Parse the format string once; rendering only joins the pieces
+    def __init__(self, text):
+        self.text = text
+        self._parts = []
+        for literal, field, spec, conversion in _FORMATTER.parse(text):
+            if spec or conversion:
+                raise ValueError(f"Unsupported format spec in template field {field!r}")
+            self._parts.append((literal, field))
+        self.fields = frozenset(field for _, field in self._parts if field is not None)
+
+    def render(self, **values):
+        pieces = []
+        for literal, field in self._parts:
+            pieces.append(literal)
+            if field is not None:
+                pieces.append(str(values[field]))
+        return ''.join(pieces)
+
+
+# cl100k_base encoding, or None when tiktoken or its data is unavailable
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding('cl100k_base')
+    except Exception:
+        return None
+
+
+# Local token count for `model`: exact for OpenAI models when tiktoken is
+# available, otherwise a word-piece estimate close to BPE counts for English
+def count_tokens(text, model=None):
+    if not text:
+        return 0
+    if model in TIKTOKEN_MODELS:
+        encoding = _encoding()
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+    return sum(1 + len(piece) // 7 if piece[0].isalpha() else 1 for piece in _TOKEN.findall(text))
+
+
+# Longest word prefix of `text` that fits in `budget` tokens
+def truncate_to_budget(text, budget, model=None):
+    words = text.split()
+    used = 0
+    for index, word in enumerate(words):
+        used += count_tokens(word, model)
+        if used > budget:
+            return ' '.join(words[:index]).rstrip(',;:') + '...'
+    return text
+
+
+# Distinct sentences of `text` with markdown removed. Bare section headings
+# ("Overview") are dropped; other lines without closing punctuation, such as
+# "Title: ..." or list items, get a full stop.
+def _sentences(text):
+    sentences = {}
+    for sentence in _SENTENCE.split(_MARKUP.sub(' ', text)):
+        sentence = ' '.join(sentence.split()) if sentence else ''
+        if not sentence:
+            continue
+        if sentence[-1] not in '.!?':
+            if ':' not in sentence and len(sentence.split()) < 4:
+                continue
+            sentence += '.'
+        sentences.setdefault(sentence, None)
+    return list(sentences)
+
+
+# Extractive summary: keep the sentences that carry the concept's most
+# frequent content words, favouring the opening, in their original order
+def _compress(text, budget, model):
+    sentences = _sentences(text)
+    if not sentences:
+        return truncate_to_budget(' '.join(text.split()), budget, model)
+    whole = ' '.join(sentences)
+    if count_tokens(whole, model) <= budget:
+        return whole
+    words = [[w for w in _WORD.findall(s.lower()) if w not in STOPWORDS] for s in sentences]
+    frequency = Counter(w for sentence in words for w in sentence)
+    scores = []
+    for index, sentence in enumerate(words):
+        unique = set(sentence)
+        score = sum(frequency[w] for w in unique) / math.sqrt(len(sentence) or 1)
+        scores.append((score * (1 + 1 / (index + 1)), index))
+
+    chosen = []
+    used = 0
+    for _, index in sorted(scores, reverse=True):
+        cost = count_tokens(sentences[index], model) + 1
+        if used + cost <= budget:
+            chosen.append(index)
+            used += cost
+    if not chosen:
+        return truncate_to_budget(sentences[0], budget, model)
+    return ' '.join(sentences[i] for i in sorted(chosen))
+
+
+_summaries = OrderedDict()
+_summaries_lock = threading.Lock()
+
+
+# `text` compressed to at most `budget` tokens of `model`. Results are cached
+# by content, so a plan's concept is summarised once however many prompts use it.
+def summarize(text, budget, model=None):
+    if not text:
+        return ''
+    key = (content_hash(text.encode('utf-8')), budget, model)
+    with _summaries_lock:
+        summary = _summaries.get(key)
+        if summary is not None:
+            _summaries.move_to_end(key)
+    CACHE_LOOKUPS.inc('prompt_summary', 'miss' if summary is None else 'hit')
+    if summary is not None:
+        return summary
+    summary = _compress(text, budget, model)
+    with _summaries_lock:
+        _summaries[key] = summary
+        while len(_summaries) > SUMMARY_CACHE_SIZE:
+            _summaries.popitem(last=False)
+    return summary
@@ -0,0 +1,115 @@
+# Static prompt and size tables shared by the generators.
+# Kept in a module (rather than inside app.py) so they are built once per
+# process instead of on every Streamlit rerun.
+from functools import lru_cache
+
+from services.prompt_engine import Template, summarize
+
+IMAGE_TYPES = ['Character', 'Enemy', 'Background', 'Object', 'Texture', 'Sprite', 'UI']
+SCRIPT_TYPES = ['Player', 'Enemy', 'Game Object', 'Level Background']
+
+IMAGE_PROMPTS = {
+    'Character': "Create a highly detailed, front-facing character concept art for a 2D game...",
+    'Enemy': "Design a menacing, front-facing enemy character concept art for a 2D game...",
+    'Background': "Create a wide, highly detailed background image for a level of the game...",
+    'Object': "Create a detailed object image for a 2D game...",
+    'Texture': "Generate a seamless texture pattern...",
+    'Sprite': "Create a game sprite sheet with multiple animation frames...",
+    'UI': "Design a cohesive set of user interface elements for a 2D game..."
+}
+
+IMAGE_SIZES = {
+    'Character': (1024, 1024),
+    'Enemy': (1024, 1024),
+    'Background': (1920, 1080),
+    'Object': (512, 512),
+    'Texture': (512, 512),
+    'Sprite': (1024, 1024),
+    'UI': (1024, 1024)
+}
+
+SCRIPT_DESCRIPTIONS = {
+    'Player': "Create a comprehensive player character script for a 2D game. Include movement, input handling, and basic interactions.",
+    'Enemy': "Develop a detailed enemy AI script for a 2D game. Include patrolling, player detection, and attack behaviors.",
+    'Game Object': "Script a versatile game object that can be interacted with, collected, or activated by the player.",
+    'Level Background': "Create a script to manage the level background in a 2D game, including parallax scrolling if applicable."
+}
+
+# code type -> (language, file extension)
+CODE_TYPES = {
+    'unity': ('csharp', '.cs'),
+    'unreal': ('cpp', '.cpp'),
+    'blender': ('python', '.py'),
+}
+
+SYSTEM_PROMPT = "You are a highly skilled assistant specializing in {role}. Provide detailed, creative, and well-structured responses optimized for game development."
+
+# Tokens of game concept embedded per target model. Image encoders only read
+# the start of a prompt (SDXL's CLIP encoder stops at 77 tokens) and DALL-E 3
+# rejects prompts over 4000 characters.
+CONCEPT_BUDGETS = {
+    'dall-e-3': 600,
+    'SD Flux-1': 300,
+    'SDXL Lightning': 35,
+    'music': 120,
+}
+DEFAULT_CONCEPT_BUDGET = 300
+
+# Shared text first and per-call text last, so requests in a plan share a prefix
+SYSTEM_TEMPLATE = Template(SYSTEM_PROMPT)
+ELEMENT_TEMPLATE = Template("Game concept: {concept}\n\nCreate a detailed {element} for the game concept above.")
+SCRIPT_TEMPLATE = Template(
+    "Generate ONLY the code, without any explanations or comments outside the code. "
+    "Ensure the code is complete and can be directly used in a project.\n\n"
+    "Engine: {engine}\n\n{description} Variation {variation}"
+)
+IMAGE_TEMPLATE = Template("{instruction} The design should fit the following game concept: {concept}. Variation {variation}")
+MUSIC_TEMPLATE = Template("Create background music for the game: {concept}")
+
+
+# System message per role, built once so every call sends identical bytes
+@lru_cache(maxsize=None)
+def system_prompt(role):
+    return SYSTEM_TEMPLATE.render(role=role)
+
+
+# User message for one text element of the plan
+def element_prompt(element, user_prompt):
+    return ELEMENT_TEMPLATE.render(concept=user_prompt, element=element.replace('_', ' '))
+
+
+# Game concept compressed to the budget of `model`
+def concept_summary(game_concept, model):
+    return summarize(game_concept, CONCEPT_BUDGETS.get(model, DEFAULT_CONCEPT_BUDGET), model).rstrip('.')
+
+
+def music_prompt(game_concept):
+    return MUSIC_TEMPLATE.render(concept=concept_summary(game_concept, 'music'))
+
+
+# Image requests implied by the customization: image name -> (prompt, size)
+def build_image_requests(customization, game_concept):
+    results = {}
+    concept = concept_summary(game_concept, customization['image_model'])
+    for img_type in customization['image_types']:
+        for i in range(customization['image_count'].get(img_type, 0)):
+            prompt = IMAGE_TEMPLATE.render(instruction=IMAGE_PROMPTS[img_type], concept=concept, variation=i + 1)
+            results[f"{img_type.lower()}_image_{i + 1}"] = (prompt, IMAGE_SIZES[img_type])
+    return results
+
+
+# Script requests implied by the customization: file name -> (script type, description).
+# Like image prompts, each carries its variation number, so repeats of one
+# script type are separate requests rather than one coalesced call.
+def build_script_requests(customization):
+    results = {}
+    for script_type in customization['script_types']:
+        for i in range(customization['script_count'].get(script_type, 0)):
+            for code_type, selected in customization['code_types'].items():
+                if not selected or code_type not in CODE_TYPES:
+                    continue  # Skip unselected or unknown code types
+                lang, file_ext = CODE_TYPES[code_type]
+                desc = SCRIPT_TEMPLATE.render(engine=code_type.capitalize(), description=SCRIPT_DESCRIPTIONS[script_type],
+                                              variation=i + 1)
+                results[f"{script_type.lower()}_{code_type}_script_{i + 1}{file_ext}"] = (script_type, desc)
+    return results
@@ -0,0 +1,320 @@
+# Raw provider calls for OpenAI and Replicate.
+# These functions take the API keys explicitly (no Streamlit state) and raise
+# ProviderError on failure, so callers can retry, hedge or fail over before
+# deciding how to surface the error to the user.
+import asyncio
+import functools
+import json
+import logging
+import math
+import os
+import time
+
+from services.cassettes import get_cassette
+from services.metrics import DOWNLOADED_BYTES, PROVIDER_LATENCY, PROVIDER_REQUESTS, RATE_LIMITED, log_event
+from services.predictions import get_prediction_manager
+from services.scheduler import QuotaExceeded, get_scheduler
+
+# Point at another OpenAI-compatible server (e.g. a local mock) with OPENAI_BASE_URL;
+# the Replicate client reads REPLICATE_BASE_URL the same way
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1').rstrip('/')
+CHAT_API_URL = f"{OPENAI_BASE_URL}/chat/completions"
+DALLE_API_URL = f"{OPENAI_BASE_URL}/images/generations"
+
+CHAT_MODELS = ['gpt-4', 'gpt-3.5-turbo', 'llama']
+IMAGE_MODELS = ['dall-e-3', 'SD Flux-1', 'SDXL Lightning']
+
+LLAMA_MODEL = "meta/llama-2-70b-chat"
+FLUX_MODEL = "black-forest-labs/flux-pro"
+SDXL_LIGHTNING_MODEL = "bytedance/sdxl-lightning-4step"
+MUSICGEN_MODEL = "meta/musicgen"
+
+# Estimated USD per call, for the per-key spend quotas (chat calls are
+# estimated from their prompt with the router's token prices)
+IMAGE_PRICES = {'dall-e-3': 0.04, 'SD Flux-1': 0.055, 'SDXL Lightning': 0.002}
+LARGE_DALLE_PRICE = 0.08
+MUSIC_PRICE = 0.05
+WORKFLOW_NODE_PRICE = 0.01
+EXPECTED_CHAT_OUTPUT_TOKENS = 700
+
+
+# `status` is the HTTP status of the failed request when the provider gave one
+class ProviderError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+# Provider that serves a chat or image model, used for labelling stats
+def provider_for(model):
+    if model in ('gpt-4', 'gpt-3.5-turbo', 'dall-e-3'):
+        return 'openai'
+    return 'replicate'
+
+
+# Record request count, latency and 429s for a provider call, labelled by
+# provider and model. `model` is taken from the call's second argument
+# unless given.
+def _observed(kind, model=None):
+    def decorate(func):
+        @functools.wraps(func)
+        async def wrapper(api_keys, *args, **kwargs):
+            name = model or args[0]
+            provider = provider_for(name)
+            started = time.perf_counter()
+            outcome = 'ok'
+            try:
+                return await func(api_keys, *args, **kwargs)
+            except asyncio.CancelledError:
+                outcome = 'cancelled'
+                raise
+            except ProviderError as e:
+                outcome = 'error'
+                if e.status == 429:
+                    outcome = 'rate_limited'
+                    RATE_LIMITED.inc(provider, name)
+                log_event('provider_error', logging.WARNING, kind=kind, provider=provider, model=name, status=e.status, error=str(e))
+                raise
+            finally:
+                PROVIDER_REQUESTS.inc(kind, provider, name, outcome)
+                PROVIDER_LATENCY.observe(time.perf_counter() - started, kind, provider, name)
+        return wrapper
+    return decorate
+
+
+# Estimated spend of one call, from the same arguments the call receives
+def estimated_cost(kind, model, args):
+    if kind == 'image':
+        if model == 'dall-e-3' and max(args[2]) > 1024:
+            return LARGE_DALLE_PRICE
+        return IMAGE_PRICES.get(model, 0.0)
+    if kind == 'music':
+        return MUSIC_PRICE
+    if kind == 'workflow':
+        return WORKFLOW_NODE_PRICE
+    from services.prompt_engine import count_tokens
+    from services.router import estimate_cost  # the router imports this module
+
+    system, prompt = args[1], args[2]
+    return estimate_cost(model, count_tokens(system, model) + count_tokens(prompt, model), EXPECTED_CHAT_OUTPUT_TOKENS)
+
+
+# Run a provider call inside a fair-share slot for the API key it bills to
+# (see services/scheduler.py). Applied outside _observed so queueing time is
+# not counted as provider latency.
+def _scheduled(kind, model=None):
+    def decorate(func):
+        @functools.wraps(func)
+        async def wrapper(api_keys, *args, **kwargs):
+            name = model or args[0]
+            provider = provider_for(name)
+            scheduler = get_scheduler()
+            try:
+                pool = await scheduler.acquire(provider, api_keys.get(provider) or '', estimated_cost(kind, name, args))
+            except QuotaExceeded as e:
+                raise ProviderError(str(e)) from e
+            try:
+                return await func(api_keys, *args, **kwargs)
+            finally:
+                scheduler.release(pool)
+        return wrapper
+    return decorate
+
+
+def _openai_headers(api_key):
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+async def _aiohttp_request(method, url, headers=None, body=None):
+    import aiohttp
+
+    async with aiohttp.ClientSession() as session:
+        async with session.request(method, url, headers=headers, data=body) as response:
+            return response.status, response.content_type, await response.read()
+
+
+# One HTTP request with aiohttp, through the record/replay cassette when one
+# is configured; returns (status, content type, body bytes)
+async def http_request(method, url, headers=None, data=None):
+    body = json.dumps(data).encode('utf-8') if data is not None else None
+    send = functools.partial(_aiohttp_request, method, url, headers, body)
+    cassette = get_cassette()
+    if cassette is None:
+        return await send()
+    return await cassette.exchange(method, url, body, send)
+
+
+# POST a JSON body to an OpenAI endpoint and return the decoded response
+async def openai_post(url, api_key, data):
+    try:
+        status, _, body = await http_request('POST', url, _openai_headers(api_key), data)
+        if status == 429:
+            raise ProviderError("Rate limited by the OpenAI API (HTTP 429).", status=429)
+        return json.loads(body)
+    except (asyncio.CancelledError, ProviderError):
+        raise
+    except Exception as e:
+        raise ProviderError(f"Unable to communicate with the OpenAI API: {str(e)}", status=getattr(e, 'status', None)) from e
+
+
+# Run a Replicate model and return its raw output.
+# The prediction manager tracks the prediction until a webhook or poll
+# reports it finished; a cancelled call (e.g. the losing side of a hedged
+# request) also cancels the prediction on Replicate instead of leaving it
+# running and billing.
+async def replicate_run(api_key, ref, input):
+    try:
+        result = await get_prediction_manager().run(api_key, ref, input)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        raise ProviderError(str(e), status=getattr(e, 'status', None)) from e
+
+    if result['status'] != "succeeded":
+        raise ProviderError(result['error'] or f"Prediction {result['status']}")
+    return result['output']
+
+
+# Chat completion with the given model; returns the response text
+@_scheduled('chat')
+@_observed('chat')
+async def chat(api_keys, model, system, prompt):
+    if model in ['gpt-4', 'gpt-3.5-turbo']:
+        data = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt}
+            ]
+        }
+        response_data = await openai_post(CHAT_API_URL, api_keys['openai'], data)
+        if "choices" not in response_data:
+            raise ProviderError(response_data.get("error", {}).get("message", "Unknown error"))
+        return response_data["choices"][0]["message"]["content"]
+    elif model == 'llama':
+        try:
+            output = await replicate_run(
+                api_keys['replicate'],
+                LLAMA_MODEL,
+                {
+                    "prompt": f"{system}\n\n{prompt}\n\n",
+                    "temperature": 0.75,
+                    "top_p": 0.9,
+                    "max_length": 500,
+                    "repetition_penalty": 1
+                }
+            )
+        except ProviderError as e:
+            raise ProviderError(f"Unable to generate content using Llama: {str(e)}", status=e.status) from e
+        return ''.join(output)
+    raise ProviderError("Invalid chat model selected.")
+
+
+# Generate one image with the given model; returns the image URL
+@_scheduled('image')
+@_observed('image')
+async def image(api_keys, model, prompt, size, steps=25, guidance=3.0, interval=2.0):
+    if model == 'dall-e-3':
+        data = {
+            "model": "dall-e-3",
+            "prompt": prompt,
+            "size": f"{size[0]}x{size[1]}",
+            "n": 1,
+            "response_format": "url"
+        }
+        try:
+            response_data = await openai_post(DALLE_API_URL, api_keys['openai'], data)
+        except ProviderError as e:
+            raise ProviderError(f"Unable to generate image: {str(e)}", status=e.status) from e
+        if "data" not in response_data:
+            raise ProviderError(response_data.get("error", {}).get("message", "Unknown error"))
+        if not response_data["data"]:
+            raise ProviderError("No data returned from API.")
+        return response_data["data"][0]["url"]
+    elif model == 'SD Flux-1':
+        width, height = size
+        divisor = math.gcd(width, height)
+        try:
+            return await replicate_run(
+                api_keys['replicate'],
+                FLUX_MODEL,
+                {
+                    "prompt": prompt,
+                    "aspect_ratio": f"{width // divisor}:{height // divisor}",
+                    "steps": steps,
+                    "guidance": guidance,
+                    "interval": interval,
+                    "safety_tolerance": 2,
+                    "output_format": "png",
+                    "output_quality": 100
+                }
+            )
+        except ProviderError as e:
+            raise ProviderError(f"Unable to generate image using SD Flux-1: {str(e)}", status=e.status) from e
+    elif model == 'SDXL Lightning':
+        try:
+            output = await replicate_run(api_keys['replicate'], SDXL_LIGHTNING_MODEL, {"prompt": prompt})
+        except ProviderError as e:
+            raise ProviderError(f"Unable to generate image using SDXL Lightning: {str(e)}", status=e.status) from e
+        if not output:
+            raise ProviderError("No image returned from SDXL Lightning.")
+        return output[0]
+    raise ProviderError("Invalid image model selected.")
+
+
+# Generate background music with MusicGen; returns the audio URL
+@_scheduled('music', model=MUSICGEN_MODEL)
+@_observed('music', model=MUSICGEN_MODEL)
+async def music(api_keys, prompt):
+    try:
+        output = await replicate_run(
+            api_keys['replicate'],
+            MUSICGEN_MODEL,
+            {
+                "prompt": prompt,
+                "model_version": "stereo-large",
+                "output_format": "mp3",
+                "normalization_strategy": "peak"
+            }
+        )
+    except ProviderError as e:
+        raise ProviderError(f"Unable to generate music: {str(e)}", status=e.status) from e
+    if isinstance(output, str) and output.startswith("http"):
+        return output
+    raise ProviderError("MusicGen did not return an audio URL.")
+
+
+# Run one workflow node's Replicate model with the given input; returns its raw output
+@_scheduled('workflow')
+@_observed('workflow')
+async def workflow_node(api_keys, model, input):
+    return await replicate_run(api_keys['replicate'], model, input)
+
+
+# Upload a model input file to Replicate; returns its URL and expiry time
+# (ISO string or None). Uploads are free, so they skip the scheduler.
+@_observed('upload', model='replicate-files')
+async def upload_file(api_keys, data, filename, content_type):
+    try:
+        return await get_prediction_manager().upload(api_keys['replicate'], data, filename, content_type)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        raise ProviderError(f"Unable to upload {filename}: {str(e)}", status=getattr(e, 'status', None)) from e
+
+
+# Download a generated asset (image or audio) and return its bytes
+async def fetch_bytes(url):
+    try:
+        status, _, data = await http_request('GET', url)
+        if status >= 400:
+            raise ProviderError(f"Unable to download {url}: HTTP {status}", status=status)
+    except (asyncio.CancelledError, ProviderError):
+        raise
+    except Exception as e:
+        raise ProviderError(f"Unable to download {url}: {str(e)}", status=getattr(e, 'status', None)) from e
+    DOWNLOADED_BYTES.inc('provider', amount=len(data))
+    return data
@@ -0,0 +1,120 @@
+# Preview-then-refine image generation.
+# In this mode a plan's images are first rendered with the fast
+# PREVIEW_MODEL, so the Results tab fills within seconds. Each preview is
+# then re-rendered with the selected model here, off the script thread, on
+# an event loop shared by every session, at a lower fair-share weight than
+# foreground work. The Results tab polls take() and swaps each preview for
+# its final image as it arrives. Refinements can be cancelled one at a time
+# (a rejected preview) or all at once; cancelling stops the provider call,
+# so nothing more is spent on it.
+import asyncio
+import threading
+
+from services.metrics import REFINEMENT_SAVED_USD, REFINEMENTS
+
+PREVIEW_MODEL = 'SDXL Lightning'
+REFINEMENT_WEIGHT = 0.5
+REFINEMENT_POLL = 1.0  # seconds between Results tab checks for finished images
+STATES = ('refining', 'done', 'failed', 'cancelled')
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='refinement', daemon=True).start()
+        return _loop
+
+
+class _Refinement:
+    def __init__(self, preview, cost):
+        self.preview = preview
+        self.cost = cost
+        self.state = 'refining'
+        self.final = None
+        self.error = None
+        self.taken = False
+        self.future = None
+
+
+# One session's refinements, by image name
+class Refiner:
+    def __init__(self):
+        # Re-entrant: cancelling a future runs _finished in the cancelling thread
+        self._lock = threading.RLock()
+        self._entries = {}
+        self.saved_usd = 0.0
+
+    # Refine image `name`, shown meanwhile as the `preview` URL. `start()`
+    # returns the coroutine producing the final URL; `cost` is its estimated spend.
+    def start(self, name, preview, start, cost=0.0):
+        with self._lock:
+            previous = self._entries.get(name)
+            if previous is not None:
+                previous.future.cancel()
+            entry = self._entries[name] = _Refinement(preview, cost)
+            entry.future = asyncio.run_coroutine_threadsafe(start(), _background_loop())
+            entry.future.add_done_callback(lambda future: self._finished(entry, future))
+        REFINEMENTS.inc('started')
+
+    def _finished(self, entry, future):
+        with self._lock:
+            if future.cancelled():
+                entry.state = 'cancelled'
+            elif future.exception() is not None:
+                entry.state, entry.error = 'failed', str(future.exception())
+            elif isinstance(future.result(), str) and future.result().startswith('http'):
+                entry.state, entry.final = 'done', future.result()
+            else:
+                entry.state, entry.error = 'failed', "The model returned no image."
+        REFINEMENTS.inc(entry.state)
+
+    # Stop refining one image, or all of them; its preview stays in the plan
+    def cancel(self, name=None):
+        with self._lock:
+            for entry_name in [name] if name else list(self._entries):
+                entry = self._entries.get(entry_name)
+                if entry is not None and entry.state == 'refining':
+                    entry.future.cancel()
+                    self.saved_usd += entry.cost
+                    REFINEMENT_SAVED_USD.inc(amount=entry.cost)
+
+    # Keep only the refinements whose preview is still in `images` (name -> URL)
+    def retain(self, images):
+        with self._lock:
+            for name, entry in list(self._entries.items()):
+                if images.get(name) != entry.preview:
+                    entry.future.cancel()
+                    del self._entries[name]
+
+    # Refinements finished since the last call: {name: (preview URL, final URL)}
+    def take(self):
+        with self._lock:
+            finished = {}
+            for name, entry in self._entries.items():
+                if entry.state == 'done' and not entry.taken:
+                    entry.taken = True
+                    finished[name] = (entry.preview, entry.final)
+            return finished
+
+    def state(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            return entry.state if entry is not None else None
+
+    @property
+    def active(self):
+        with self._lock:
+            return any(entry.state == 'refining' for entry in self._entries.values())
+
+    def stats(self):
+        with self._lock:
+            counts = dict.fromkeys(STATES, 0)
+            for entry in self._entries.values():
+                counts[entry.state] += 1
+            errors = [entry.error for entry in self._entries.values() if entry.error]
+        return dict(counts, total=sum(counts.values()), saved_usd=self.saved_usd, errors=errors)
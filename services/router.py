@@ -0,0 +1,232 @@
+# Cost- and latency-aware routing of chat requests to models.
+# Each request carries a task (a text element name or a script type) that
+# maps to a minimum quality tier and an expected output length. The router
+# predicts latency and cost per candidate model from its own observed stats
+# (seeded with static priors) and picks one according to the routing mode.
+# Realized latency and cost are accumulated per plan in a PlanReport.
+import contextvars
+import threading
+import time
+
+from services.prompt_engine import count_tokens
+from services.providers import CHAT_MODELS
+
+ROUTING_MODES = ['off', 'fast', 'balanced', 'quality']
+
+# Static priors: USD per 1k input/output tokens, quality tier (higher is
+# better), fixed overhead seconds and seconds per output token.
+MODEL_PROFILES = {
+    'gpt-4': {'input_cost': 0.03, 'output_cost': 0.06, 'quality': 3, 'overhead': 1.5, 'per_token': 0.05},
+    'gpt-3.5-turbo': {'input_cost': 0.0005, 'output_cost': 0.0015, 'quality': 2, 'overhead': 0.6, 'per_token': 0.012},
+    'llama': {'input_cost': 0.00065, 'output_cost': 0.00275, 'quality': 1, 'overhead': 3.0, 'per_token': 0.03},
+}
+
+# task -> (minimum quality tier, expected output tokens)
+TASK_PROFILES = {
+    'game_concept': (3, 900),
+    'world_concept': (2, 800),
+    'character_concepts': (2, 800),
+    'plot': (1, 500),
+    'storyline': (2, 1000),
+    'dialogue': (2, 700),
+    'game_mechanics': (2, 800),
+    'level_design': (2, 900),
+    'script:Player': (2, 900),
+    'script:Enemy': (2, 900),
+    'script:Game Object': (1, 500),
+    'script:Level Background': (1, 500),
+}
+DEFAULT_TASK_PROFILE = (2, 700)
+
+# Smoothing factor for the observed-latency moving averages
+EWMA_ALPHA = 0.3
+
+
+# Local token estimate for `model` (see services/prompt_engine.py)
+def estimate_tokens(text, model=None):
+    return max(1, count_tokens(text, model))
+
+
+def estimate_cost(model, input_tokens, output_tokens):
+    profile = MODEL_PROFILES.get(model)
+    if profile is None:
+        return 0.0
+    return (input_tokens * profile['input_cost'] + output_tokens * profile['output_cost']) / 1000
+
+
+class ModelStats:
+    def __init__(self, model):
+        profile = MODEL_PROFILES[model]
+        self.calls = 0
+        self.errors = 0
+        self.overhead = profile['overhead']
+        self.per_token = profile['per_token']
+
+    @property
+    def error_rate(self):
+        return self.errors / self.calls if self.calls else 0.0
+
+    def record(self, latency, ok, output_tokens):
+        self.calls += 1
+        if not ok:
+            self.errors += 1
+            return
+        # Split the observation between fixed overhead and per-token time
+        # using the current per-token estimate, then smooth both.
+        per_token = max(0.0, (latency - self.overhead) / max(output_tokens, 1))
+        overhead = max(0.0, latency - self.per_token * output_tokens)
+        self.per_token += EWMA_ALPHA * (per_token - self.per_token)
+        self.overhead += EWMA_ALPHA * (overhead - self.overhead)
+
+    def predict_latency(self, output_tokens):
+        return self.overhead + self.per_token * output_tokens
+
+
+class ModelRouter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {model: ModelStats(model) for model in MODEL_PROFILES}
+
+    def record(self, model, latency, ok, output_tokens):
+        with self._lock:
+            if model in self._stats:
+                self._stats[model].record(latency, ok, output_tokens)
+
+    def stats(self):
+        with self._lock:
+            return {
+                model: {
+                    'calls': s.calls,
+                    'error_rate': round(s.error_rate, 3),
+                    'predicted_latency_s': round(s.predict_latency(DEFAULT_TASK_PROFILE[1]), 2),
+                }
+                for model, s in self._stats.items()
+            }
+
+    # Pick a model for one request.
+    # `selected` is the user's model choice, returned unchanged when routing is off.
+    def choose(self, task, prompt, mode, selected, available=None, latency_budget=None):
+        if mode == 'off' or mode not in ROUTING_MODES:
+            return selected
+        min_quality, output_tokens = TASK_PROFILES.get(task, DEFAULT_TASK_PROFILE)
+        input_tokens = estimate_tokens(prompt)
+        candidates = [m for m in (available or CHAT_MODELS) if m in MODEL_PROFILES]
+        if not candidates:
+            return selected
+
+        with self._lock:
+            scored = []
+            for model in candidates:
+                stats = self._stats[model]
+                latency = stats.predict_latency(output_tokens)
+                # Expected retries inflate both latency and spend
+                penalty = 1.0 / max(1.0 - stats.error_rate, 0.1)
+                scored.append({
+                    'model': model,
+                    'quality': MODEL_PROFILES[model]['quality'],
+                    'latency': latency * penalty,
+                    'cost': estimate_cost(model, input_tokens, output_tokens) * penalty,
+                })
+
+        if mode == 'quality':
+            return max(scored, key=lambda c: (c['quality'], -c['latency']))['model']
+
+        eligible = [c for c in scored if c['quality'] >= min_quality] or scored
+        if latency_budget:
+            within = [c for c in eligible if c['latency'] <= latency_budget]
+            eligible = within or [min(eligible, key=lambda c: c['latency'])]
+
+        if mode == 'fast':
+            return min(eligible, key=lambda c: (c['latency'], c['cost']))['model']
+
+        # balanced: normalise latency and cost against the cheapest/fastest candidate
+        best_latency = min(c['latency'] for c in eligible) or 1e-6
+        best_cost = min(c['cost'] for c in eligible) or 1e-6
+        return min(
+            eligible,
+            key=lambda c: c['latency'] / best_latency + c['cost'] / best_cost - c['quality']
+        )['model']
+
+
+class PlanReport:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = []
+
+    # A coalesced call joined an identical one in flight: it costs nothing
+    # and is not counted as a provider call
+    def add(self, task, model, latency, ok, input_tokens, output_tokens, coalesced=False):
+        with self._lock:
+            self.calls.append({
+                'task': task,
+                'model': model,
+                'latency_s': round(latency, 2),
+                'ok': ok,
+                'input_tokens': input_tokens,
+                'output_tokens': output_tokens,
+                'cost_usd': round(estimate_cost(model, input_tokens, output_tokens), 5) if ok and not coalesced else 0.0,
+                'coalesced': coalesced,
+            })
+
+    # Add the calls recorded in another report (e.g. speculative ones adopted by this plan)
+    def merge(self, other):
+        with other._lock:
+            calls = list(other.calls)
+        with self._lock:
+            self.calls.extend(calls)
+
+    # Per-model totals for display
+    def summary(self):
+        with self._lock:
+            calls = list(self.calls)
+        per_model = {}
+        for call in calls:
+            row = per_model.setdefault(call['model'], {'model': call['model'], 'calls': 0, 'coalesced': 0, 'errors': 0,
+                                                       'latency_s': 0.0, 'cost_usd': 0.0})
+            if call.get('coalesced'):
+                row['coalesced'] += 1
+            else:
+                row['calls'] += 1
+                row['errors'] += 0 if call['ok'] else 1
+            row['latency_s'] = round(row['latency_s'] + call['latency_s'], 2)
+            row['cost_usd'] = round(row['cost_usd'] + call['cost_usd'], 5)
+        return {
+            'total_cost_usd': round(sum(c['cost_usd'] for c in calls), 4),
+            'total_latency_s': round(sum(c['latency_s'] for c in calls), 2),
+            'total_input_tokens': sum(c['input_tokens'] for c in calls),
+            'models': list(per_model.values()),
+        }
+
+
+# Report for the plan currently being generated; asyncio tasks inherit it
+current_report = contextvars.ContextVar('current_report', default=None)
+
+
+# Time one model call and record it in the router stats and the current report
+async def recorded_call(router, task, model, prompt, call):
+    started = time.perf_counter()
+    input_tokens = estimate_tokens(prompt, model)
+    try:
+        result = await call(model)
+    except Exception:
+        latency = time.perf_counter() - started
+        router.record(model, latency, False, 0)
+        report = current_report.get()
+        if report is not None:
+            report.add(task, model, latency, False, input_tokens, 0)
+        raise
+    latency = time.perf_counter() - started
+    output_tokens = estimate_tokens(result, model)
+    router.record(model, latency, True, output_tokens)
+    report = current_report.get()
+    if report is not None:
+        report.add(task, model, latency, True, input_tokens, output_tokens)
+    return result
+
+
+_router = ModelRouter()
+
+
+# Process-wide router so observed stats accumulate across sessions
+def get_router():
+    return _router
@@ -0,0 +1,242 @@
+# Process-wide fair-share scheduler for provider calls.
+# Every session's chat, image and music calls ask for a slot in the pool of
+# the API key they bill to, so sessions sharing keys are coordinated instead
+# of each running unbounded. Each pool caps concurrent calls for its key and,
+# optionally, the estimated spend per rolling hour. Waiting calls are
+# served by weighted fair queuing across flows (one per session, plus a
+# lower-weight flow for speculative calls): each call is tagged with a
+# virtual finish time that advances with its flow's own backlog. A session
+# asking for a handful of calls is therefore served between the calls of a
+# 40-image batch rather than behind all of them, and while several sessions
+# share a key no single one may hold its last RESERVED_SLOTS slots, so their
+# calls rarely wait for a batch's long calls at all. Sessions run their own event
+# loops on their own threads, so waiters are woken with call_soon_threadsafe.
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+from services.blobs import content_hash
+from services.metrics import QUOTA_REJECTIONS, SCHEDULER_QUEUED, SCHEDULER_WAIT_SECONDS, log_event
+
+PROVIDER_CONCURRENCY = {
+    'openai': int(os.environ.get('GAMEDEV_OPENAI_CONCURRENCY', '8')),
+    'replicate': int(os.environ.get('GAMEDEV_REPLICATE_CONCURRENCY', '16')),
+}
+DEFAULT_CONCURRENCY = 8
+PROVIDER_NAMES = {'openai': 'OpenAI', 'replicate': 'Replicate'}
+# Estimated USD per API key per rolling hour; 0 disables the quota
+SPEND_LIMIT = float(os.environ.get('GAMEDEV_KEY_SPEND_USD_PER_HOUR', '0'))
+SPEND_WINDOW = 3600.0
+SPECULATIVE_WEIGHT = 0.25
+# Slots held back from any one flow while other sessions use the same key
+RESERVED_SLOTS = int(os.environ.get('GAMEDEV_RESERVED_SLOTS', '1'))
+SHARE_WINDOW = 5.0
+
+# A fair-queuing flow: `id` groups the calls of one session, `weight` is its share
+Flow = namedtuple('Flow', ['id', 'weight'])
+DEFAULT_FLOW = Flow('default', 1.0)
+
+# Flow of the plan being generated; asyncio tasks inherit it
+current_flow = contextvars.ContextVar('current_flow', default=DEFAULT_FLOW)
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class _Waiter:
+    def __init__(self, flow, loop, charge):
+        self.flow = flow
+        self.loop = loop
+        self.future = loop.create_future()
+        self.charge = charge
+        self.granted = False
+        self.cancelled = False
+
+
+class _Pool:
+    def __init__(self, provider, limit, spend_limit):
+        self.provider = provider
+        self.limit = limit
+        self.spend_limit = spend_limit
+        self.active = 0
+        self.queue = []
+        self.queued = 0
+        self.virtual = 0.0
+        self.last_finish = {}
+        self.flow_active = {}
+        self.seen = {}
+        self.spend = deque()
+        self.spent = 0.0
+
+
+class FairScheduler:
+    def __init__(self, concurrency=None, spend_limit=SPEND_LIMIT):
+        self.concurrency = dict(PROVIDER_CONCURRENCY, **(concurrency or {}))
+        self.spend_limit = spend_limit
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._sequence = itertools.count()
+
+    def _pool(self, provider, api_key):
+        key = (provider, content_hash(api_key.encode('utf-8'))[:16])
+        pool = self._pools.get(key)
+        if pool is None:
+            limit = self.concurrency.get(provider, DEFAULT_CONCURRENCY)
+            pool = self._pools[key] = _Pool(provider, limit, self.spend_limit)
+        return pool
+
+    def _expire(self, pool, now):
+        while pool.spend and now - pool.spend[0][0] > SPEND_WINDOW:
+            pool.spent -= pool.spend.popleft()[1]
+
+    def _charge(self, pool, usd):
+        now = time.monotonic()
+        self._expire(pool, now)
+        if pool.spend_limit and pool.spent + usd > pool.spend_limit:
+            QUOTA_REJECTIONS.inc(pool.provider)
+            log_event('spend_quota_exceeded', provider=pool.provider, spent_usd=round(pool.spent, 4))
+            raise QuotaExceeded(f"The hourly spend quota of ${pool.spend_limit:.2f} for this "
+                                f"{PROVIDER_NAMES.get(pool.provider, pool.provider)} API key has been reached; try again later.")
+        charge = [now, usd]
+        pool.spend.append(charge)
+        pool.spent += usd
+        return charge
+
+    # Virtual finish tag of the next call of `flow`
+    def _tag(self, pool, flow):
+        start = max(pool.virtual, pool.last_finish.get(flow.id, 0.0))
+        finish = start + 1.0 / flow.weight
+        pool.last_finish[flow.id] = finish
+        if len(pool.last_finish) > 1024:
+            pool.last_finish = {f: t for f, t in pool.last_finish.items() if t > pool.virtual}
+        return finish
+
+    # Most slots one flow may hold: all of them while it has the key to
+    # itself, otherwise all but RESERVED_SLOTS, so calls from other sessions
+    # start without waiting for a batch's long calls to finish
+    def _flow_limit(self, pool, flow_id, now):
+        for other, seen in pool.seen.items():
+            if other != flow_id and now - seen < SHARE_WINDOW:
+                return max(1, pool.limit - RESERVED_SLOTS)
+        return pool.limit
+
+    # Grant free slots to waiting calls in virtual finish order (lock held)
+    def _dispatch(self, pool):
+        now = time.monotonic()
+        deferred = []
+        while pool.queue and pool.active < pool.limit:
+            item = heapq.heappop(pool.queue)
+            finish, _, waiter = item
+            if waiter.cancelled:
+                continue
+            flow_id = waiter.flow.id
+            if pool.flow_active.get(flow_id, 0) >= self._flow_limit(pool, flow_id, now):
+                deferred.append(item)
+                continue
+            pool.queued -= 1
+            SCHEDULER_QUEUED.dec(pool.provider)
+            try:
+                waiter.loop.call_soon_threadsafe(self._deliver, pool, waiter)
+            except RuntimeError:
+                continue  # the waiting session's event loop has closed
+            pool.virtual = max(pool.virtual, finish - 1.0 / waiter.flow.weight)
+            pool.active += 1
+            pool.flow_active[flow_id] = pool.flow_active.get(flow_id, 0) + 1
+            waiter.granted = True
+        for item in deferred:
+            heapq.heappush(pool.queue, item)
+
+    def _deliver(self, pool, waiter):
+        if waiter.future.cancelled():
+            self.release((pool, waiter.flow.id))
+        else:
+            waiter.future.set_result(None)
+
+    # Return the slot of a finished call
+    def release(self, slot):
+        pool, flow_id = slot
+        with self._lock:
+            pool.active -= 1
+            pool.flow_active[flow_id] -= 1
+            if not pool.flow_active[flow_id]:
+                del pool.flow_active[flow_id]
+            self._dispatch(pool)
+
+    # Wait for a slot for one call billed to `api_key` and return it for
+    # release(); raises QuotaExceeded when the call would take the key over
+    # its spend quota
+    async def acquire(self, provider, api_key, usd=0.0, flow=None):
+        flow = flow or current_flow.get()
+        started = time.perf_counter()
+        with self._lock:
+            pool = self._pool(provider, api_key)
+            charge = self._charge(pool, usd)
+            now = time.monotonic()
+            pool.seen[flow.id] = now
+            if len(pool.seen) > 256:
+                pool.seen = {f: t for f, t in pool.seen.items() if now - t < SHARE_WINDOW}
+            finish = self._tag(pool, flow)
+            waiter = _Waiter(flow, asyncio.get_running_loop(), charge)
+            heapq.heappush(pool.queue, (finish, next(self._sequence), waiter))
+            pool.queued += 1
+            SCHEDULER_QUEUED.inc(provider)
+            self._dispatch(pool)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if not waiter.granted:
+                    waiter.cancelled = True
+                    pool.queued -= 1
+                    SCHEDULER_QUEUED.dec(provider)
+                    # Refund the estimate of a call that never ran
+                    pool.spent -= charge[1]
+                    charge[1] = 0.0
+            if waiter.granted and waiter.future.done() and not waiter.future.cancelled():
+                self.release((pool, flow.id))
+            raise
+        SCHEDULER_WAIT_SECONDS.observe(time.perf_counter() - started, provider)
+        return pool, flow.id
+
+    # Queue position (1 = next) of the earliest waiting call of flow
+    # `flow_id`, the worst across pools; 0 when none of its calls is waiting
+    def position(self, flow_id):
+        with self._lock:
+            position = 0
+            for pool in self._pools.values():
+                waiting = sorted((finish, seq, waiter) for finish, seq, waiter in pool.queue if not waiter.cancelled)
+                for index, (_, _, waiter) in enumerate(waiting):
+                    if waiter.flow.id == flow_id:
+                        position = max(position, index + 1)
+                        break
+            return position
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            for pool in self._pools.values():
+                self._expire(pool, now)
+            return [
+                {'provider': pool.provider, 'active': pool.active, 'limit': pool.limit, 'queued': pool.queued,
+                 'spent_usd': round(pool.spent, 4)}
+                for pool in self._pools.values()
+            ]
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+# Process-wide scheduler shared by all sessions
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = FairScheduler()
+        return _scheduler
@@ -0,0 +1,105 @@
+# Single-flight deduplication of generation requests.
+# Identical requests in flight at the same time (the same model, prompt and
+# settings, billed to the same API key) are sent once: the first caller
+# starts the call and later ones attach to it, and all of them get its
+# result or its error. Calls run on a shared background event loop because
+# callers come from different sessions, each on its own loop and thread.
+# A caller that is cancelled only detaches; the call itself is cancelled
+# when its last caller goes. Finished calls are forgotten at once, so this
+# never serves a stale result.
+import asyncio
+import json
+import threading
+import time
+
+from services.blobs import content_hash
+from services.metrics import COALESCED_REQUESTS
+
+# Payload fields that only affect scheduling or bookkeeping, not the result
+IGNORED_FIELDS = ('flow', 'weight', 'task')
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='single-flight', daemon=True).start()
+        return _loop
+
+
+# Key of a request: its kind, payload (minus IGNORED_FIELDS) and the API
+# keys it may bill to, as a hash of canonical JSON
+def request_key(kind, payload, api_keys):
+    request = {name: value for name, value in payload.items() if name not in IGNORED_FIELDS}
+    text = json.dumps([kind, request, sorted(api_keys.items())], sort_keys=True, separators=(',', ':'), default=str)
+    return content_hash(text.encode('utf-8'))
+
+
+class _Call:
+    def __init__(self, future):
+        self.future = future
+        self.callers = 1
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def _forget(self, key, call):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    # Await start() (a coroutine factory) for `key`, or the identical call
+    # already in flight. A caller that joins such a call has
+    # on_coalesced(seconds waited, ok) called when it finishes.
+    async def run(self, kind, key, start, on_coalesced=None):
+        with self._lock:
+            call = self._calls.get(key)
+            coalesced = call is not None
+            if call is None:
+                call = self._calls[key] = _Call(asyncio.run_coroutine_threadsafe(start(), _background_loop()))
+                call.future.add_done_callback(lambda future: self._forget(key, call))
+            else:
+                call.callers += 1
+                self.coalesced += 1
+                COALESCED_REQUESTS.inc(kind)
+        started = time.perf_counter()
+        try:
+            result = await asyncio.shield(asyncio.wrap_future(call.future))
+        except asyncio.CancelledError:
+            with self._lock:
+                call.callers -= 1
+                if call.callers == 0:
+                    call.future.cancel()  # runs _forget before anyone else can join
+            raise
+        except Exception:
+            if coalesced and on_coalesced is not None:
+                on_coalesced(time.perf_counter() - started, False)
+            raise
+        if coalesced and on_coalesced is not None:
+            on_coalesced(time.perf_counter() - started, True)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._calls), 'coalesced': self.coalesced}
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+# Process-wide single-flight table shared by all sessions
+def get_single_flight():
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+        return _single_flight
@@ -0,0 +1,127 @@
+# Speculative generation of the first plan elements.
+# While the user is still filling in the form, the concept elements every
+# later step depends on are requested in the background once the prompt has
+# stayed unchanged for SETTLE_SECONDS. A submit with the same inputs adopts
+# the result, finished or still in flight; a changed prompt cancels and
+# discards it. Guardrails keep wasted spend bounded: a per-session limit on
+# speculative calls in a rolling window, a per-session cap on the estimated
+# cost of discarded calls, and a process-wide limit on concurrent
+# speculative calls (later ones wait for a slot).
+import asyncio
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+from services.metrics import SPECULATION_WASTED_USD, SPECULATIONS, log_event
+
+SPECULATIVE_ELEMENTS = ('game_concept', 'world_concept')
+SETTLE_SECONDS = float(os.environ.get('GAMEDEV_SPECULATION_SETTLE', '1.5'))
+MIN_PROMPT_CHARS = 20
+SESSION_LIMIT = int(os.environ.get('GAMEDEV_SPECULATION_LIMIT', '10'))
+SESSION_WINDOW = 3600.0
+MAX_WASTE_USD = float(os.environ.get('GAMEDEV_SPECULATION_MAX_WASTE_USD', '0.25'))
+MAX_CONCURRENT = int(os.environ.get('GAMEDEV_SPECULATION_CONCURRENCY', '8'))
+
+# One speculative call: `key` identifies its inputs, `start()` returns the
+# coroutine to run and `cost` is its estimated spend in USD
+SpeculativeCall = namedtuple('SpeculativeCall', ['element', 'key', 'start', 'cost'])
+
+_loop = None
+_loop_lock = threading.Lock()
+_slots = asyncio.Semaphore(MAX_CONCURRENT)
+
+
+# Event loop thread shared by every session's speculative calls
+def _background_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='speculation', daemon=True).start()
+        return _loop
+
+
+class _Entry:
+    def __init__(self, call):
+        self.call = call
+        self.started = False
+        self.go = asyncio.Event()
+        self.future = None
+
+
+class Speculator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._scheduled = deque()
+        self.wasted_usd = 0.0
+        self.counts = {'started': 0, 'hit': 0, 'miss': 0, 'discarded': 0, 'skipped': 0}
+
+    def _count(self, element, outcome):
+        self.counts[outcome] += 1
+        SPECULATIONS.inc(element, outcome)
+
+    async def _run(self, entry):
+        try:
+            await asyncio.wait_for(entry.go.wait(), SETTLE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        async with _slots:
+            with self._lock:
+                entry.started = True
+                self._count(entry.call.element, 'started')
+            return await entry.call.start()
+
+    def _discard(self, entry):
+        entry.future.cancel()
+        self._count(entry.call.element, 'discarded')
+        if entry.started:
+            self.wasted_usd += entry.call.cost
+            SPECULATION_WASTED_USD.inc(amount=entry.call.cost)
+
+    # Make `calls` the session's current speculation: start the new ones and
+    # cancel any whose inputs no longer match
+    def propose(self, calls):
+        keys = {call.key for call in calls}
+        now = time.monotonic()
+        with self._lock:
+            for key in [key for key in self._entries if key not in keys]:
+                self._discard(self._entries.pop(key))
+            while self._scheduled and now - self._scheduled[0] > SESSION_WINDOW:
+                self._scheduled.popleft()
+            for call in calls:
+                if call.key in self._entries:
+                    continue
+                if len(self._scheduled) >= SESSION_LIMIT or self.wasted_usd >= MAX_WASTE_USD:
+                    self._count(call.element, 'skipped')
+                    log_event('speculation_skipped', element=call.element, scheduled=len(self._scheduled),
+                              wasted_usd=round(self.wasted_usd, 4))
+                    continue
+                entry = _Entry(call)
+                entry.future = asyncio.run_coroutine_threadsafe(self._run(entry), _background_loop())
+                self._entries[call.key] = entry
+                self._scheduled.append(now)
+
+    # Future for a speculated result with these inputs (counted as a hit), or
+    # None (a miss). A call still waiting for the prompt to settle starts now.
+    def take(self, element, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            failed = entry is not None and entry.future.done() and (
+                entry.future.cancelled() or entry.future.exception() is not None)
+            if entry is None or failed:
+                self._count(element, 'miss')
+                return None
+            self._count(element, 'hit')
+        _background_loop().call_soon_threadsafe(entry.go.set)
+        return entry.future
+
+    def cancel_all(self):
+        self.propose([])
+
+    def stats(self):
+        with self._lock:
+            decided = self.counts['hit'] + self.counts['miss']
+            return dict(self.counts, in_flight=len(self._entries), wasted_usd=round(self.wasted_usd, 4),
+                        hit_rate=round(self.counts['hit'] / decided, 3) if decided else None)
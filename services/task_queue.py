@@ -0,0 +1,288 @@
+# Durable task queue in SQLite.
+# Generation work (chat, image and music calls) is stored as JSON tasks that
+# any number of worker processes (worker.py) claim with a lease, extend with
+# heartbeats and complete or fail. A task whose worker dies is claimed again
+# once its lease expires, so delivery is at-least-once; failures with a
+# retryable provider status are requeued with backoff up to max_attempts.
+# Claims pick, among runnable tasks, the oldest one of the flow (session)
+# with the fewest tasks running, so one big plan cannot monopolise workers.
+# API keys are stored apart from the payload and erased once a task ends.
+# Workers on other machines can share the queue through a shared volume;
+# set GAMEDEV_QUEUE_JOURNAL=delete there, as WAL needs shared memory.
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from services.blobs import DATA_DIR
+from services.metrics import log_event
+
+QUEUE_PATH = os.environ.get('GAMEDEV_QUEUE_PATH', os.path.join(DATA_DIR, 'tasks.sqlite3'))
+JOURNAL_MODE = os.environ.get('GAMEDEV_QUEUE_JOURNAL', 'wal')
+LEASE_SECONDS = 30.0
+MAX_ATTEMPTS = 3
+RETENTION_SECONDS = 24 * 3600
+POLL_INTERVAL = 0.1
+
+Task = namedtuple('Task', ['id', 'kind', 'flow', 'payload', 'credentials', 'attempts', 'max_attempts'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    flow TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    credentials TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_runnable ON tasks (status, available_at);
+CREATE INDEX IF NOT EXISTS tasks_flow ON tasks (flow, status, lease_expires);
+CREATE INDEX IF NOT EXISTS tasks_owner ON tasks (lease_owner, status);
+"""
+
+# Up to :limit runnable tasks in claim order. Running counts per flow are
+# computed once; a flow's k-th oldest runnable task ranks as if k-1 more of
+# its tasks were already running, which gives the same order as claiming
+# one task at a time from the least-served flow, oldest first.
+CLAIM_QUERY = """
+WITH running AS (
+    SELECT flow, COUNT(*) AS n FROM tasks
+    WHERE status = 'leased' AND lease_expires >= :now
+    GROUP BY flow
+), runnable AS (
+    SELECT id, flow, ROW_NUMBER() OVER (PARTITION BY flow ORDER BY id) AS rank FROM tasks
+    WHERE available_at <= :now AND attempts < max_attempts
+      AND (status = 'queued' OR (status = 'leased' AND lease_expires < :now))
+)
+SELECT r.id FROM runnable AS r LEFT JOIN running AS c ON c.flow = r.flow
+ORDER BY COALESCE(c.n, 0) + r.rank, r.id
+LIMIT :limit
+"""
+
+# Expired leases of tasks that workers have already lost too many times
+ABANDON_QUERY = """
+UPDATE tasks SET status = 'failed', error = 'Task abandoned by workers ' || attempts || ' times.',
+    credentials = NULL, finished = :now, lease_owner = NULL
+WHERE status = 'leased' AND lease_expires < :now AND available_at <= :now AND attempts >= max_attempts
+"""
+
+
+class TaskQueue:
+    def __init__(self, path=QUEUE_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = self._db()
+        db.execute(f"PRAGMA journal_mode={JOURNAL_MODE}")
+        db.executescript(SCHEMA)
+
+    # One autocommit connection per thread
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def submit(self, kind, payload, flow='default', credentials=None, max_attempts=MAX_ATTEMPTS):
+        now = time.time()
+        cursor = self._db().execute(
+            "INSERT INTO tasks (kind, flow, payload, credentials, max_attempts, available_at, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (kind, flow, json.dumps(payload), json.dumps(credentials) if credentials else None, max_attempts, now, now)
+        )
+        return cursor.lastrowid
+
+    # Lease up to `limit` runnable tasks to `owner`
+    def claim(self, owner, limit=1, lease=LEASE_SECONDS):
+        db = self._db()
+        tasks = []
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            db.execute(ABANDON_QUERY, {'now': now})
+            for (task_id,) in db.execute(CLAIM_QUERY, {'now': now, 'limit': limit}).fetchall():
+                db.execute(
+                    "UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                    "WHERE id = ?",
+                    (owner, now + lease, task_id)
+                )
+                row = db.execute(
+                    "SELECT id, kind, flow, payload, credentials, attempts, max_attempts FROM tasks WHERE id = ?",
+                    (task_id,)
+                ).fetchone()
+                tasks.append(Task(row[0], row[1], row[2], json.loads(row[3]),
+                                  json.loads(row[4]) if row[4] else {}, row[5], row[6]))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return tasks
+
+    # Extend the leases of all of `owner`'s tasks; returns the ids it still holds
+    def heartbeat(self, owner, lease=LEASE_SECONDS):
+        db = self._db()
+        db.execute("UPDATE tasks SET lease_expires = ? WHERE lease_owner = ? AND status = 'leased'",
+                   (time.time() + lease, owner))
+        return {row[0] for row in db.execute(
+            "SELECT id FROM tasks WHERE lease_owner = ? AND status = 'leased'", (owner,))}
+
+    def complete(self, task_id, owner, result):
+        cursor = self._db().execute(
+            "UPDATE tasks SET status = 'done', result = ?, credentials = NULL, finished = ? "
+            "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (json.dumps(result), time.time(), task_id, owner)
+        )
+        return cursor.rowcount == 1
+
+    # Fail a leased task; with `retry_after` it is requeued if attempts remain
+    def fail(self, task_id, owner, error, retry_after=None):
+        now = time.time()
+        db = self._db()
+        if retry_after is not None:
+            cursor = db.execute(
+                "UPDATE tasks SET status = 'queued', lease_owner = NULL, lease_expires = NULL, available_at = ?, "
+                "error = ? WHERE id = ? AND lease_owner = ? AND status = 'leased' AND attempts < max_attempts",
+                (now + retry_after, error, task_id, owner)
+            )
+            if cursor.rowcount == 1:
+                return True
+        cursor = db.execute(
+            "UPDATE tasks SET status = 'failed', error = ?, credentials = NULL, finished = ? "
+            "WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (error, now, task_id, owner)
+        )
+        return cursor.rowcount == 1
+
+    # Requeue `owner`'s leased tasks without counting the attempt (worker shutdown)
+    def release(self, owner):
+        self._db().execute(
+            "UPDATE tasks SET status = 'queued', lease_owner = NULL, lease_expires = NULL, attempts = attempts - 1 "
+            "WHERE lease_owner = ? AND status = 'leased'",
+            (owner,)
+        )
+
+    def cancel(self, task_ids):
+        if not task_ids:
+            return
+        marks = ','.join('?' * len(task_ids))
+        self._db().execute(
+            f"UPDATE tasks SET status = 'cancelled', credentials = NULL, finished = ? "
+            f"WHERE id IN ({marks}) AND status IN ('queued', 'leased')",
+            (time.time(), *task_ids)
+        )
+
+    # {id: (status, result, error)} for those of `task_ids` that have finished
+    def finished(self, task_ids):
+        results = {}
+        ids = list(task_ids)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            for task_id, status, result, error in self._db().execute(
+                    f"SELECT id, status, result, error FROM tasks WHERE id IN ({marks}) "
+                    f"AND status IN ('done', 'failed', 'cancelled')", chunk):
+                results[task_id] = (status, json.loads(result) if result else None, error)
+        return results
+
+    def purge(self, older_than=RETENTION_SECONDS):
+        self._db().execute("DELETE FROM tasks WHERE status IN ('done', 'failed', 'cancelled') AND finished < ?",
+                           (time.time() - older_than,))
+
+    def counts(self):
+        return dict(self._db().execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+# Process-wide queue handle
+def get_task_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = TaskQueue()
+        return _queue
+
+
+class TaskWatcher:
+    # Resolves the futures of submitted tasks from one polling thread, so
+    # any number of waiting calls costs one query per POLL_INTERVAL
+    def __init__(self, queue):
+        self.queue = queue
+        self._lock = threading.Lock()
+        self._waiting = {}
+        self._wakeup = threading.Event()
+        threading.Thread(target=self._poll, name='task-watcher', daemon=True).start()
+
+    def _poll(self):
+        while True:
+            with self._lock:
+                ids = list(self._waiting)
+            if not ids:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            try:
+                finished = self.queue.finished(ids)
+            except Exception as e:
+                log_event('task_watch_failed', error=str(e))
+                finished = {}
+            for task_id, outcome in finished.items():
+                with self._lock:
+                    waiter = self._waiting.pop(task_id, None)
+                if waiter is not None:
+                    loop, future = waiter
+                    try:
+                        loop.call_soon_threadsafe(_resolve, future, outcome)
+                    except RuntimeError:
+                        pass  # the waiting session's event loop has closed
+            time.sleep(POLL_INTERVAL)
+
+    # Submit a task and wait for its (status, result, error); cancelling the
+    # wait cancels the task
+    async def run(self, kind, payload, flow='default', credentials=None):
+        task_id = await asyncio.to_thread(self.queue.submit, kind, payload, flow, credentials)
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            self._waiting[task_id] = (asyncio.get_running_loop(), future)
+        self._wakeup.set()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            with self._lock:
+                self._waiting.pop(task_id, None)
+            # In a worker thread like submit; it finishes even if this wait is cancelled again
+            await asyncio.to_thread(self.queue.cancel, [task_id])
+            raise
+
+
+def _resolve(future, outcome):
+    if not future.done():
+        future.set_result(outcome)
+
+
+_watcher = None
+
+
+# Process-wide watcher for tasks submitted by this process
+def get_task_watcher():
+    global _watcher
+    queue = get_task_queue()
+    with _queue_lock:
+        if _watcher is None:
+            _watcher = TaskWatcher(queue)
+        return _watcher
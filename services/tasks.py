@@ -0,0 +1,177 @@
+# Generation tasks: the provider calls a plan is made of, as serializable
+# units. Each kind takes a JSON payload and the session's API keys. By
+# default dispatch() runs them in the calling process; with
+# GAMEDEV_TASK_QUEUE=1 it submits them to the durable queue
+# (services/task_queue.py) and waits while worker processes (worker.py) run
+# them, so the UI process only submits and watches. The per-key scheduler
+# then applies within each worker; across workers, claims are balanced per
+# session by the queue. Identical tasks in flight at the same time are sent
+# once (services/singleflight.py).
+import asyncio
+import logging
+import os
+import random
+import socket
+import uuid
+
+from services import providers
+from services.hedging import get_hedger
+from services.metrics import log_event
+from services.providers import ProviderError
+from services.router import PlanReport, current_report, get_router, recorded_call
+from services.scheduler import Flow, current_flow
+from services.singleflight import get_single_flight, request_key
+from services.task_queue import LEASE_SECONDS, get_task_watcher
+
+QUEUE_ENABLED = os.environ.get('GAMEDEV_TASK_QUEUE', '') == '1'
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+RETRY_BACKOFF = 2.0
+IDLE_POLL = 0.2
+
+
+async def chat_task(payload, api_keys):
+    router = get_router()
+    system, prompt = payload['system'], payload['prompt']
+
+    async def call(model):
+        return await recorded_call(router, payload.get('task'), model, prompt,
+                                   lambda m: providers.chat(api_keys, m, system, prompt))
+
+    return await get_hedger().run(call, payload['model'], payload.get('fallback'), payload.get('hedge_pct'))
+
+
+async def image_task(payload, api_keys):
+    async def call(model):
+        return await providers.image(api_keys, model, payload['prompt'], tuple(payload['size']),
+                                     payload.get('steps', 25), payload.get('guidance', 3.0), payload.get('interval', 2.0))
+
+    return await get_hedger().run(call, payload['model'], payload.get('fallback'), payload.get('hedge_pct'))
+
+
+async def music_task(payload, api_keys):
+    return await providers.music(api_keys, payload['prompt'])
+
+
+async def node_task(payload, api_keys):
+    return await providers.workflow_node(api_keys, payload['model'], payload['input'])
+
+
+HANDLERS = {'chat': chat_task, 'image': image_task, 'music': music_task, 'node': node_task}
+
+
+# Run one task in its own context and return its value with the calls it
+# recorded, for the submitting process's plan report
+async def execute(kind, payload, api_keys):
+    report = PlanReport()
+
+    async def run():
+        current_report.set(report)
+        current_flow.set(Flow(payload.get('flow', 'default'), payload.get('weight', 1.0)))
+        return await HANDLERS[kind](payload, api_keys)
+
+    value = await asyncio.ensure_future(run())
+    return {'value': value, 'calls': report.calls}
+
+
+# Run a task, or join the identical one already in flight; raises
+# ProviderError on failure. The call runs on the single-flight loop under
+# the first caller's scheduling flow and plan report; a caller that joins
+# it records a free 'coalesced' call lasting as long as it waited.
+async def dispatch(kind, payload, api_keys):
+    flow, report = current_flow.get(), current_report.get()
+
+    async def start():
+        current_flow.set(flow)
+        current_report.set(report)
+        return await _dispatch(kind, payload, api_keys)
+
+    def coalesced(waited, ok):
+        if report is not None:
+            report.add(payload.get('task') or kind, payload.get('model'), waited, ok, 0, 0, coalesced=True)
+
+    return await get_single_flight().run(kind, request_key(kind, payload, api_keys), start, coalesced)
+
+
+# Run a task here or through the queue
+async def _dispatch(kind, payload, api_keys):
+    if not QUEUE_ENABLED:
+        return await HANDLERS[kind](payload, api_keys)
+    flow = current_flow.get()
+    payload = dict(payload, flow=flow.id, weight=flow.weight)
+    status, result, error = await get_task_watcher().run(kind, payload, flow.id, dict(api_keys))
+    if status != 'done':
+        raise ProviderError(error or f"Generation task {status}.")
+    # Calls ran in a worker: feed them to this process's router and report
+    router = get_router()
+    report = current_report.get()
+    for call in result['calls']:
+        router.record(call['model'], call['latency_s'], call['ok'], call['output_tokens'])
+        if report is not None:
+            report.add(call['task'], call['model'], call['latency_s'], call['ok'],
+                       call['input_tokens'], call['output_tokens'])
+    return result['value']
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+async def _run_task(queue, owner, task):
+    try:
+        result = await execute(task.kind, task.payload, task.credentials)
+    except asyncio.CancelledError:
+        log_event('task_abandoned', task_id=task.id, kind=task.kind)
+        raise
+    except ProviderError as e:
+        retry = e.status in RETRYABLE_STATUSES
+        await asyncio.to_thread(queue.fail, task.id, owner, str(e), _backoff(task) if retry else None)
+        log_event('task_failed', logging.WARNING, task_id=task.id, kind=task.kind, status=e.status,
+                  attempt=task.attempts, retry=retry, error=str(e))
+        return
+    except Exception as e:
+        await asyncio.to_thread(queue.fail, task.id, owner, f"Worker error: {e}", _backoff(task))
+        log_event('task_failed', logging.ERROR, task_id=task.id, kind=task.kind, attempt=task.attempts,
+                  retry=True, error=repr(e))
+        return
+    if not await asyncio.to_thread(queue.complete, task.id, owner, result):
+        log_event('task_result_dropped', task_id=task.id, kind=task.kind)
+
+
+def _backoff(task):
+    return RETRY_BACKOFF * 2 ** (task.attempts - 1) * random.uniform(0.8, 1.2)
+
+
+# Worker main loop: keep up to `slots` tasks running, claiming more as they
+# finish, and renew all leases every lease/3 seconds. Tasks whose lease was
+# lost (expired and reclaimed, or cancelled by the submitter) are stopped.
+async def run_worker(queue, slots, owner=None, stop=None):
+    owner = owner or worker_id()
+    stop = stop or asyncio.Event()
+    running = {}
+    loop = asyncio.get_running_loop()
+    next_heartbeat = loop.time() + LEASE_SECONDS / 3
+    log_event('worker_started', worker=owner, slots=slots)
+    try:
+        while not stop.is_set():
+            if len(running) < slots:
+                for task in await asyncio.to_thread(queue.claim, owner, slots - len(running)):
+                    running[task.id] = asyncio.ensure_future(_run_task(queue, owner, task))
+            if loop.time() >= next_heartbeat:
+                held = await asyncio.to_thread(queue.heartbeat, owner)
+                for task_id in [task_id for task_id in running if task_id not in held]:
+                    running.pop(task_id).cancel()
+                next_heartbeat = loop.time() + LEASE_SECONDS / 3
+            waits = list(running.values())
+            timeout = IDLE_POLL if len(running) < slots else max(0.0, next_heartbeat - loop.time())
+            if waits:
+                await asyncio.wait(waits, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await asyncio.sleep(timeout)
+            for task_id in [task_id for task_id, job in running.items() if job.done()]:
+                running.pop(task_id)
+    finally:
+        # Hand unfinished tasks back to the queue for other workers
+        for job in running.values():
+            job.cancel()
+        await asyncio.to_thread(queue.release, owner)
+        log_event('worker_stopped', worker=owner)
@@ -0,0 +1,142 @@
+# Seamless-tiling validation and repair for generated textures.
+# A texture tiles when its opposite borders continue each other. Two scores
+# are computed with vectorized NumPy:
+#   * seam: mean difference across the wrap-around seams relative to the
+#     typical difference between neighbouring columns/rows inside the image
+#     (<= 1 when the seam is indistinguishable from the interior);
+#   * smooth: relative size of the "smooth" component of the periodic plus
+#     smooth decomposition (Moisan 2011), solved with one FFT; it is ~0 for
+#     an image that is already periodic and grows with edge discontinuity.
+# Near misses (whose smooth component does not dominate) are fixed with
+# offset-and-blend and re-scored; textures dominated by a non-periodic trend,
+# or still failing after the fix, are flagged for regeneration. Passing textures get a mip chain.
+from io import BytesIO
+
+from services.workers import parallel_map
+
+TEXTURE_PREFIX = 'texture_image_'
+
+SEAM_PASS = 1.6
+SMOOTH_PASS = 0.05
+SMOOTH_FIXABLE = 0.75
+MIN_MIP_SIZE = 4
+
+
+def is_texture(name):
+    return name.startswith(TEXTURE_PREFIX)
+
+
+def _to_float(rgb):
+    import numpy as np
+
+    return np.asarray(rgb, dtype=np.float32) / 255.0
+
+
+# Ratio of wrap-around seam difference to the 95th percentile of interior
+# column/row differences (a seam below 1 looks like any other column)
+def seam_score(rgb):
+    import numpy as np
+
+    img = _to_float(rgb)
+    interior_x = np.percentile(np.abs(np.diff(img, axis=1)).mean(axis=(0, 2)), 95)
+    interior_y = np.percentile(np.abs(np.diff(img, axis=0)).mean(axis=(1, 2)), 95)
+    seam_x = np.abs(img[:, 0] - img[:, -1]).mean()
+    seam_y = np.abs(img[0] - img[-1]).mean()
+    return float(max(seam_x / max(interior_x, 1e-6), seam_y / max(interior_y, 1e-6)))
+
+
+# Std of the smooth (non-periodic) component relative to the image std
+def smooth_score(rgb):
+    import numpy as np
+
+    gray = _to_float(rgb).mean(axis=2)
+    height, width = gray.shape
+    boundary = np.zeros_like(gray)
+    boundary[0] += gray[-1] - gray[0]
+    boundary[-1] += gray[0] - gray[-1]
+    boundary[:, 0] += gray[:, -1] - gray[:, 0]
+    boundary[:, -1] += gray[:, 0] - gray[:, -1]
+    q = np.cos(2 * np.pi * np.arange(height) / height)[:, None]
+    r = np.cos(2 * np.pi * np.arange(width) / width)[None, :]
+    denominator = 2 * q + 2 * r - 4
+    denominator[0, 0] = 1
+    spectrum = np.fft.fft2(boundary) / denominator
+    spectrum[0, 0] = 0
+    smooth = np.real(np.fft.ifft2(spectrum))
+    return float(smooth.std() / max(gray.std(), 1e-6))
+
+
+def tiles_seamlessly(seam, smooth):
+    return seam <= SEAM_PASS and smooth <= SMOOTH_PASS
+
+
+# Offset-and-blend: weight the original towards the centre and a half-offset
+# copy (whose edges come from the seamless interior) towards the borders
+def make_seamless(rgb):
+    import numpy as np
+
+    img = np.asarray(rgb, dtype=np.float32)
+    height, width = img.shape[:2]
+    shifted = np.roll(img, (height // 2, width // 2), axis=(0, 1))
+    wy = np.sin(np.linspace(0, np.pi, height))
+    wx = np.sin(np.linspace(0, np.pi, width))
+    weight = (np.outer(wy, wx) ** 0.5)[..., None]
+    return np.clip(img * weight + shifted * (1 - weight), 0, 255).astype(np.uint8)
+
+
+# Mip levels from the largest power of two that fits down to MIN_MIP_SIZE
+def mip_chain(rgb):
+    from PIL import Image
+
+    image = Image.fromarray(rgb)
+    size = 1 << (min(image.size).bit_length() - 1)
+    levels = []
+    while size >= MIN_MIP_SIZE:
+        image = image.resize((size, size), Image.LANCZOS)
+        levels.append((size, image))
+        size //= 2
+    return levels
+
+
+def _png(image):
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+# Worker entry point: validate, fix if needed and build mips for one texture.
+# Returns a dict with status 'seamless', 'fixed' or 'failed'; bytes that do
+# not decode as an image (e.g. an HTML error page) fail with an 'error'.
+def process_texture(item):
+    import numpy as np
+    from PIL import Image
+
+    name, data = item
+    try:
+        rgb = np.asarray(Image.open(BytesIO(data)).convert('RGB'))
+    except Exception as e:
+        return {'name': name, 'seam': None, 'smooth': None, 'status': 'failed', 'error': f"Not a readable image: {e}"}
+    seam, smooth = seam_score(rgb), smooth_score(rgb)
+    result = {'name': name, 'seam': round(seam, 3), 'smooth': round(smooth, 3), 'status': 'seamless'}
+
+    if not tiles_seamlessly(seam, smooth):
+        if smooth > SMOOTH_FIXABLE:
+            result['status'] = 'failed'
+            return result
+        rgb = make_seamless(rgb)
+        seam, smooth = seam_score(rgb), smooth_score(rgb)
+        result.update(fixed_seam=round(seam, 3), fixed_smooth=round(smooth, 3))
+        if not tiles_seamlessly(seam, smooth):
+            result['status'] = 'failed'
+            return result
+        result['status'] = 'fixed'
+
+    result['image'] = _png(Image.fromarray(rgb))
+    result['mips'] = {size: _png(level) for size, level in mip_chain(rgb)}
+    return result
+
+
+# Process {name: png bytes} textures in the worker pool
+def process_textures(images):
+    items = [(name, data) for name, data in images.items() if is_texture(name)]
+    return {result['name']: result for result in parallel_map(process_texture, items)}
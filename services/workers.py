@@ -0,0 +1,38 @@
+# Shared process pool for CPU-heavy post-processing (image slicing, texture
+# fixing, hashing, export optimisation, audio decoding).
+# The pool is created lazily once per server process and reused across
+# reruns and sessions so worker start-up (interpreter + NumPy import) is
+# only paid once. Workers are spawned rather than forked because the
+# Streamlit server is multi-threaded.
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+MAX_WORKERS = int(os.environ.get('GAMEDEV_WORKERS', '0')) or max(1, min(8, (os.cpu_count() or 2) - 1))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+# Map `func` over `items`, in the pool when there is enough work to pay for it
+def parallel_map(func, items, min_parallel=2):
+    items = list(items)
+    if len(items) < min_parallel or MAX_WORKERS == 1:
+        return [func(item) for item in items]
+    return list(get_process_pool().map(func, items))
+
+
+@atexit.register
+def _shutdown():
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,192 @@
+# Execution of canvas workflows (services/graph.py).
+# A run works on a copy of the graph taken when it starts. Each node's model
+# is called as soon as every node feeding it has finished, so independent
+# branches run concurrently; runs from all sessions share one background
+# event loop, so the script thread only starts them and reads their status.
+# Text nodes are given their prompt, image nodes the output of the node
+# feeding them or their own input image, uploaded to Replicate through
+# services/input_media.py so repeated runs reuse the same file. A node that
+# fails or is cancelled skips everything downstream of it.
+# Every status change bumps the run's version; changes_since(v) returns only
+# the nodes that changed after v, which the canvas streams to the browser.
+import asyncio
+import logging
+import threading
+import time
+import uuid
+
+from services.graph import GraphError
+from services.input_media import get_input_media
+from services.metrics import log_event
+from services.providers import ProviderError
+from services.scheduler import current_flow
+from services.tasks import dispatch
+
+STATES = ('queued', 'running', 'done', 'failed', 'skipped', 'cancelled')
+FINAL_STATES = ('done', 'failed', 'skipped', 'cancelled')
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='workflows', daemon=True).start()
+        return _loop
+
+
+# First URL in a model output (a URL or a list of them)
+def output_url(output):
+    if isinstance(output, (list, tuple)):
+        output = next((item for item in output if isinstance(item, str)), None)
+    return output if isinstance(output, str) else None
+
+
+# Replicate file URL of the node's uploaded input image (a blob hash),
+# uploaded once and reused while it is valid
+async def uploaded_image(params, api_keys):
+    if not params.get('input_image'):
+        return None
+    return await get_input_media().file_url(api_keys, params['input_image'], params.get('input_image_type') or 'image/png')
+
+
+# Model input for a node from its properties, the outputs feeding it and
+# the URL of its uploaded image
+def node_input(spec, params, upstream, uploaded=None):
+    if spec.input_type == 'image':
+        image = next((url for url in upstream if url), None) or uploaded
+        if not image:
+            raise ProviderError("No input image: connect an image node or upload one.")
+        model_input = {'image': image}
+    else:
+        prompt = (params.get('prompt') or '').strip()
+        if not prompt:
+            raise ProviderError("No prompt set.")
+        model_input = {'prompt': prompt}
+    for name, target in spec.inputs.items():
+        value = params.get(name)
+        if value in (None, ''):
+            continue
+        if isinstance(target, tuple):
+            try:
+                model_input.update(zip(target, (int(part) for part in str(value).lower().split('x'))))
+            except ValueError:
+                raise ProviderError(f"Invalid {name}: {value}")
+        else:
+            model_input[target] = value
+    return model_input
+
+
+class WorkflowRun:
+    # `catalogue` maps node kinds to presets.AINode
+    def __init__(self, graph, catalogue, api_keys):
+        snapshot, self.order = graph.ordered_snapshot()
+        self.nodes = {node['id']: {'kind': node['kind'], 'params': node['params']} for node in snapshot['nodes']}
+        self.predecessors = {node_id: [] for node_id in self.nodes}
+        for edge in snapshot['edges']:
+            self.predecessors[edge['target']].append(edge['source'])
+        self.id = uuid.uuid4().hex[:8]
+        self.catalogue = catalogue
+        self.api_keys = dict(api_keys)
+        self.started = time.time()
+        self.version = 0
+        self.statuses = {node_id: {'state': 'queued'} for node_id in self.order}
+        self._changed = dict.fromkeys(self.order, 0)
+        self._lock = threading.Lock()
+        self._tasks = {}
+        self._future = None
+
+    def _set(self, node_id, **status):
+        with self._lock:
+            self.version += 1
+            self.statuses[node_id] = status
+            self._changed[node_id] = self.version
+
+    # Statuses of the nodes that changed after `version`
+    def changes_since(self, version):
+        with self._lock:
+            return {node_id: dict(self.statuses[node_id]) for node_id, changed in self._changed.items() if changed > version}
+
+    @property
+    def finished(self):
+        return self._future is not None and self._future.done()
+
+    def counts(self):
+        with self._lock:
+            counts = dict.fromkeys(STATES, 0)
+            for status in self.statuses.values():
+                counts[status['state']] += 1
+            return counts
+
+    def outputs(self):
+        with self._lock:
+            return {node_id: status['output'] for node_id, status in self.statuses.items() if status.get('output')}
+
+    def start(self, flow=None):
+        self._future = asyncio.run_coroutine_threadsafe(self._run(flow), _background_loop())
+        return self
+
+    # Cancel the given nodes (and so everything downstream), or the whole run
+    def cancel(self, node_ids=None):
+        def cancel():
+            for node_id in node_ids or list(self._tasks):
+                task = self._tasks.get(node_id)
+                if task is not None:
+                    task.cancel()
+        _background_loop().call_soon_threadsafe(cancel)
+
+    async def _run(self, flow):
+        if flow is not None:
+            current_flow.set(flow)
+        self._tasks = {node_id: asyncio.ensure_future(self._node(node_id)) for node_id in self.order}
+        await asyncio.wait(self._tasks.values())
+
+    async def _node(self, node_id):
+        try:
+            upstream = []
+            for source in self.predecessors[node_id]:
+                task = self._tasks[source]
+                await asyncio.wait([task])
+                if task.cancelled() or task.exception() is not None or self.statuses[source]['state'] != 'done':
+                    self._set(node_id, state='skipped', error=f"{source} did not finish")
+                    return None
+                upstream.append(task.result())
+            spec = self.catalogue[self.nodes[node_id]['kind']]
+            started = time.perf_counter()
+            self._set(node_id, state='running')
+            params = self.nodes[node_id]['params']
+            uploaded = None
+            if spec.input_type == 'image' and not any(upstream):
+                uploaded = await uploaded_image(params, self.api_keys)
+            model_input = node_input(spec, params, upstream, uploaded)
+            output = await dispatch('node', {'model': spec.model, 'input': model_input}, self.api_keys)
+        except asyncio.CancelledError:
+            self._set(node_id, state='cancelled')
+            raise
+        except ProviderError as e:
+            self._set(node_id, state='failed', error=str(e))
+            return None
+        except Exception as e:
+            # Anything else still fails the node, so its downstream nodes are skipped
+            log_event('workflow_node_failed', logging.WARNING, run=self.id, node=node_id, error=str(e))
+            self._set(node_id, state='failed', error=str(e))
+            return None
+        url = output_url(output)
+        if url is None:
+            self._set(node_id, state='failed', error="The model returned no output URL.")
+            return None
+        self._set(node_id, state='done', output=url, seconds=round(time.perf_counter() - started, 2))
+        return url
+
+
+# Start running `graph`; raises GraphError if it cannot run
+def start_workflow(graph, catalogue, api_keys, flow=None):
+    if not graph.nodes:
+        raise GraphError("The workflow is empty.")
+    unknown = sorted({node['kind'] for node in graph.nodes.values()} - set(catalogue))
+    if unknown:
+        raise GraphError(f"Unknown node kinds: {', '.join(unknown)}")
+    return WorkflowRun(graph, catalogue, api_keys).start(flow)
@@ -0,0 +1,39 @@
+# Generation worker: runs the chat, image and music tasks that the app
+# submits to the durable task queue when started with GAMEDEV_TASK_QUEUE=1.
+# Start as many as needed, on this machine or on others that mount the same
+# GAMEDEV_DATA_DIR (or GAMEDEV_QUEUE_PATH):
+#
+#     python worker.py --slots 8
+#
+# Each worker runs up to --slots tasks at once; stopping it (Ctrl+C or
+# SIGTERM) hands its unfinished tasks back to the queue.
+import argparse
+import asyncio
+import os
+import signal
+
+from services.metrics import start_http_server
+from services.task_queue import get_task_queue
+from services.tasks import run_worker
+
+
+async def main(slots, purge):
+    queue = get_task_queue()
+    if purge:
+        queue.purge()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+    await run_worker(queue, slots, stop=stop)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run generation tasks from the durable task queue.")
+    parser.add_argument("--slots", type=int, default=int(os.environ.get('GAMEDEV_WORKER_SLOTS', '8')),
+                        help="tasks run concurrently by this worker")
+    parser.add_argument("--metrics-port", type=int, default=0, help="serve Prometheus metrics on this port")
+    parser.add_argument("--no-purge", action="store_true", help="keep finished tasks older than a day")
+    args = parser.parse_args()
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+    asyncio.run(main(args.slots, not args.no_purge))